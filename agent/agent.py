@@ -5,6 +5,7 @@ from typing import Any, Optional
 import tkinter as tk
 from tkinter import simpledialog, scrolledtext, messagebox
 
+import aiolimiter
 import tiktoken
 from beartype import beartype
 
@@ -19,6 +20,7 @@ from browser_env.actions import (
 )
 from browser_env.utils import Observation, StateInfo
 from llms import (
+    acall_llm,
     call_llm,
     generate_from_huggingface_completion,
     generate_from_openai_chat_completion,
@@ -125,36 +127,55 @@ class PromptAgent(Agent):
         prompt = self.prompt_constructor.construct(
             trajectory, intent, meta_data
         )
-        lm_config = self.lm_config
         n = 0
         while True:
-            response = call_llm(lm_config, prompt)
-            force_prefix = self.prompt_constructor.instruction[
-                "meta_data"
-            ].get("force_prefix", "")
-            response = f"{force_prefix}{response}"
-            print(f"response: {response}")
+            response = call_llm(self.lm_config, prompt)
             n += 1
-            try:
-                parsed_response = self.prompt_constructor.extract_action(
-                    response
-                )
-                if self.action_set_tag == "id_accessibility_tree":
-                    action = create_id_based_action(parsed_response)
-                elif self.action_set_tag == "playwright":
-                    action = create_playwright_action(parsed_response)
-                else:
-                    raise ValueError(
-                        f"Unknown action type {self.action_set_tag}"
-                    )
-                action["raw_prediction"] = response
-                break
-            except ActionParsingError as e:
-                if n >= lm_config.gen_config["max_retry"]:
-                    action = create_none_action()
-                    action["raw_prediction"] = response
-                    break
+            action = self.parse_response(response, n)
+            if action is not None:
+                return action
 
+    async def anext_action(
+        self,
+        trajectory: Trajectory,
+        intent: str,
+        meta_data: dict[str, Any],
+        limiter: aiolimiter.AsyncLimiter,
+    ) -> Action:
+        """Same as `next_action`, the requests to the model are limited by
+        `limiter`, which is shared by the concurrent episodes"""
+        prompt = self.prompt_constructor.construct(
+            trajectory, intent, meta_data
+        )
+        n = 0
+        while True:
+            response = await acall_llm(self.lm_config, prompt, limiter)
+            n += 1
+            action = self.parse_response(response, n)
+            if action is not None:
+                return action
+
+    def parse_response(self, response: str, n: int) -> Action | None:
+        """Turn the n-th response to the prompt into an action, None if the
+        response can not be parsed and the model should be asked again"""
+        force_prefix = self.prompt_constructor.instruction["meta_data"].get(
+            "force_prefix", ""
+        )
+        response = f"{force_prefix}{response}"
+        print(f"response: {response}")
+        try:
+            parsed_response = self.prompt_constructor.extract_action(response)
+            if self.action_set_tag == "id_accessibility_tree":
+                action = create_id_based_action(parsed_response)
+            elif self.action_set_tag == "playwright":
+                action = create_playwright_action(parsed_response)
+            else:
+                raise ValueError(f"Unknown action type {self.action_set_tag}")
+        except ActionParsingError as e:
+            if n < self.lm_config.gen_config["max_retry"]:
+                return None
+            action = create_none_action()
+        action["raw_prediction"] = response
         return action
 
     def reset(self, test_config_file: str) -> None:
@@ -10,6 +10,42 @@ from llms import lm_config
 from llms.tokenizers import Tokenizer
 from llms.utils import APIInput
 
+# nodes of these roles can be interacted with, they are kept first when the
+# observation is truncated by priority
+INTERACTIVE_ROLES = (
+    "button",
+    "checkbox",
+    "combobox",
+    "link",
+    "listbox",
+    "menuitem",
+    "menuitemcheckbox",
+    "menuitemradio",
+    "option",
+    "radio",
+    "searchbox",
+    "slider",
+    "spinbutton",
+    "switch",
+    "tab",
+    "textbox",
+    "treeitem",
+)
+# the id, the role, the quoted name and the properties of a node line
+NODE_LINE_PATTERN = re.compile(
+    r"^\t*\[(\d+)\] (\S+)"
+    r"(?: ('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")(.*))?"
+)
+FOCUSED_PATTERN = re.compile(r"(?:^| )focused: True(?: |$)")
+# the chat format of Llama-2
+B_INST, E_INST = "[INST]", "[/INST]"
+B_SYS, E_SYS = "<<SYS>>\n", "\n<</SYS>>\n\n"
+BOS, EOS = "<s>", "</s>"
+# the tokens the chat format of OpenAI adds around each message, and for the
+# name of a message
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+
 
 class Instruction(TypedDict):
     """Instruction for constructing prompt"""
@@ -20,6 +56,14 @@ class Instruction(TypedDict):
     meta_data: dict[str, Any]
 
 
+class PromptPrefix(TypedDict):
+    """The static part of the prompt, shared by all the steps"""
+
+    # the chat messages, or the prompt string
+    prompt: str | tuple[dict[str, str], ...]
+    num_tokens: int
+
+
 class PromptConstructor(object):
     def __init__(
         self,
@@ -34,12 +78,15 @@ class PromptConstructor(object):
         instruction["examples"] = [tuple(e) for e in instruction["examples"]]
         self.instruction: Instruction = instruction
         self.tokenizer = tokenizer
+        # keyed by the intro and the examples
+        self.prompt_prefixes: dict[
+            tuple[str, tuple[tuple[str, str], ...]], PromptPrefix
+        ] = {}
 
-    def get_lm_api_input(
-        self, intro: str, examples: list[tuple[str, str]], current: str
+    def build_prompt_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
     ) -> APIInput:
-
-        """Return the require format for an API"""
+        """Return the static part of the prompt, before the observation"""
         message: list[dict[str, str]] | str
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
@@ -59,7 +106,6 @@ class PromptConstructor(object):
                             "content": y,
                         }
                     )
-                message.append({"role": "user", "content": current})
                 return message
             elif self.lm_config.mode == "completion":
                 message = f"{intro}\n\n"
@@ -68,8 +114,6 @@ class PromptConstructor(object):
                     message += f"Observation\n:{example[0]}\n\n"
                     message += f"Action: {example[1]}\n\n"
                 message += "Now make prediction given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Action:"
                 return message
             else:
                 raise ValueError(
@@ -80,9 +124,6 @@ class PromptConstructor(object):
             # https://github.com/facebookresearch/llama/blob/main/llama/generation.py#L320
             if "Llama-2" in self.lm_config.model:
                 if self.lm_config.mode == "chat":
-                    B_INST, E_INST = "[INST]", "[/INST]"
-                    B_SYS, E_SYS = "<<SYS>>\n", "\n<</SYS>>\n\n"
-                    BOS, EOS = "<s>", "</s>"
                     # adding the system message to be the starting of the first example
                     examples = [
                         (
@@ -96,9 +137,6 @@ class PromptConstructor(object):
                             for (x, y) in examples
                         ]
                     )
-                    # add the current observation
-                    message += f"{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
-
                     return message
                 else:
                     raise ValueError("Only chat mode is supported for Llama-2")
@@ -111,6 +149,60 @@ class PromptConstructor(object):
                 f"Provider {self.lm_config.provider} not implemented"
             )
 
+    def get_prompt_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
+    ) -> PromptPrefix:
+        """Build the static part of the prompt and count its tokens once, it
+        is reused by every step"""
+        key = (intro, tuple(examples))
+        if key not in self.prompt_prefixes:
+            prefix = self.build_prompt_prefix(intro, examples)
+            prompt: str | tuple[dict[str, str], ...]
+            if isinstance(prefix, str):
+                prompt = prefix
+                num_tokens = len(self.tokenizer.encode(prefix))
+            else:
+                assert isinstance(prefix, list)
+                prompt = tuple(prefix)
+                num_tokens = self.count_message_tokens(prompt)
+            self.prompt_prefixes[key] = {
+                "prompt": prompt,
+                "num_tokens": num_tokens,
+            }
+        return self.prompt_prefixes[key]
+
+    def count_message_tokens(
+        self, messages: tuple[dict[str, str], ...]
+    ) -> int:
+        """Count the tokens of chat messages with the chat format: every
+        field is encoded and each message and name add a few tokens"""
+        num_tokens = 0
+        for message in messages:
+            num_tokens += TOKENS_PER_MESSAGE
+            for field, value in message.items():
+                num_tokens += len(self.tokenizer.encode(value))
+                if field == "name":
+                    num_tokens += TOKENS_PER_NAME
+        return num_tokens
+
+    def get_lm_api_input(
+        self, intro: str, examples: list[tuple[str, str]], current: str
+    ) -> APIInput:
+
+        """Return the require format for an API"""
+        prefix = self.get_prompt_prefix(intro, examples)["prompt"]
+        if isinstance(prefix, tuple):
+            # chat messages
+            return list(prefix) + [{"role": "user", "content": current}]
+        elif "openai" in self.lm_config.provider:
+            return prefix + f"Observation\n:{current}\n\nAction:"
+        else:
+            # add the current observation
+            return (
+                prefix
+                + f"{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
+            )
+
     def construct(
         self,
         trajectory: Trajectory,
@@ -119,6 +211,118 @@ class PromptConstructor(object):
     ) -> APIInput:
         raise NotImplementedError
 
+    def get_max_obs_length(self) -> int | None:
+        """The token budget of the observation, None if it is not limited"""
+        max_obs_length: int = self.lm_config.gen_config["max_obs_length"]
+        return max_obs_length or None
+
+    def truncate_observation(self, state_info: StateInfo) -> str:
+        """Fit the observation into the budget of `get_max_obs_length`.
+
+        With the "prefix" truncation, the observation is cut after the
+        budget. With the "priority" truncation, whole lines are kept in
+        order of priority until the budget is spent: the focused node, then
+        the interactive nodes, then the tab titles, then the other nodes,
+        each by distance to the viewport and then in page order. The kept
+        lines are printed in their original order. The lines are picked by
+        their estimated costs (see `Tokenizer.count_tokens`), the joined
+        lines are then encoded and the kept lines of the lowest priority are
+        dropped until they fit.
+        """
+        obs = state_info["observation"][self.obs_modality]
+        max_obs_length = self.get_max_obs_length()
+        if max_obs_length is None:
+            return obs  # type: ignore[return-value]
+        truncation = self.lm_config.gen_config.get("obs_truncation", "prefix")
+        if truncation == "prefix":
+            return self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        if truncation != "priority":
+            raise ValueError(f"Unknown observation truncation: {truncation}")
+
+        # a node is printed over several lines when its name has newlines
+        groups: list[list[str]] = []
+        group_node_ids: list[str | None] = []
+        group_tiers: list[int] = []
+        header = True
+        for line in obs.split("\n"):  # type: ignore[union-attr]
+            match = NODE_LINE_PATTERN.match(line)
+            if match:
+                header = False
+            if match or not groups or header:
+                groups.append([])
+                group_node_ids.append(match.group(1) if match else None)
+                # the tab titles are not spent on before the nodes that
+                # can be acted on
+                if match and FOCUSED_PATTERN.search(match.group(4) or ""):
+                    group_tiers.append(0)
+                elif match and match.group(2) in INTERACTIVE_ROLES:
+                    group_tiers.append(1)
+                elif header:
+                    group_tiers.append(2)
+                else:
+                    group_tiers.append(3)
+            groups[-1].append(line)
+
+        # the token counts of the lines are cached by the tokenizer
+        costs = [
+            self.tokenizer.count_tokens("\n".join(group) + "\n")
+            for group in groups
+        ]
+        if sum(costs) <= max_obs_length and (
+            len(self.tokenizer.encode(obs)) <= max_obs_length  # type: ignore[arg-type]
+        ):
+            return obs  # type: ignore[return-value]
+
+        text_meta_data = state_info["info"]["observation_metadata"].get(
+            "text", {}
+        )
+        obs_nodes_info = text_meta_data.get("obs_nodes_info", {})
+        win_height = text_meta_data.get("browser_config", {}).get(
+            "win_height", 0
+        )
+
+        def viewport_distance(node_id: str | None) -> float:
+            if node_id not in obs_nodes_info:
+                return 0.0
+            union_bound = obs_nodes_info[node_id]["union_bound"]
+            if not union_bound:
+                return 0.0
+            _, y, _, height = union_bound
+            return float(max(0.0, -(y + height), y - win_height))
+
+        order = sorted(
+            range(len(groups)),
+            key=lambda idx: (
+                group_tiers[idx],
+                viewport_distance(group_node_ids[idx]),
+                idx,
+            ),
+        )
+        keep = [False] * len(groups)
+        budget = max_obs_length
+        for idx in order:
+            if costs[idx] <= budget:
+                keep[idx] = True
+                budget -= costs[idx]
+        # by priority
+        kept = [idx for idx in order if keep[idx]]
+        while True:
+            truncated = "\n".join(
+                line
+                for idx, group in enumerate(groups)
+                if keep[idx]
+                for line in group
+            )
+            excess = len(self.tokenizer.encode(truncated)) - max_obs_length
+            if excess <= 0:
+                return truncated
+            # the costs are estimates, drop enough of the lowest priority
+            # lines to cover the excess and encode again
+            while excess > 0 and kept:
+                idx = kept.pop()
+                keep[idx] = False
+                excess -= costs[idx]
+
     def map_url_to_real(self, url: str) -> str:
         """Map the urls to their real world counterparts"""
         for i, j in URL_MAPPINGS.items():
@@ -171,10 +375,7 @@ class DirectPromptConstructor(PromptConstructor):
         
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.truncate_observation(state_info)
 
         page = state_info["info"]["page"]
         url = page.url
@@ -229,10 +430,7 @@ class CoTPromptConstructor(PromptConstructor):
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.truncate_observation(state_info)
 
         page = state_info["info"]["page"]
         url = page.url
@@ -294,10 +492,7 @@ class GuidedPromptConstructor(PromptConstructor):
 
         guidance = meta_data["guidance"]
 
-        obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.truncate_observation(state_info)
 
         page = state_info["info"]["page"]
         url = page.url
@@ -33,13 +33,19 @@ from .actions import (
 )
 from .async_envs import AsyncScriptBrowserEnv
 from .envs import ScriptBrowserEnv
+from .media_store import MediaStore
 from .processors import ObservationMetadata
+from .shared_browser import SharedBrowser, SharedBrowserEnv
 from .trajectory import Trajectory
+from .trajectory_log import TrajectoryLog, read_trajectory_log
 from .utils import DetachedPage, StateInfo
 
 __all__ = [
     "ScriptBrowserEnv",
     "AsyncScriptBrowserEnv",
+    "SharedBrowser",
+    "SharedBrowserEnv",
+    "MediaStore",
     "DetachedPage",
     "StateInfo",
     "ObservationMetadata",
@@ -73,4 +79,6 @@ __all__ = [
     "create_stop_action",
     "ActionParsingError",
     "Trajectory",
+    "TrajectoryLog",
+    "read_trajectory_log",
 ]
@@ -1,13 +1,25 @@
 """Script to automatically login each website"""
 import argparse
+import asyncio
 import glob
+import json
 import os
+import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
 from itertools import combinations
 from pathlib import Path
+from typing import Any, Callable, TypedDict
 
-from playwright.sync_api import sync_playwright
+from playwright.async_api import Browser as ABrowser
+from playwright.async_api import BrowserContext as ABrowserContext
+from playwright.async_api import async_playwright
+from playwright.sync_api import (
+    Browser,
+    BrowserContext,
+    Page,
+    sync_playwright,
+)
 
 from browser_env.env_config import (
     ACCOUNTS,
@@ -30,6 +42,143 @@ URLS = [
 ]
 EXACT_MATCH = [True, True, True, True]
 KEYWORDS = ["", "", "Dashboard", "Delete"]
+# the sites checked with a plain HTTP request with the cookies instead of
+# opening a page. Only the sites that redirect a logged out user to the
+# login page on the server: gitlab (to /users/sign_in) and shopping (to
+# /customer/account/login/), otherwise a logged out cookie passes as valid
+HTTP_PROBE = [True, True, False, False]
+# seconds during which the sites of a storage state are not probed again
+# once they were, only the expiry dates of its cookies are checked
+LOGIN_VALIDATION_TTL = 600.0
+
+
+class CookieCheck(TypedDict):
+    cookie_file: str
+    site: str
+    expired: bool
+    latency: float  # seconds
+
+
+def is_login_expired(
+    d_url: str, content: str, url: str, keyword: str, url_exact: bool = True
+) -> bool:
+    """Whether the response to `url` (`d_url` after the redirections) is
+    the one of a logged out user"""
+    if keyword:
+        return keyword not in content
+    else:
+        if url_exact:
+            return d_url != url
+        else:
+            return url not in d_url
+
+
+def is_page_expired(
+    page: Page, url: str, keyword: str, url_exact: bool = True
+) -> bool:
+    """Test whether the cookie of the page is expired"""
+    page.goto(url)
+    page.wait_for_load_state()
+    return is_login_expired(page.url, page.content(), url, keyword, url_exact)
+
+
+def is_site_expired(context: BrowserContext, site: str) -> bool:
+    """Test whether the cookie of the context is expired on the site"""
+    site_idx = SITES.index(site)
+    url = URLS[site_idx]
+    keyword = KEYWORDS[site_idx]
+    url_exact = EXACT_MATCH[site_idx]
+    if HTTP_PROBE[site_idx]:
+        response = context.request.get(url)
+        return is_login_expired(
+            response.url, response.text(), url, keyword, url_exact
+        )
+    page = context.new_page()
+    expired = is_page_expired(page, url, keyword, url_exact)
+    page.close()
+    return expired
+
+
+async def ais_site_expired(context: ABrowserContext, site: str) -> bool:
+    """Async version of `is_site_expired`"""
+    site_idx = SITES.index(site)
+    url = URLS[site_idx]
+    keyword = KEYWORDS[site_idx]
+    url_exact = EXACT_MATCH[site_idx]
+    if HTTP_PROBE[site_idx]:
+        response = await context.request.get(url)
+        return is_login_expired(
+            response.url, await response.text(), url, keyword, url_exact
+        )
+    page = await context.new_page()
+    await page.goto(url)
+    await page.wait_for_load_state()
+    expired = is_login_expired(
+        page.url, await page.content(), url, keyword, url_exact
+    )
+    await page.close()
+    return expired
+
+
+async def acheck_cookie_files(cookie_files: list[str]) -> list[CookieCheck]:
+    """Check the cookie files on all their sites, with one browser and a
+    context per cookie file, all at the same time"""
+
+    async def check_site(
+        context: ABrowserContext, cookie_file: str, site: str
+    ) -> CookieCheck:
+        start = time.monotonic()
+        try:
+            expired = await ais_site_expired(context, site)
+        except Exception:
+            # e.g., the site is down
+            expired = True
+        return {
+            "cookie_file": cookie_file,
+            "site": site,
+            "expired": expired,
+            "latency": time.monotonic() - start,
+        }
+
+    async def check_file(
+        browser: ABrowser, cookie_file: str
+    ) -> list[CookieCheck]:
+        context = await browser.new_context(storage_state=cookie_file)
+        checks = await asyncio.gather(
+            *[
+                check_site(context, cookie_file, site)
+                for site in get_site_comb_from_filepath(cookie_file)
+            ]
+        )
+        await context.close()
+        return list(checks)
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(
+            headless=HEADLESS, slow_mo=SLOW_MO
+        )
+        checks = await asyncio.gather(
+            *[check_file(browser, c_file) for c_file in cookie_files]
+        )
+        await browser.close()
+    return [check for file_checks in checks for check in file_checks]
+
+
+def check_cookie_files(cookie_files: list[str]) -> list[CookieCheck]:
+    """Check the cookie files and print the result and latency per site"""
+    start = time.monotonic()
+    checks = asyncio.run(acheck_cookie_files(cookie_files))
+    for check in checks:
+        status = "expired" if check["expired"] else "valid"
+        print(
+            f"{check['cookie_file']} {check['site']}: {status} "
+            f"({check['latency']:.2f}s)"
+        )
+    print(
+        f"Checked {len(checks)} sites of {len(cookie_files)} cookie files "
+        f"in {time.monotonic() - start:.2f}s"
+    )
+    return checks
 
 
 def is_expired(
@@ -44,27 +193,13 @@ def is_expired(
     browser = playwright.chromium.launch(headless=True, slow_mo=SLOW_MO)
     context = browser.new_context(storage_state=storage_state)
     page = context.new_page()
-    page.goto(url)
-    time.sleep(1)
-    d_url = page.url
-    content = page.content()
+    expired = is_page_expired(page, url, keyword, url_exact)
     context_manager.__exit__()
-    if keyword:
-        return keyword not in content
-    else:
-        if url_exact:
-            return d_url != url
-        else:
-            return url not in d_url
+    return expired
 
 
-def renew_comb(comb: list[str], auth_folder: str = "./.auth") -> None:
-    context_manager = sync_playwright()
-    playwright = context_manager.__enter__()
-    browser = playwright.chromium.launch(headless=HEADLESS)
-    context = browser.new_context()
-    page = context.new_page()
-
+def login_comb(page: Page, comb: list[str]) -> None:
+    """Log in to each site of the combination"""
     if "shopping" in comb:
         username = ACCOUNTS["shopping"]["username"]
         password = ACCOUNTS["shopping"]["password"]
@@ -99,6 +234,14 @@ def renew_comb(comb: list[str], auth_folder: str = "./.auth") -> None:
         page.get_by_test_id("password-field").fill(password)
         page.get_by_test_id("sign-in-button").click()
 
+
+def renew_comb(comb: list[str], auth_folder: str = "./.auth") -> None:
+    context_manager = sync_playwright()
+    playwright = context_manager.__enter__()
+    browser = playwright.chromium.launch(headless=HEADLESS)
+    context = browser.new_context()
+    page = context.new_page()
+    login_comb(page, comb)
     context.storage_state(path=f"{auth_folder}/{'.'.join(comb)}_state.json")
 
     context_manager.__exit__()
@@ -109,6 +252,109 @@ def get_site_comb_from_filepath(file_path: str) -> list[str]:
     return comb
 
 
+def cookies_expired(storage_state: dict[str, Any]) -> bool:
+    """Whether a cookie of the storage state is past its expiry date"""
+    now = time.time()
+    return any(
+        0 <= cookie.get("expires", -1) < now
+        for cookie in storage_state["cookies"]
+    )
+
+
+class LoginService:
+    """Storage states of the site combinations, shared by the tasks of a run.
+
+    The state of a combination is kept in `auth_folder` and reused by every
+    task that needs it. Before it is reused, its cookies are checked, and
+    each site is probed with it unless it was probed (or renewed) in the
+    last `validation_ttl` seconds and no task was logged out since, see
+    `invalidate`. It is only renewed (logged in again) when it expired.
+    Both run in the browser returned by `get_browser`, the browser of the
+    environment, so no browser is launched for the login.
+    """
+
+    def __init__(
+        self,
+        get_browser: Callable[[], Browser],
+        auth_folder: str = "./.auth",
+        validation_ttl: float = LOGIN_VALIDATION_TTL,
+    ) -> None:
+        self.get_browser = get_browser
+        self.auth_folder = Path(auth_folder)
+        self.auth_folder.mkdir(parents=True, exist_ok=True)
+        self.validation_ttl = validation_ttl
+        # when the sites of each combination were last found logged in
+        self.validated: dict[str, float] = {}
+        self.reuses = 0
+        self.renewals = 0
+        self.probes = 0
+
+    def get_state_path(self, comb: list[str]) -> Path:
+        return self.auth_folder / f"{'.'.join(comb)}_state.json"
+
+    def is_expired(self, comb: list[str]) -> bool:
+        state_path = self.get_state_path(comb)
+        if not state_path.exists():
+            return True
+        with open(state_path) as f:
+            storage_state = json.load(f)
+        if cookies_expired(storage_state):
+            return True
+        validated = self.validated.get(".".join(comb))
+        if (
+            validated is not None
+            and time.monotonic() - validated < self.validation_ttl
+        ):
+            return False
+
+        self.probes += 1
+        context = self.get_browser().new_context(storage_state=storage_state)
+        try:
+            expired = any(is_site_expired(context, site) for site in comb)
+        finally:
+            context.close()
+        if not expired:
+            self.validated[".".join(comb)] = time.monotonic()
+        return expired
+
+    def invalidate(self, comb: list[str]) -> None:
+        """Probe the sites of the combination before its next reuse, e.g.,
+        after a task was logged out from them"""
+        self.validated.pop(".".join(comb), None)
+
+    def renew(self, comb: list[str]) -> None:
+        context = self.get_browser().new_context()
+        try:
+            login_comb(context.new_page(), comb)
+            storage_state = context.storage_state()
+        finally:
+            context.close()
+        # other processes may read the state at the same time
+        state_path = self.get_state_path(comb)
+        tmp_path = state_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(storage_state, f)
+        os.replace(tmp_path, state_path)
+        self.validated[".".join(comb)] = time.monotonic()
+
+    def get_storage_state(self, comb: list[str]) -> str:
+        """Return the path of a valid storage state of the combination"""
+        if self.is_expired(comb):
+            self.renew(comb)
+            self.renewals += 1
+        else:
+            self.reuses += 1
+        return str(self.get_state_path(comb))
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "reuses": self.reuses,
+            "renewals": self.renewals,
+            "probes": self.probes,
+        }
+
+
 def main(auth_folder: str = "./.auth") -> None:
     pairs = list(combinations(SITES, 2))
 
@@ -127,30 +373,30 @@ def main(auth_folder: str = "./.auth") -> None:
         for site in SITES:
             executor.submit(renew_comb, [site], auth_folder=auth_folder)
 
-    futures = []
     cookie_files = list(glob.glob(f"{auth_folder}/*.json"))
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for c_file in cookie_files:
-            comb = get_site_comb_from_filepath(c_file)
-            for cur_site in comb:
-                url = URLS[SITES.index(cur_site)]
-                keyword = KEYWORDS[SITES.index(cur_site)]
-                match = EXACT_MATCH[SITES.index(cur_site)]
-                future = executor.submit(
-                    is_expired, Path(c_file), url, keyword, match
-                )
-                futures.append(future)
-
-    for i, future in enumerate(futures):
-        assert not future.result(), f"Cookie {cookie_files[i]} expired."
+    for check in check_cookie_files(cookie_files):
+        assert not check[
+            "expired"
+        ], f"Cookie {check['cookie_file']} expired on {check['site']}."
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--site_list", nargs="+", default=[])
     parser.add_argument("--auth_folder", type=str, default="./.auth")
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="only check whether the cookie files of the auth folder expired",
+    )
     args = parser.parse_args()
-    if not args.site_list:
+    if args.validate:
+        checks = check_cookie_files(
+            list(glob.glob(f"{args.auth_folder}/*.json"))
+        )
+        if any(check["expired"] for check in checks):
+            sys.exit(1)
+    elif not args.site_list:
         main()
     else:
         if "all" in args.site_list:
@@ -0,0 +1,566 @@
+"""Compact, array-backed representation of the accessibility tree"""
+import re
+from collections.abc import Iterator, Mapping
+from typing import Any, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from .constants import IGNORED_ACTREE_PROPERTIES, IGNORED_UNNAMED_ROLES
+from .utils import AccessibilityTree
+
+STATIC_TEXT_PATTERN = re.compile(r"\[\d+\] StaticText (.+)", re.DOTALL)
+
+
+def format_node(
+    node_id: str, role: Any, name: str, properties: str, has_backend: bool
+) -> tuple[str | None, bool]:
+    node_str = f"[{node_id}] {role} {repr(name)}"
+    if properties:
+        node_str += " " + properties
+
+    # empty generic node
+    if not name.strip():
+        if not properties:
+            if role in IGNORED_UNNAMED_ROLES:
+                return None, False
+        elif role in ["listitem"]:
+            return None, False
+
+    # nodes without backend node are printed, but their children are not
+    # indented and they can not be interacted with
+    return node_str, has_backend
+
+
+class CompactAccessibilityTree:
+    """Struct-of-arrays storage of the accessibility tree.
+
+    Node `i` has the CDP node id `node_ids[i]`. Its role and name are indices
+    into the interned `roles` and `names` tables, and its children are
+    `child_indices[child_offsets[i]:child_offsets[i + 1]]`. Bounds are rows
+    of a float32 array, NaN when the node has no bound. Nodes whose role,
+    name or properties can not be read are `malformed` and never printed.
+    """
+
+    __slots__ = (
+        "node_ids",
+        "backend_ids",
+        "role_ids",
+        "name_ids",
+        "roles",
+        "names",
+        "properties",
+        "malformed",
+        "parent",
+        "child_offsets",
+        "child_indices",
+        "bounds",
+    )
+
+    def __init__(
+        self,
+        node_ids: list[str],
+        backend_ids: npt.NDArray[np.int64],
+        role_ids: npt.NDArray[np.int32],
+        name_ids: npt.NDArray[np.int32],
+        roles: list[Any],
+        names: list[Any],
+        properties: list[str],
+        malformed: npt.NDArray[np.bool_],
+        parent: npt.NDArray[np.int32],
+        child_offsets: npt.NDArray[np.int32],
+        child_indices: npt.NDArray[np.int32],
+        bounds: npt.NDArray[np.float32],
+    ) -> None:
+        self.node_ids = node_ids
+        # -1 if the node has no backend DOM node
+        self.backend_ids = backend_ids
+        self.role_ids = role_ids
+        self.name_ids = name_ids
+        self.roles = roles
+        self.names = names
+        # the formatted properties of each node, joined by spaces
+        self.properties = properties
+        self.malformed = malformed
+        # -1 for the root
+        self.parent = parent
+        self.child_offsets = child_offsets
+        self.child_indices = child_indices
+        self.bounds = bounds
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @classmethod
+    def from_cdp_nodes(
+        cls, nodes: AccessibilityTree
+    ) -> "CompactAccessibilityTree":
+        """Build the tree from the nodes of `Accessibility.getFullAXTree`"""
+        # a few nodes are repeated in the accessibility tree
+        node_id_to_idx: dict[str, int] = {}
+        unique_nodes: AccessibilityTree = []
+        for node in nodes:
+            if node["nodeId"] not in node_id_to_idx:
+                node_id_to_idx[node["nodeId"]] = len(unique_nodes)
+                unique_nodes.append(node)
+
+        num_nodes = len(unique_nodes)
+        backend_ids = [-1] * num_nodes
+        role_ids = [-1] * num_nodes
+        name_ids = [-1] * num_nodes
+        malformed = [False] * num_nodes
+        parent = [-1] * num_nodes
+        role_table: dict[Any, int] = {}
+        name_table: dict[Any, int] = {}
+        properties = []
+        child_offsets = [0]
+        child_indices: list[int] = []
+
+        for idx, node in enumerate(unique_nodes):
+            if "backendDOMNodeId" in node:
+                backend_ids[idx] = int(node["backendDOMNodeId"])
+            if node.get("parentId") in node_id_to_idx:
+                parent[idx] = node_id_to_idx[node["parentId"]]
+            child_indices.extend(
+                node_id_to_idx[child_id]
+                for child_id in node["childIds"]
+                if child_id in node_id_to_idx
+            )
+            child_offsets.append(len(child_indices))
+
+            node_properties = []
+            try:
+                role = node["role"]["value"]
+                name = node["name"]["value"]
+                for property in node.get("properties", []):
+                    try:
+                        if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                            continue
+                        node_properties.append(
+                            f'{property["name"]}: {property["value"]["value"]}'
+                        )
+                    except KeyError:
+                        pass
+                # names that are not strings can not be printed
+                name.strip()
+                role_ids[idx] = role_table.setdefault(role, len(role_table))
+                name_ids[idx] = name_table.setdefault(name, len(name_table))
+            except Exception:
+                malformed[idx] = True
+                node_properties = []
+            properties.append(" ".join(node_properties))
+
+        return cls(
+            node_ids=list(node_id_to_idx),
+            backend_ids=np.array(backend_ids, dtype=np.int64),
+            role_ids=np.array(role_ids, dtype=np.int32),
+            name_ids=np.array(name_ids, dtype=np.int32),
+            roles=list(role_table),
+            names=list(name_table),
+            properties=properties,
+            malformed=np.array(malformed, dtype=np.bool_),
+            parent=np.array(parent, dtype=np.int32),
+            child_offsets=np.array(child_offsets, dtype=np.int32),
+            child_indices=np.array(child_indices, dtype=np.int32),
+            bounds=np.full((num_nodes, 4), np.nan, dtype=np.float32),
+        )
+
+    def copy(self) -> "CompactAccessibilityTree":
+        """A copy with its own bounds, the other arrays are shared"""
+        return CompactAccessibilityTree(
+            node_ids=self.node_ids,
+            backend_ids=self.backend_ids,
+            role_ids=self.role_ids,
+            name_ids=self.name_ids,
+            roles=self.roles,
+            names=self.names,
+            properties=self.properties,
+            malformed=self.malformed,
+            parent=self.parent,
+            child_offsets=self.child_offsets,
+            child_indices=self.child_indices,
+            bounds=np.full_like(self.bounds, np.nan),
+        )
+
+    def get_role(self, idx: int) -> Any:
+        if self.malformed[idx]:
+            return None
+        return self.roles[self.role_ids[idx]]
+
+    def has_role(self, role: str) -> npt.NDArray[np.bool_]:
+        """Whether each node has the given role"""
+        if role not in self.roles:
+            return np.zeros(len(self), dtype=np.bool_)
+        has_role: npt.NDArray[np.bool_] = (
+            self.role_ids == self.roles.index(role)
+        ) & ~self.malformed
+        return has_role
+
+    def get_bound(self, idx: int) -> list[float] | None:
+        bound = self.bounds[idx]
+        if np.isnan(bound).any():
+            return None
+        return [float(x) for x in bound]
+
+    def format_node(self, idx: int) -> tuple[str | None, bool]:
+        """Return the text of the node (None if it is not printed) and
+        whether the node is valid, i.e., its children are indented"""
+        if self.malformed[idx]:
+            return None, False
+        return format_node(
+            self.node_ids[idx],
+            self.roles[self.role_ids[idx]],
+            self.names[self.name_ids[idx]],
+            self.properties[idx],
+            bool(self.backend_ids[idx] >= 0),
+        )
+
+    def prune(self, keep: npt.NDArray[np.bool_]) -> "CompactAccessibilityTree":
+        """Remove the nodes not marked in `keep` from the tree.
+
+        The children of a removed node are spliced into the children of its
+        nearest kept ancestor, at the position of the removed node.
+        """
+        kept = np.flatnonzero(keep)
+        new_index = (np.cumsum(keep) - 1).tolist()
+        keep_list = keep.tolist()
+        child_offsets = self.child_offsets.tolist()
+        child_indices = self.child_indices.tolist()
+
+        parent = [
+            new_index[p] if p >= 0 and keep_list[p] else -1
+            for p in self.parent[kept].tolist()
+        ]
+        new_child_offsets = [0]
+        new_child_indices: list[int] = []
+        for idx in kept.tolist():
+            stack = child_indices[child_offsets[idx] : child_offsets[idx + 1]]
+            stack.reverse()
+            while stack:
+                child = stack.pop()
+                if keep_list[child]:
+                    new_child_indices.append(new_index[child])
+                    parent[new_index[child]] = new_index[idx]
+                else:
+                    grandchildren = child_indices[
+                        child_offsets[child] : child_offsets[child + 1]
+                    ]
+                    stack.extend(reversed(grandchildren))
+            new_child_offsets.append(len(new_child_indices))
+
+        return CompactAccessibilityTree(
+            node_ids=[self.node_ids[idx] for idx in kept.tolist()],
+            backend_ids=self.backend_ids[kept],
+            role_ids=self.role_ids[kept],
+            name_ids=self.name_ids[kept],
+            roles=self.roles,
+            names=self.names,
+            properties=[self.properties[idx] for idx in kept.tolist()],
+            malformed=self.malformed[kept],
+            parent=np.array(parent, dtype=np.int32),
+            child_offsets=np.array(new_child_offsets, dtype=np.int32),
+            child_indices=np.array(new_child_indices, dtype=np.int32),
+            bounds=self.bounds[kept],
+        )
+
+    def serialize(
+        self,
+        subtrees: dict[str, "SerializedSubtree"] | None = None,
+        unchanged: list[bool] | None = None,
+    ) -> tuple[str, "ObsNodesInfo"]:
+        """Serialize the tree into the text observation.
+
+        Nodes are visited depth first with an explicit stack, so deep trees
+        do not hit the recursion limit, and the lines are joined once at the
+        end. A static text already in one of the previous three lines is not
+        printed again.
+
+        With `subtrees`, the lines of the subtree of each node are recorded
+        by node id, and the recorded lines of the nodes marked in
+        `unchanged` are reused when they are at the same depth, see
+        `IncrementalAccessibilityTree`.
+        """
+        # plain lists are much faster to index than arrays
+        node_ids = self.node_ids
+        roles = self.roles
+        names = self.names
+        properties = self.properties
+        malformed = self.malformed.tolist()
+        role_ids = self.role_ids.tolist()
+        name_ids = self.name_ids.tolist()
+        backend_ids = self.backend_ids.tolist()
+        child_offsets = self.child_offsets.tolist()
+        child_indices = self.child_indices.tolist()
+        node_index: dict[str, int] = {}
+        # the lines before the repeated static texts are removed, with the
+        # text of the static texts (None for the other lines)
+        lines: list[str] = []
+        static_texts: list[str | None] = []
+        # the node ids of node_index, in order
+        indexed_ids: list[str] = []
+        id_to_idx: dict[str, int] | None = None
+        starts: dict[int, tuple[int, int]] = {}
+
+        stack = [(0, 0)]
+        while stack:
+            idx, depth = stack.pop()
+            if subtrees is not None:
+                if idx < 0:
+                    # all the lines of the subtree of ~idx are in
+                    idx = ~idx
+                    start, id_start = starts.pop(idx)
+                    subtrees[node_ids[idx]] = SerializedSubtree(
+                        depth,
+                        lines,
+                        static_texts,
+                        start,
+                        len(lines),
+                        indexed_ids,
+                        id_start,
+                        len(indexed_ids),
+                    )
+                    continue
+                assert unchanged is not None
+                subtree = subtrees.get(node_ids[idx])
+                if (
+                    unchanged[idx]
+                    and subtree is not None
+                    and subtree.depth == depth
+                ):
+                    lines.extend(subtree.lines[subtree.start : subtree.end])
+                    static_texts.extend(
+                        subtree.static_texts[subtree.start : subtree.end]
+                    )
+                    subtree_ids = subtree.indexed_ids[
+                        subtree.id_start : subtree.id_end
+                    ]
+                    if id_to_idx is None:
+                        id_to_idx = {
+                            node_id: i for i, node_id in enumerate(node_ids)
+                        }
+                    for node_id in subtree_ids:
+                        node_index[node_id] = id_to_idx[node_id]
+                    indexed_ids.extend(subtree_ids)
+                    continue
+                starts[idx] = (len(lines), len(indexed_ids))
+                stack.append((~idx, depth))
+
+            if malformed[idx]:
+                node_str, valid_node = None, False
+            else:
+                node_str, valid_node = format_node(
+                    node_ids[idx],
+                    roles[role_ids[idx]],
+                    names[name_ids[idx]],
+                    properties[idx],
+                    backend_ids[idx] >= 0,
+                )
+
+            if node_str is not None:
+                for line_idx, line in enumerate(node_str.split("\n")):
+                    if line_idx == 0:
+                        line = "\t" * depth + line
+                    if "statictext" in line.lower():
+                        match = STATIC_TEXT_PATTERN.search(line)
+                        if match:
+                            static_text = match.group(1)[1:-1]
+                            if static_text:
+                                lines.append(line)
+                                static_texts.append(static_text)
+                    else:
+                        lines.append(line)
+                        static_texts.append(None)
+
+            if valid_node:
+                node_index[node_ids[idx]] = idx
+                indexed_ids.append(node_ids[idx])
+
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            for child in reversed(
+                child_indices[child_offsets[idx] : child_offsets[idx + 1]]
+            ):
+                stack.append((child, child_depth))
+
+        # remove statictext if the content already appears in the previous
+        # lines
+        clean_lines: list[str] = []
+        for line, static_text in zip(lines, static_texts):
+            if static_text is None or all(
+                static_text not in prev_line for prev_line in clean_lines[-3:]
+            ):
+                clean_lines.append(line)
+
+        return "\n".join(clean_lines), ObsNodesInfo(self, node_index)
+
+
+class SerializedSubtree(NamedTuple):
+    """The lines of a subtree serialized at `depth`,
+    `lines[start:end]`, and the ids of its printed nodes,
+    `indexed_ids[id_start:id_end]`. The lists are shared by all the subtrees
+    of an observation."""
+
+    depth: int
+    lines: list[str]
+    static_texts: list[str | None]
+    start: int
+    end: int
+    indexed_ids: list[str]
+    id_start: int
+    id_end: int
+
+
+class IncrementalAccessibilityTree:
+    """Serialize the successive accessibility trees of a page, only the
+    subtrees that changed since the last tree are serialized again.
+
+    The nodes are matched by node id, which is stable across fetches. A
+    subtree whose nodes are printed the same and have the same children is
+    serialized to the same lines, which are reused. The result is the same
+    as `CompactAccessibilityTree.serialize`.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the previous trees, the next one is serialized from
+        scratch"""
+        # the CDP nodes of the last tree built and its compact form
+        self.cdp_nodes: AccessibilityTree | None = None
+        self.built_tree: CompactAccessibilityTree | None = None
+        # the last tree serialized
+        self.last_tree: CompactAccessibilityTree | None = None
+        # the lines of the subtrees that did not change since they were
+        # serialized, by node id of their root
+        self.subtrees: dict[str, SerializedSubtree] = {}
+
+    def from_cdp_nodes(
+        self, nodes: AccessibilityTree
+    ) -> CompactAccessibilityTree:
+        """Same as `CompactAccessibilityTree.from_cdp_nodes`, the last tree
+        built is reused if the nodes are the same list"""
+        if nodes is not self.cdp_nodes or self.built_tree is None:
+            self.built_tree = CompactAccessibilityTree.from_cdp_nodes(nodes)
+            self.cdp_nodes = nodes
+        return self.built_tree.copy()
+
+    def serialize(
+        self, tree: CompactAccessibilityTree
+    ) -> tuple[str, "ObsNodesInfo"]:
+        changed = np.flatnonzero(~self.unchanged_nodes(tree))
+        # the subtrees are made of the children of the nodes
+        parent = np.full(len(tree), -1, dtype=np.int64)
+        parent[tree.child_indices] = np.repeat(
+            np.arange(len(tree)), np.diff(tree.child_offsets)
+        )
+        parent_list = parent.tolist()
+        subtree_changed = [False] * len(tree)
+        for idx in changed.tolist():
+            while idx >= 0 and not subtree_changed[idx]:
+                subtree_changed[idx] = True
+                self.subtrees.pop(tree.node_ids[idx], None)
+                idx = parent_list[idx]
+
+        self.last_tree = tree
+        return tree.serialize(
+            self.subtrees, [not is_changed for is_changed in subtree_changed]
+        )
+
+    def unchanged_nodes(
+        self, tree: CompactAccessibilityTree
+    ) -> npt.NDArray[np.bool_]:
+        """Whether each node of the tree is in the last tree, printed the
+        same and with the same children"""
+        last_tree = self.last_tree
+        if last_tree is None or not len(last_tree):
+            return np.zeros(len(tree), dtype=np.bool_)
+        last_index = {
+            node_id: i for i, node_id in enumerate(last_tree.node_ids)
+        }
+        matched = np.array(
+            [last_index.get(node_id, -1) for node_id in tree.node_ids],
+            dtype=np.int64,
+        )
+        unchanged = matched >= 0
+        last = np.where(unchanged, matched, 0)
+
+        def interned(values: list[Any], last_values: list[Any]) -> Any:
+            # the ids of the last values in the current table, -2 for the
+            # missing ones and for -1
+            index = {value: i for i, value in enumerate(values)}
+            return np.array(
+                [index.get(value, -2) for value in last_values] + [-2],
+                dtype=np.int32,
+            )
+
+        last_role_ids = interned(tree.roles, last_tree.roles)
+        last_name_ids = interned(tree.names, last_tree.names)
+        # the malformed nodes are not printed
+        unchanged &= tree.malformed == last_tree.malformed[last]
+        unchanged &= tree.malformed | (
+            (tree.role_ids == last_role_ids[last_tree.role_ids[last]])
+            & (tree.name_ids == last_name_ids[last_tree.name_ids[last]])
+        )
+        unchanged &= (tree.backend_ids >= 0) == (
+            last_tree.backend_ids[last] >= 0
+        )
+        unchanged &= (
+            np.array(tree.properties, dtype=object)
+            == np.array(last_tree.properties, dtype=object)[last]
+        )
+
+        # the children, by node id
+        num_children = np.diff(tree.child_offsets)
+        last_num_children = np.diff(last_tree.child_offsets)
+        unchanged &= num_children == last_num_children[last]
+        if len(tree.child_indices) and len(last_tree.child_indices):
+            owner = np.repeat(np.arange(len(tree)), num_children)
+            same_owner = unchanged[owner]
+            position = (
+                last_tree.child_offsets[last[owner]]
+                + np.arange(len(owner))
+                - tree.child_offsets[owner]
+            )
+            position = np.where(same_owner, position, 0)
+            node_ids = np.array(tree.node_ids, dtype=object)
+            last_node_ids = np.array(last_tree.node_ids, dtype=object)
+            same_child = (
+                node_ids[tree.child_indices]
+                == last_node_ids[last_tree.child_indices[position]]
+            )
+            unchanged[owner[same_owner & ~same_child]] = False
+        return unchanged
+
+
+class ObsNodesInfo(Mapping[str, dict[str, Any]]):
+    """Read-only view of the printed nodes of a compact accessibility tree.
+
+    Behaves like the `obs_nodes_info` dict of the HTML observation, the info
+    of a node is only built when it is read.
+    """
+
+    __slots__ = ("tree", "node_index")
+
+    def __init__(
+        self, tree: CompactAccessibilityTree, node_index: dict[str, int]
+    ) -> None:
+        self.tree = tree
+        self.node_index = node_index
+
+    def __getitem__(self, obs_node_id: str) -> dict[str, Any]:
+        idx = self.node_index[obs_node_id]
+        return {
+            "backend_id": int(self.tree.backend_ids[idx]),
+            "union_bound": self.tree.get_bound(idx),
+            "text": self.tree.format_node(idx)[0],
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.node_index)
+
+    def __len__(self) -> int:
+        return len(self.node_index)
+
+    def __contains__(self, obs_node_id: object) -> bool:
+        return obs_node_id in self.node_index
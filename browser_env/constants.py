@@ -293,3 +293,17 @@ IGNORED_ACTREE_PROPERTIES = (
     "multiline",
     "invalid",
 )
+# nodes of these roles are skipped when they have no name and no properties
+IGNORED_UNNAMED_ROLES = (
+    "generic",
+    "img",
+    "list",
+    "strong",
+    "paragraph",
+    "banner",
+    "navigation",
+    "Section",
+    "LabelText",
+    "Legend",
+    "listitem",
+)
@@ -4,7 +4,7 @@ import time
 from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Callable, Union
 
 import numpy as np
 import numpy.typing as npt
@@ -13,6 +13,7 @@ from beartype.door import is_bearable
 from gymnasium import Env
 from gymnasium.spaces import Box, Text
 from playwright.sync_api import (
+    Browser,
     CDPSession,
     Page,
     Playwright,
@@ -21,8 +22,14 @@ from playwright.sync_api import (
     sync_playwright,
 )
 
-from .actions import Action, execute_action, get_action_space
+from .actions import (
+    Action,
+    ActionTypes,
+    execute_action,
+    get_action_space,
+)
 from .processors import ObservationHandler, ObservationMetadata
+from .settle import get_settle_strategy
 from .utils import (
     AccessibilityTree,
     DetachedPage,
@@ -30,6 +37,15 @@ from .utils import (
     png_bytes_to_numpy,
 )
 
+# the actions that may change the page without any DOM mutation, the
+# observation cache can not tell that the page changed
+UNOBSERVED_CHANGE_ACTION_TYPES = {
+    ActionTypes.SCROLL,
+    ActionTypes.KEY_PRESS,
+    ActionTypes.MOUSE_HOVER,
+    ActionTypes.HOVER,
+}
+
 
 @dataclass
 class PlaywrightScript:
@@ -84,6 +100,14 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
+        bounds_mode: str = "per_node",
+        ax_update_mode: str = "full",
+        verify_ax_cache: bool = False,
+        persistent_browser: bool = False,
+        lazy_image_observation: bool = False,
+        settle_strategy: str = "fixed",
+        cache_observation: bool = False,
+        browser: Browser | None = None,
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -94,6 +118,20 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.viewport_size = viewport_size
         self.save_trace_enabled = save_trace_enabled
         self.sleep_after_execution = sleep_after_execution
+        # sleep_after_execution is the upper bound of the waiting time
+        self.settle_strategy = get_settle_strategy(
+            settle_strategy, sleep_after_execution
+        )
+        self.last_settle_time = 0.0
+        # keep playwright and the browser alive across resets, only the
+        # browser context is recreated for each task
+        self.persistent_browser = persistent_browser
+        # a browser owned by the caller and shared with other environments,
+        # only the context of this environment is closed
+        self.shared_browser = browser
+        self.browser_launches = 0
+        self.context_creations = 0
+        self.browser_running = False
 
         match observation_type:
             case "html" | "accessibility_tree":
@@ -115,19 +153,50 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.image_observation_type,
             self.current_viewport_only,
             self.viewport_size,
+            bounds_mode=bounds_mode,
+            ax_update_mode=ax_update_mode,
+            verify_ax_cache=verify_ax_cache,
+            lazy_image=lazy_image_observation,
+            cache_observation=cache_observation,
         )
 
         self.observation_space = (
             self.observation_handler.get_observation_space()
         )
 
-    @beartype
-    def setup(self, config_file: Path | None = None) -> None:
+    def launch_browser(self) -> None:
         self.context_manager = sync_playwright()
         self.playwright = self.context_manager.__enter__()
         self.browser = self.playwright.chromium.launch(
             headless=self.headless, slow_mo=self.slow_mo
         )
+        self.browser_launches += 1
+        self.browser_running = True
+
+    def close_browser(self) -> None:
+        self.context_manager.__exit__()
+        self.browser_running = False
+
+    def browser_alive(self) -> bool:
+        return self.reset_finished and self.browser.is_connected()
+
+    def get_browser(self) -> Browser:
+        """Return the browser of the environment, launch it if it is not
+        running, e.g., to log in before the first reset"""
+        if self.shared_browser is not None:
+            return self.shared_browser
+        if self.browser_running and not self.browser.is_connected():
+            self.close_browser()
+        if not self.browser_running:
+            self.launch_browser()
+        return self.browser
+
+    @beartype
+    def setup(self, config_file: Path | None = None) -> None:
+        if self.shared_browser is not None:
+            self.browser = self.shared_browser
+        elif not self.browser_running:
+            self.launch_browser()
 
         if config_file:
             with open(config_file, "r") as f:
@@ -145,6 +214,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             geolocation=geolocation,
             device_scale_factor=1,
         )
+        self.context_creations += 1
         if self.save_trace_enabled:
             self.context.tracing.start(screenshots=True, snapshots=True)
         if start_url:
@@ -193,9 +263,26 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         :param options: options for the environment. The current supported options are:
             - "storage_state": the storage state of the browser. It is a file path to a json file.
         """
+        self.start_episode(seed=seed, options=options)
+        self.last_settle_time = self.settle_strategy.wait(self.page)
+        return self.observe_reset()
+
+    def start_episode(
+        self,
+        seed: int | None = None,
+        options: dict[str, str] | None = None,
+    ) -> None:
+        """Open the pages of the task, before the page settles"""
         super().reset(seed=seed, options=options)
+        self.observation_handler.expire_observation()
         if self.reset_finished:
-            self.context_manager.__exit__()
+            if self.shared_browser is not None or (
+                self.persistent_browser and self.browser_alive()
+            ):
+                self.context.close()
+            else:
+                self.close_browser()
+                self.reset_finished = False
 
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
@@ -207,35 +294,70 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.setup()
         self.reset_finished = True
 
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+    def observe_reset(
+        self,
+    ) -> tuple[dict[str, Observation], dict[str, Any]]:
+        return self.fetch_reset_observation()()
 
-        observation = self._get_obs()
-        observation_metadata = self._get_obs_metadata()
-        info = {
+    def fetch_reset_observation(
+        self,
+    ) -> Callable[[], tuple[dict[str, Observation], dict[str, Any]]]:
+        """The browser side of `observe_reset`, return the function that
+        builds the result without the browser"""
+        build_observation = self.observation_handler.fetch_observation(
+            self.page, self.get_page_client(self.page)
+        )
+        text_processor = self.observation_handler.text_processor
+        info: dict[str, Any] = {
             "page": DetachedPage(self.page.url, ""),
             "fail_error": "",
-            "observation_metadata": observation_metadata,
+            "bounds_cdp_calls": text_processor.bounds_cdp_calls,
+            "ax_tree_reused": text_processor.ax_tree_reused,
+            "ax_tree_cache": text_processor.ax_tree_cache_stats,
+            "settle_time": self.last_settle_time,
+            "observation_cache": (
+                self.observation_handler.observation_cache_stats
+            ),
         }
 
-        return (observation, info)
+        def build() -> tuple[dict[str, Observation], dict[str, Any]]:
+            observation = build_observation()
+            info["observation_metadata"] = self._get_obs_metadata()
+            return (observation, info)
+
+        return build
 
     def save_trace(self, trace_path: str | Path) -> None:
         if self.save_trace_enabled:
             self.context.tracing.stop(path=trace_path)
 
     def close(self) -> None:
-        if self.reset_finished:
-            self.context_manager.__exit__()
+        if self.reset_finished and self.shared_browser is not None:
+            self.context.close()
+        if self.browser_running:
+            self.close_browser()
+        self.reset_finished = False
 
     def step(
         self, action: Action
     ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        success, fail_error, action_time = self.act(action)
+        self.last_settle_time = self.settle_strategy.wait(self.page)
+        return self.observe_step(success, fail_error, action_time)
+
+    def act(self, action: Action) -> tuple[bool, str, float]:
+        """Execute the action, return whether it succeeded, the error and
+        the seconds it took"""
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
 
         success = False
         fail_error = ""
+        self.observation_handler.expire_observation()
+        if action["action_type"] in UNOBSERVED_CHANGE_ACTION_TYPES:
+            self.observation_handler.invalidate_observation()
+        self.settle_strategy.before_action(self.page)
+        action_start = time.monotonic()
         try:
             self.page = execute_action(
                 action,
@@ -246,24 +368,61 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             success = True
         except Exception as e:
             fail_error = str(e)
+        action_time = time.monotonic() - action_start
+        return success, fail_error, action_time
 
-        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+    def observe_step(
+        self, success: bool, fail_error: str, action_time: float
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        return self.fetch_step_observation(success, fail_error, action_time)()
 
-        observation = self._get_obs()
-        observation_metadata = self._get_obs_metadata()
+    def fetch_step_observation(
+        self, success: bool, fail_error: str, action_time: float
+    ) -> Callable[
+        [], tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]
+    ]:
+        """The browser side of `observe_step`, return the function that
+        builds the result without the browser"""
+        fetch_start = time.monotonic()
+        build_observation = self.observation_handler.fetch_observation(
+            self.page, self.get_page_client(self.page)
+        )
+        text_processor = self.observation_handler.text_processor
+        page = DetachedPage(self.page.url, self.page.content())
+        fetch_time = time.monotonic() - fetch_start
 
-        info = {
-            "page": DetachedPage(self.page.url, self.page.content()),
+        info: dict[str, Any] = {
+            "page": page,
             "fail_error": fail_error,
-            "observation_metadata": observation_metadata,
+            "bounds_cdp_calls": text_processor.bounds_cdp_calls,
+            "ax_tree_reused": text_processor.ax_tree_reused,
+            "ax_tree_cache": text_processor.ax_tree_cache_stats,
+            "settle_time": self.last_settle_time,
+            "observation_cache": (
+                self.observation_handler.observation_cache_stats
+            ),
         }
-        msg = (
-            observation,
-            float(success),  # reward
-            False,  # terminated
-            False,  # truncated
-            info,
-        )
-        return msg
+
+        def build() -> (
+            tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]
+        ):
+            build_start = time.monotonic()
+            observation = build_observation()
+            info["observation_metadata"] = self._get_obs_metadata()
+            observe_time = fetch_time + time.monotonic() - build_start
+            # seconds spent in each phase of the step
+            info["timings"] = {
+                "action": action_time,
+                "settle": self.last_settle_time,
+                "observe": observe_time,
+            }
+            msg = (
+                observation,
+                float(success),  # reward
+                False,  # terminated
+                False,  # truncated
+                info,
+            )
+            return msg
+
+        return build
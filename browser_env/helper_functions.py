@@ -1,7 +1,7 @@
 import base64
 import io
 import json
-import re
+import os
 from pathlib import Path
 from typing import Any
 
@@ -15,6 +15,7 @@ from browser_env import (
     StateInfo,
     action2str,
 )
+from browser_env.media_store import MediaStore
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -32,6 +33,9 @@ HTML_TEMPLATE = """
     </body>
 </html>
 """
+# the render is written as the head, then the steps as they come, and the
+# tail when it is closed
+HTML_HEAD, HTML_TAIL = HTML_TEMPLATE.format(body="{body}").split("{body}")
 
 
 def get_render_action(
@@ -111,10 +115,20 @@ def get_action_description(
 
 
 class RenderHelper(object):
-    """Helper class to render text and image observations and meta data in the trajectory"""
+    """Helper class to render text and image observations and meta data in the trajectory
+
+    Each step is appended to the render file, which only becomes a complete
+    html document when the helper is closed. With a media store, the
+    screenshots are linked to their file in the store instead of being
+    inlined.
+    """
 
     def __init__(
-        self, config_file: str, result_dir: str, action_set_tag: str
+        self,
+        config_file: str,
+        result_dir: str,
+        action_set_tag: str,
+        media_store: MediaStore | None = None,
     ) -> None:
         with open(config_file, "r") as f:
             _config = json.load(f)
@@ -125,14 +139,17 @@ class RenderHelper(object):
             task_id = _config["task_id"]
 
         self.action_set_tag = action_set_tag
-
-        self.render_file = open(
-            Path(result_dir) / "renders" / f"render_{task_id}.html", "a+"
-        )
-        self.render_file.truncate(0)
+        self.media_store = media_store
+
+        render_path = Path(result_dir) / "renders" / f"render_{task_id}.html"
+        if media_store is not None:
+            # the links are relative, the result dir can be moved
+            self.media_url = Path(
+                os.path.relpath(media_store.folder, render_path.parent)
+            ).as_posix()
+        self.render_file = open(render_path, "w")
         # write init template
-        self.render_file.write(HTML_TEMPLATE.format(body=f"{_config_str}"))
-        self.render_file.read()
+        self.render_file.write(HTML_HEAD + _config_str)
         self.render_file.flush()
 
     def render(
@@ -154,13 +171,20 @@ class RenderHelper(object):
         if render_screenshot:
             # image observation
             img_obs = observation["image"]
-            image = Image.fromarray(img_obs)  # type:ignore
-            byte_io = io.BytesIO()
-            image.save(byte_io, format="PNG")
-            byte_io.seek(0)
-            image_bytes = base64.b64encode(byte_io.read())
-            image_str = image_bytes.decode("utf-8")
-            new_content += f"<img src='data:image/png;base64,{image_str}' style='width:50vw; height:auto;'/>\n"
+            if self.media_store is not None:
+                name = self.media_store.put(img_obs)  # type:ignore
+                image_src = f"{self.media_url}/{name}"
+            else:
+                image = Image.fromarray(img_obs)  # type:ignore
+                byte_io = io.BytesIO()
+                image.save(byte_io, format="PNG")
+                byte_io.seek(0)
+                image_bytes = base64.b64encode(byte_io.read())
+                image_str = image_bytes.decode("utf-8")
+                image_src = f"data:image/png;base64,{image_str}"
+            new_content += (
+                f"<img src='{image_src}' style='width:50vw; height:auto;'/>\n"
+            )
 
         # meta data
         new_content += f"<div class='prev_action' style='background-color:pink'>{meta_data['action_history'][-1]}</div>\n"
@@ -176,16 +200,10 @@ class RenderHelper(object):
         new_content += f"{action_str}\n"
 
         # add new content
-        self.render_file.seek(0)
-        html = self.render_file.read()
-        html_body = re.findall(r"<body>(.*?)</body>", html, re.DOTALL)[0]
-        html_body += new_content
-
-        html = HTML_TEMPLATE.format(body=html_body)
-        self.render_file.seek(0)
-        self.render_file.truncate()
-        self.render_file.write(html)
+        self.render_file.write(new_content)
         self.render_file.flush()
 
     def close(self) -> None:
-        self.render_file.close()
+        if not self.render_file.closed:
+            self.render_file.write(HTML_TAIL)
+            self.render_file.close()
@@ -0,0 +1,103 @@
+"""Content-addressed store of the screenshots of a run"""
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+from PIL import Image
+
+MEDIA_FORMATS = ["webp", "png"]
+
+
+class MediaStore:
+    """Write each distinct screenshot once, as `<sha256>.<format>` in
+    `folder`, and refer to it by its file name.
+
+    The images are encoded and written by a background thread, `put` only
+    hashes the pixels. The first failed write is raised by the next `put`
+    and by `close`. WebP is lossless, so the screenshots are kept
+    exactly, and its files are smaller than PNG.
+    """
+
+    def __init__(self, folder: str | Path, media_format: str = "webp") -> None:
+        if media_format not in MEDIA_FORMATS:
+            raise ValueError(f"Invalid media format: {media_format}")
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.media_format = media_format
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="media"
+        )
+        self.error: BaseException | None = None
+        # the file names written or being written
+        self.names: set[str] = set()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.reuses = 0
+
+    def get_name(self, image: npt.NDArray[np.uint8]) -> str:
+        digest = hashlib.sha256(str(image.shape).encode("utf-8"))
+        digest.update(np.ascontiguousarray(image).data)
+        return f"{digest.hexdigest()}.{self.media_format}"
+
+    def get_path(self, name: str) -> Path:
+        return self.folder / name
+
+    def put(self, image: npt.NDArray[np.uint8]) -> str:
+        """Store the image, return its file name in the store"""
+        name = self.get_name(image)
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            if name in self.names or self.get_path(name).exists():
+                self.names.add(name)
+                self.reuses += 1
+                return name
+            self.names.add(name)
+            self.writes += 1
+            # the caller may reuse the array
+            future = self.executor.submit(self.write, name, image.copy())
+        future.add_done_callback(functools.partial(self.check_write, name))
+        return name
+
+    def check_write(self, name: str, future: Future[None]) -> None:
+        error = future.exception()
+        if error is None:
+            return
+        with self.lock:
+            # written again if it is put again
+            self.names.discard(name)
+            if self.error is None:
+                self.error = error
+
+    def write(self, name: str, image: npt.NDArray[np.uint8]) -> None:
+        # written to a temporary file first, so that a file in the store
+        # is always complete
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if self.media_format == "webp":
+                    Image.fromarray(image).save(
+                        f, format="WEBP", lossless=True
+                    )
+                else:
+                    Image.fromarray(image).save(f, format="PNG")
+            os.replace(tmp_path, self.get_path(name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"writes": self.writes, "reuses": self.reuses}
+
+    def close(self) -> None:
+        """Wait for the pending writes, raise the error of a failed one"""
+        self.executor.shutdown()
+        if self.error is not None:
+            raise self.error
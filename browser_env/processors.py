@@ -1,20 +1,28 @@
 import json
-import re
 from collections import defaultdict
-from typing import Any, TypedDict, Union
+from collections.abc import (
+    ItemsView,
+    Iterator,
+    KeysView,
+    Mapping,
+    ValuesView,
+)
+from typing import Any, Callable, TypedDict, Union, cast
 
 import numpy as np
 import numpy.typing as npt
 from gymnasium import spaces
 from playwright.sync_api import CDPSession, Page, ViewportSize
+from typing_extensions import NotRequired
 
 from browser_env.constants import (
     ASCII_CHARSET,
     FREQ_UNICODE_CHARSET,
-    IGNORED_ACTREE_PROPERTIES,
     UTTERANCE_MAX_LENGTH,
 )
 
+from .ax_tree import CompactAccessibilityTree, IncrementalAccessibilityTree
+from .settle import INSTALL_DOM_OBSERVER_JS
 from .utils import (
     AccessibilityTree,
     AccessibilityTreeNode,
@@ -23,10 +31,82 @@ from .utils import (
     DOMNode,
     DOMTree,
     Observation,
+    PageState,
     png_bytes_to_numpy,
 )
 
 IN_VIEWPORT_RATIO_THRESHOLD = 0.6
+# the node ids of an iframe are prefixed with the backend id of its owner
+# element, as long as the ids of the page are below the stride the ids are
+# unique, numeric and the same at every step
+FRAME_NODE_ID_STRIDE = 1_000_000
+# fetch the full accessibility tree at least every this many observations
+AX_FULL_REFRESH_INTERVAL = 10
+
+# walk the whole document in one evaluation and return the same rect that
+# `get_bounding_client_rect` computes for each node, in DOM pre-order, with
+# the index of its parent in the result
+BULK_BOUNDING_CLIENT_RECT_JS = """
+    () => {
+        const nodes = [];
+        const stack = [[document, -1]];
+        while (stack.length > 0) {
+            const [node, parentIndex] = stack.pop();
+            let rect = null;
+            try {
+                let r;
+                if (node.nodeType == 3) {
+                    const range = document.createRange();
+                    range.selectNode(node);
+                    r = range.getBoundingClientRect().toJSON();
+                    range.detach();
+                } else {
+                    r = node.getBoundingClientRect().toJSON();
+                }
+                rect = {x: r.x, y: r.y, width: r.width, height: r.height};
+            } catch (e) {
+                rect = null;
+            }
+            const index = nodes.length;
+            nodes.push([
+                node.nodeName,
+                parentIndex,
+                node.nodeType == 3 && node.nodeValue.trim() === "",
+                rect,
+            ]);
+            for (let i = node.childNodes.length - 1; i >= 0; i--) {
+                stack.push([node.childNodes[i], index]);
+            }
+        }
+        return nodes;
+    }
+"""
+
+# everything the observation needs from the page in one evaluation. The DOM
+# version changes with the document (timeOrigin) and with every mutation or
+# input observed in it, the document size with its layout (e.g., an image
+# that loaded)
+PAGE_STATE_JS = (
+    """
+    () => {"""
+    + INSTALL_DOM_OBSERVER_JS
+    + """
+        return {
+            url: window.location.href,
+            title: document.title,
+            win_top_bound: window.pageYOffset,
+            win_left_bound: window.pageXOffset,
+            win_width: window.screen.width,
+            win_height: window.screen.height,
+            device_pixel_ratio: window.devicePixelRatio,
+            doc_width: document.documentElement.scrollWidth,
+            doc_height: document.documentElement.scrollHeight,
+            dom_version:
+                `${performance.timeOrigin}:${window.__webarenaDomVersion}`,
+        };
+    }
+"""
+)
 
 
 class ObservationProcessor:
@@ -35,7 +115,9 @@ class ObservationProcessor:
 
 
 class ObservationMetadata(TypedDict):
-    obs_nodes_info: dict[str, Any]
+    obs_nodes_info: Mapping[str, Any]
+    # the window of the text observation, the union bounds are relative to it
+    browser_config: NotRequired[BrowserConfig]
 
 
 def create_empty_metadata() -> ObservationMetadata:
@@ -50,20 +132,61 @@ class TextObervationProcessor(ObservationProcessor):
         observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        bounds_mode: str = "per_node",
+        ax_update_mode: str = "full",
+        verify_ax_cache: bool = False,
     ):
         self.observation_type = observation_type
         self.current_viewport_only = current_viewport_only
         self.viewport_size = viewport_size
+        if bounds_mode not in ["per_node", "bulk", "snapshot"]:
+            raise ValueError(f"Invalid bounds mode: {bounds_mode}")
+        self.bounds_mode = bounds_mode
+        if ax_update_mode not in ["full", "incremental"]:
+            raise ValueError(f"Invalid ax update mode: {ax_update_mode}")
+        self.ax_update_mode = ax_update_mode
+        self.verify_ax_cache = verify_ax_cache
+        # the accessibility tree of the last observation, before pruning
+        self.raw_accessibility_tree: AccessibilityTree = []
+        self.raw_accessibility_tree_key: tuple[str, str] | None = None
+        self.incremental_tree = IncrementalAccessibilityTree()
+        self.ax_tree_reused = False
+        # observations since the last full refresh, the first one is a full
+        # refresh
+        self.ax_tree_updates = AX_FULL_REFRESH_INTERVAL
+        self.ax_tree_cache_hits = 0
+        self.ax_tree_cache_misses = 0
+        # reused or incrementally serialized trees that differ from fresh
+        # ones, with verify_ax_cache
+        self.ax_tree_mismatches = 0
+        # number of CDP calls spent on bounding boxes for the last observation
+        self.bounds_cdp_calls = 0
+        # the printed nodes of the last observation, by element id
+        self.obs_nodes_info: Mapping[str, Any] = {}
+        # whether the last observation includes the content of iframes,
+        # which the DOM version of the page does not cover
+        self.has_frame_content = False
+        self.page_state: PageState | None = None
         self.observation_tag = "text"
         self.meta_data = (
             create_empty_metadata()
         )  # use the store meta data of this observation type
 
+    @staticmethod
+    def fetch_page_state(page: Page) -> PageState:
+        """Probe the page state with a single evaluation"""
+        page_state: PageState = page.evaluate(PAGE_STATE_JS)
+        return page_state
+
     def fetch_browser_info(
         self,
         page: Page,
         client: CDPSession,
+        page_state: PageState | None = None,
     ) -> BrowserInfo:
+        if page_state is None:
+            page_state = self.fetch_page_state(page)
+
         # extract domtree
         tree = client.send(
             "DOMSnapshot.captureSnapshot",
@@ -82,13 +205,13 @@ class TextObervationProcessor(ObservationProcessor):
         tree["documents"][0]["layout"]["bounds"] = bounds
 
         # extract browser info
-        win_top_bound = page.evaluate("window.pageYOffset")
-        win_left_bound = page.evaluate("window.pageXOffset")
-        win_width = page.evaluate("window.screen.width")
-        win_height = page.evaluate("window.screen.height")
+        win_top_bound = page_state["win_top_bound"]
+        win_left_bound = page_state["win_left_bound"]
+        win_width = page_state["win_width"]
+        win_height = page_state["win_height"]
         win_right_bound = win_left_bound + win_width
         win_lower_bound = win_top_bound + win_height
-        device_pixel_ratio = page.evaluate("window.devicePixelRatio")
+        device_pixel_ratio = page_state["device_pixel_ratio"]
         assert device_pixel_ratio == 1.0, "devicePixelRatio is not 1.0"
 
         config: BrowserConfig = {
@@ -140,36 +263,295 @@ class TextObervationProcessor(ObservationProcessor):
             return {"result": {"subtype": "error"}}
 
     @staticmethod
-    def get_element_in_viewport_ratio(
-        elem_left_bound: float,
-        elem_top_bound: float,
-        width: float,
-        height: float,
-        config: BrowserConfig,
-    ) -> float:
-        elem_right_bound = elem_left_bound + width
-        elem_lower_bound = elem_top_bound + height
+    def get_bounding_client_rects(
+        client: CDPSession, backend_node_ids: list[str]
+    ) -> tuple[dict[str, dict[str, Any]], int]:
+        """Resolve the bounding client rects of many nodes at once.
+
+        The rects of the whole document are computed in a single evaluation
+        and matched to backend node ids through `DOM.getDocument`. Both trees
+        are walked together from the document: the children of two matched
+        nodes are matched in order by node name, skipping the whitespace-only
+        text nodes that CDP leaves out. Node values are not compared, CDP
+        truncates the long ones. Nodes that can not be matched (e.g., inside
+        iframes or shadow roots, or changed between the two calls) fall back
+        to `get_bounding_client_rect`. Return the responses keyed by backend
+        node id, in the same format as `get_bounding_client_rect`, and the
+        number of CDP calls made.
+        """
+        responses: dict[str, dict[str, Any]] = {}
+        num_calls = 0
+        wanted = set(backend_node_ids)
+        try:
+            num_calls += 1
+            root = client.send("DOM.getDocument", {"depth": -1})["root"]
+            num_calls += 1
+            response = client.send(
+                "Runtime.evaluate",
+                {
+                    "expression": f"({BULK_BOUNDING_CLIENT_RECT_JS})()",
+                    "returnByValue": True,
+                },
+            )
+            js_nodes = response["result"]["value"]
+
+            js_children: list[list[int]] = [[] for _ in js_nodes]
+            for js_index, (_, parent_index, is_whitespace, _) in enumerate(
+                js_nodes
+            ):
+                if parent_index >= 0 and not is_whitespace:
+                    js_children[parent_index].append(js_index)
+
+            stack = []
+            if js_nodes and js_nodes[0][0] == root["nodeName"]:
+                stack.append((root, 0))
+            while stack:
+                node, js_index = stack.pop()
+                backend_node_id = str(node["backendNodeId"])
+                if backend_node_id in wanted:
+                    rect = js_nodes[js_index][3]
+                    if rect is None:
+                        responses[backend_node_id] = {
+                            "result": {"subtype": "error"}
+                        }
+                    else:
+                        responses[backend_node_id] = {
+                            "result": {"value": rect}
+                        }
+                # a node inserted on the JS side is skipped, the nodes left
+                # on the CDP side are not matched
+                js_cursor = iter(js_children[js_index])
+                for child in node.get("children", []):
+                    for js_child in js_cursor:
+                        if js_nodes[js_child][0] == child["nodeName"]:
+                            stack.append((child, js_child))
+                            break
+        except Exception:
+            responses = {}
+
+        for backend_node_id in backend_node_ids:
+            if backend_node_id not in responses:
+                num_calls += 2
+                responses[
+                    backend_node_id
+                ] = TextObervationProcessor.get_bounding_client_rect(
+                    client, backend_node_id
+                )
+        return responses, num_calls
 
-        win_left_bound = 0
-        win_right_bound = config["win_width"]
-        win_top_bound = 0
-        win_lower_bound = config["win_height"]
+    @staticmethod
+    def get_snapshot_bounds(info: BrowserInfo) -> dict[str, list[float]]:
+        """Get the bounds of the nodes from the layout in the DOM snapshot.
+
+        The snapshot bounds are in document coordinates, they are shifted by
+        the scroll offsets to match `getBoundingClientRect`. The nodes of
+        iframe documents are relative to the viewport of their iframe. Nodes
+        with more than one layout object get the union of their boxes. Nodes
+        without layout are not in the result.
+        """
+        tree = info["DOMTree"]
+        config = info["config"]
+
+        bounds: dict[str, list[float]] = {}
+        for doc_idx, document in enumerate(tree["documents"]):
+            backend_node_ids = document["nodes"]["backendNodeId"]
+            layout = document["layout"]
+            if doc_idx == 0:
+                win_left_bound = config["win_left_bound"]
+                win_top_bound = config["win_top_bound"]
+            else:
+                win_left_bound = document.get("scrollOffsetX", 0)
+                win_top_bound = document.get("scrollOffsetY", 0)
+
+            for node_idx, bound in zip(layout["nodeIndex"], layout["bounds"]):
+                backend_node_id = str(backend_node_ids[node_idx])
+                x, y, width, height = bound
+                x -= win_left_bound
+                y -= win_top_bound
+                if backend_node_id in bounds:
+                    prev_x, prev_y, prev_width, prev_height = bounds[
+                        backend_node_id
+                    ]
+                    right = max(prev_x + prev_width, x + width)
+                    lower = max(prev_y + prev_height, y + height)
+                    x = min(prev_x, x)
+                    y = min(prev_y, y)
+                    width = right - x
+                    height = lower - y
+                bounds[backend_node_id] = [x, y, width, height]
+        return bounds
+
+    def fetch_bounds(
+        self,
+        info: BrowserInfo,
+        client: CDPSession,
+        backend_node_ids: list[str],
+    ) -> dict[str, list[float] | None]:
+        """Get the union bound ([x, y, width, height]) of the nodes"""
+        if self.bounds_mode == "snapshot":
+            # no CDP call, the layout comes with the DOM snapshot
+            self.bounds_cdp_calls = 0
+            snapshot_bounds = self.get_snapshot_bounds(info)
+            return {
+                backend_node_id: snapshot_bounds.get(backend_node_id, None)
+                for backend_node_id in backend_node_ids
+            }
 
-        # Compute the overlap in x and y axes
-        overlap_width = max(
+        responses: dict[str, dict[str, Any]]
+        if self.bounds_mode == "bulk":
+            responses, num_calls = self.get_bounding_client_rects(
+                client, backend_node_ids
+            )
+        else:
+            responses = {}
+            for backend_node_id in backend_node_ids:
+                responses[backend_node_id] = self.get_bounding_client_rect(
+                    client, backend_node_id
+                )
+            # DOM.resolveNode + Runtime.callFunctionOn for each node
+            num_calls = 2 * len(backend_node_ids)
+        self.bounds_cdp_calls = num_calls
+
+        bounds: dict[str, list[float] | None] = {}
+        for backend_node_id, response in responses.items():
+            if response.get("result", {}).get("subtype", "") == "error":
+                bounds[backend_node_id] = None
+            else:
+                x = response["result"]["value"]["x"]
+                y = response["result"]["value"]["y"]
+                width = response["result"]["value"]["width"]
+                height = response["result"]["value"]["height"]
+                bounds[backend_node_id] = [x, y, width, height]
+        return bounds
+
+    def fetch_node_bounds(
+        self,
+        info: BrowserInfo,
+        client: CDPSession,
+        accessibility_tree: AccessibilityTree,
+        backend_node_ids: list[str],
+    ) -> dict[str, list[float] | None]:
+        """Same as `fetch_bounds`, with the bounds of the nodes inside
+        iframes shifted by the position of their iframe elements. The
+        iframe elements are measured in the same call."""
+        frame_owner_ids = {
+            str(node["backendDOMNodeId"]): node["frameOwnerIds"]
+            for node in accessibility_tree
+            if "frameOwnerIds" in node and "backendDOMNodeId" in node
+        }
+        if not frame_owner_ids:
+            return self.fetch_bounds(info, client, backend_node_ids)
+
+        owner_ids = {
+            owner_id
+            for owner_ids in frame_owner_ids.values()
+            for owner_id in owner_ids
+        }
+        bounds = self.fetch_bounds(
+            info,
+            client,
+            backend_node_ids + sorted(owner_ids - set(backend_node_ids)),
+        )
+        node_bounds: dict[str, list[float] | None] = {}
+        for backend_node_id in backend_node_ids:
+            bound = bounds[backend_node_id]
+            for owner_id in frame_owner_ids.get(backend_node_id, []):
+                owner_bound = bounds[owner_id]
+                if bound is None or owner_bound is None:
+                    bound = None
+                    break
+                x, y, width, height = bound
+                bound = [x + owner_bound[0], y + owner_bound[1], width, height]
+            node_bounds[backend_node_id] = bound
+        return node_bounds
+
+    @staticmethod
+    def get_viewport_keep_mask(
+        union_bounds: list[list[float] | None] | npt.NDArray[np.float32],
+        config: BrowserConfig,
+    ) -> npt.NDArray[np.bool_]:
+        """Return whether each node is visible and has enough of its area
+        in the viewport (IN_VIEWPORT_RATIO_THRESHOLD) to be kept. Nodes
+        without bounds (None or a NaN row) are not kept.
+        """
+        if isinstance(union_bounds, np.ndarray):
+            bounds = union_bounds.astype(np.float64).reshape(-1, 4)
+        else:
+            missing_bound = [np.nan] * 4
+            bounds = np.array(
+                [
+                    union_bound if union_bound else missing_bound
+                    for union_bound in union_bounds
+                ],
+                dtype=np.float64,
+            ).reshape(-1, 4)
+        x, y, width, height = bounds.T
+
+        overlap_width = np.clip(
+            np.minimum(x + width, config["win_width"]) - np.maximum(x, 0),
             0,
-            min(elem_right_bound, win_right_bound)
-            - max(elem_left_bound, win_left_bound),
+            None,
         )
-        overlap_height = max(
+        overlap_height = np.clip(
+            np.minimum(y + height, config["win_height"]) - np.maximum(y, 0),
             0,
-            min(elem_lower_bound, win_lower_bound)
-            - max(elem_top_bound, win_top_bound),
+            None,
         )
+        # invisible nodes (zero area) and nodes without bounds (NaN) are
+        # never kept, whatever the ratio computes to
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = overlap_width * overlap_height / (width * height)
+        keep: npt.NDArray[np.bool_] = (
+            (width != 0)
+            & (height != 0)
+            & (ratio >= IN_VIEWPORT_RATIO_THRESHOLD)
+        )
+        return keep
+
+    @staticmethod
+    def prune_tree(tree: DOMTree, keep: list[bool]) -> DOMTree:
+        """Remove the nodes not marked in `keep` from the tree.
+
+        The children of a removed node are spliced into the children of its
+        nearest kept ancestor, at the position of the removed node, and
+        their parentId is updated accordingly. Each node is visited once.
+        """
+        id_to_cursor = {
+            node["nodeId"]: cursor for cursor, node in enumerate(tree)
+        }
+        for cursor, node in enumerate(tree):
+            if not keep[cursor]:
+                continue
+            if all(
+                child_id not in id_to_cursor or keep[id_to_cursor[child_id]]
+                for child_id in node["childIds"]
+            ):
+                continue
 
-        # Compute the overlap area
-        ratio = overlap_width * overlap_height / width * height
-        return ratio
+            # expand the removed children in place, depth first
+            child_ids = []
+            stack = [
+                (child_id, False) for child_id in reversed(node["childIds"])
+            ]
+            while stack:
+                child_id, spliced = stack.pop()
+                if child_id not in id_to_cursor:
+                    child_ids.append(child_id)
+                    continue
+                child_cursor = id_to_cursor[child_id]
+                child = tree[child_cursor]
+                if keep[child_cursor]:
+                    child_ids.append(child_id)
+                    if spliced:
+                        child["parentId"] = node["nodeId"]
+                else:
+                    stack.extend(
+                        (grandchild_id, True)
+                        for grandchild_id in reversed(child["childIds"])
+                    )
+            node["childIds"] = child_ids
+
+        return [node for cursor, node in enumerate(tree) if keep[cursor]]
 
     def fetch_page_html(
         self,
@@ -235,85 +617,35 @@ class TextObervationProcessor(ObservationProcessor):
             if cur_node["parentId"] != "-1":
                 graph[cur_node["parentId"]].append(str(cur_node["nodeId"]))
 
-            # get the bound
-            if cur_node["parentId"] == "-1":
-                cur_node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
-            else:
-                response = self.get_bounding_client_rect(
-                    client, cur_node["backendNodeId"]
-                )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    cur_node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    cur_node["union_bound"] = [x, y, width, height]
-
             dom_tree.append(cur_node)
 
+        # get the bound
+        bounds = self.fetch_bounds(
+            info,
+            client,
+            [
+                node["backendNodeId"]
+                for node in dom_tree
+                if node["parentId"] != "-1"
+            ],
+        )
+        for node in dom_tree:
+            if node["parentId"] == "-1":
+                node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
+            else:
+                node["union_bound"] = bounds[node["backendNodeId"]]
+
         # add parent children index to the node
         for parent_id, child_ids in graph.items():
             dom_tree[int(parent_id)]["childIds"] = child_ids
 
         # remove the nodes that are not in the current viewport
         if current_viewport_only:
-
-            def remove_node_in_graph(node: DOMNode) -> None:
-                # update the node information in the accessibility tree
-                node_id = node["nodeId"]
-                parent_id = node["parentId"]
-                child_ids = node["childIds"]
-
-                # update the children of the parent node
-                assert dom_tree[int(parent_id)]["parentId"] != "[REMOVED]"
-                # remove the nodeid from parent
-                index = dom_tree[int(parent_id)]["childIds"].index(node_id)
-                dom_tree[int(parent_id)]["childIds"].pop(index)
-
-                # Insert children_nodeids in the same location
-                for child_id in child_ids:
-                    dom_tree[int(parent_id)]["childIds"].insert(
-                        index, child_id
-                    )
-                    index += 1
-
-                # update children node's parent
-                for child_id in child_ids:
-                    dom_tree[int(child_id)]["parentId"] = parent_id
-                # mark as removed
-                dom_tree[int(node_id)]["parentId"] = "[REMOVED]"
-
             config = info["config"]
-            for cursor, node in enumerate(dom_tree):
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
-
-                [x, y, width, height] = node["union_bound"]
-
-                # invisible node
-                if width == 0.0 or height == 0.0:
-                    remove_node_in_graph(node)
-                    continue
-
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
-                )
-
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
-
-            dom_tree = [
-                node
-                for node in dom_tree
-                if node.get("parentId", "-1") != "[REMOVED]"
-            ]
+            keep = self.get_viewport_keep_mask(
+                [node["union_bound"] for node in dom_tree], config
+            )
+            dom_tree = self.prune_tree(dom_tree, keep.tolist())
 
         return dom_tree
 
@@ -360,19 +692,36 @@ class TextObervationProcessor(ObservationProcessor):
         html = dfs(0, 0)
         return html, obs_nodes_info
 
-    def fetch_page_accessibility_tree(
-        self,
-        info: BrowserInfo,
-        client: CDPSession,
-        current_viewport_only: bool,
-    ) -> AccessibilityTree:
-        
+    @staticmethod
+    def fetch_child_frame_ids(client: CDPSession) -> list[str]:
+        """The ids of the frames below the main frame, in pre-order"""
+        try:
+            frame_tree = client.send("Page.getFrameTree", {})["frameTree"]
+        except Exception:
+            return []
+        frame_ids = []
+        stack = list(reversed(frame_tree.get("childFrames", [])))
+        while stack:
+            frame = stack.pop()
+            frame_ids.append(frame["frame"]["id"])
+            stack.extend(reversed(frame.get("childFrames", [])))
+        return frame_ids
+
+    @staticmethod
+    def fetch_full_accessibility_tree(client: CDPSession) -> AccessibilityTree:
+        """Fetch the accessibility tree of the page and of its iframes.
+
+        The frames are fetched one after the other, the sync API of
+        playwright waits for the response of each command. The tree of each
+        iframe is attached below its owner node, see
+        `merge_frame_accessibility_tree`.
+        """
+        child_frame_ids = TextObervationProcessor.fetch_child_frame_ids(client)
         # THIS IS WHERE ACCESSIBILITY TREE IS FETCHED
         accessibility_tree: AccessibilityTree = client.send(
             "Accessibility.getFullAXTree", {}
         )["nodes"]
 
-
         # a few nodes are repeated in the accessibility tree
         seen_ids = set()
         _accessibility_tree = []
@@ -380,234 +729,329 @@ class TextObervationProcessor(ObservationProcessor):
             if node["nodeId"] not in seen_ids:
                 _accessibility_tree.append(node)
                 seen_ids.add(node["nodeId"])
-        accessibility_tree = _accessibility_tree
-
-        nodeid_to_cursor = {}
-        for cursor, node in enumerate(accessibility_tree):
-            nodeid_to_cursor[node["nodeId"]] = cursor
-            # usually because the node is not visible etc
-            if "backendDOMNodeId" not in node:
-                node["union_bound"] = None
-                continue
-            backend_node_id = str(node["backendDOMNodeId"])
-            if node["role"]["value"] == "RootWebArea":
-                # always inside the viewport
-                node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
-            else:
-                response = self.get_bounding_client_rect(
-                    client, backend_node_id
-                )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    node["union_bound"] = [x, y, width, height]
 
-        # filter nodes that are not in the current viewport
-        if current_viewport_only:
-
-            def remove_node_in_graph(node: AccessibilityTreeNode) -> None:
-                # update the node information in the accessibility tree
-                nodeid = node["nodeId"]
-                node_cursor = nodeid_to_cursor[nodeid]
-                parent_nodeid = node["parentId"]
-                children_nodeids = node["childIds"]
-                parent_cursor = nodeid_to_cursor[parent_nodeid]
-                # update the children of the parent node
-                assert (
-                    accessibility_tree[parent_cursor].get("parentId", "Root")
-                    is not None
-                )
-                # remove the nodeid from parent's childIds
-                index = accessibility_tree[parent_cursor]["childIds"].index(
-                    nodeid
+        for frame_id in child_frame_ids:
+            try:
+                frame_accessibility_tree = client.send(
+                    "Accessibility.getFullAXTree", {"frameId": frame_id}
+                )["nodes"]
+                owner = client.send("DOM.getFrameOwner", {"frameId": frame_id})
+            except Exception:
+                # e.g., out-of-process iframes are not reachable from the page
+                continue
+            _accessibility_tree = (
+                TextObervationProcessor.merge_frame_accessibility_tree(
+                    _accessibility_tree,
+                    frame_accessibility_tree,
+                    str(owner["backendNodeId"]),
                 )
-                accessibility_tree[parent_cursor]["childIds"].pop(index)
-                # Insert children_nodeids in the same location
-                for child_nodeid in children_nodeids:
-                    accessibility_tree[parent_cursor]["childIds"].insert(
-                        index, child_nodeid
-                    )
-                    index += 1
-                # update children node's parent
-                for child_nodeid in children_nodeids:
-                    child_cursor = nodeid_to_cursor[child_nodeid]
-                    accessibility_tree[child_cursor][
-                        "parentId"
-                    ] = parent_nodeid
-                # mark as removed
-                accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
-
-            config = info["config"]
-            for node in accessibility_tree:
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
+            )
+        return _accessibility_tree
 
-                [x, y, width, height] = node["union_bound"]
+    @staticmethod
+    def merge_frame_accessibility_tree(
+        accessibility_tree: AccessibilityTree,
+        frame_accessibility_tree: AccessibilityTree,
+        owner_backend_id: str,
+    ) -> AccessibilityTree:
+        """Attach the tree of an iframe below the node of its owner element.
+
+        The node ids of the frame are prefixed with the backend id of its
+        owner, see FRAME_NODE_ID_STRIDE, so that the element ids stay numeric
+        and unique, and do not change when the rest of the page changes. The
+        nodes of the frame record the backend ids of the iframe elements they
+        are nested in (`frameOwnerIds`, outermost first) to shift their bounds
+        into the viewport of the page. Frames whose owner is not in the tree
+        (e.g., hidden iframes) or that are already in it are left out.
+        """
+        owner_index = -1
+        backend_ids = set()
+        for index, node in enumerate(accessibility_tree):
+            if "backendDOMNodeId" in node:
+                backend_id = str(node["backendDOMNodeId"])
+                backend_ids.add(backend_id)
+                if backend_id == owner_backend_id and owner_index < 0:
+                    owner_index = index
+        if owner_index < 0 or not frame_accessibility_tree:
+            return accessibility_tree
+        frame_root = frame_accessibility_tree[0]
+        if str(frame_root.get("backendDOMNodeId")) in backend_ids:
+            return accessibility_tree
+
+        owner = accessibility_tree[owner_index]
+        frame_owner_ids = owner.get("frameOwnerIds", []) + [owner_backend_id]
+        id_prefix = int(owner_backend_id) * FRAME_NODE_ID_STRIDE
+
+        def shift(node_id: str) -> str:
+            return str(id_prefix + int(node_id))
+
+        merged = list(accessibility_tree)
+        merged[owner_index] = {
+            **owner,
+            "childIds": owner["childIds"] + [shift(frame_root["nodeId"])],
+        }
+        seen_ids = set()
+        for node in frame_accessibility_tree:
+            if node["nodeId"] in seen_ids:
+                continue
+            seen_ids.add(node["nodeId"])
+            frame_node: AccessibilityTreeNode = {
+                **node,
+                "nodeId": shift(node["nodeId"]),
+                "childIds": [shift(child_id) for child_id in node["childIds"]],
+                "frameOwnerIds": frame_owner_ids,
+            }
+            if node is frame_root or "parentId" not in node:
+                frame_node["parentId"] = owner["nodeId"]
+            else:
+                frame_node["parentId"] = shift(node["parentId"])
+            merged.append(frame_node)
+        return merged
 
-                # invisible node
-                if width == 0 or height == 0:
-                    remove_node_in_graph(node)
-                    continue
+    def fetch_cached_accessibility_tree(
+        self, client: CDPSession
+    ) -> AccessibilityTree:
+        """Reuse the accessibility tree of the last observation as long as the
+        DOM version of the page does not change, otherwise fetch the whole
+        tree again, which `serialize_accessibility_tree` then diffs with the
+        last one.
+
+        The node ids are stable across fetches, so a reused tree is exactly
+        what a new fetch would return, unless the tree changed without any
+        DOM mutation, input or focus change (e.g., a menu shown by a CSS
+        :hover rule). After AX_FULL_REFRESH_INTERVAL observations, the tree
+        is fetched and built again from scratch, and with `verify_ax_cache`
+        every reused tree is compared with a fresh one, see
+        `ax_tree_cache_stats`. Trees with iframes are never reused, the DOM
+        version only covers the main frame.
+        """
+        key = None
+        if self.page_state is not None:
+            key = (self.page_state["url"], self.page_state["dom_version"])
+        full_refresh = self.ax_tree_updates >= AX_FULL_REFRESH_INTERVAL
+        if full_refresh:
+            self.ax_tree_updates = 0
+            self.incremental_tree.reset()
+        else:
+            self.ax_tree_updates += 1
+        self.ax_tree_reused = (
+            key is not None
+            and key == self.raw_accessibility_tree_key
+            and not full_refresh
+        )
 
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
+        if self.ax_tree_reused:
+            self.ax_tree_cache_hits += 1
+            raw_accessibility_tree = self.raw_accessibility_tree
+            if self.verify_ax_cache:
+                full_accessibility_tree = self.fetch_full_accessibility_tree(
+                    client
                 )
+                if full_accessibility_tree != raw_accessibility_tree:
+                    self.ax_tree_mismatches += 1
+                    raw_accessibility_tree = full_accessibility_tree
+        else:
+            self.ax_tree_cache_misses += 1
+            raw_accessibility_tree = self.fetch_full_accessibility_tree(client)
 
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
-
-            accessibility_tree = [
-                node
-                for node in accessibility_tree
-                if node.get("parentId", "Root") != "[REMOVED]"
-            ]
-
-        return accessibility_tree
-
-    @staticmethod
-    def parse_accessibility_tree(
-        accessibility_tree: AccessibilityTree,
-    ) -> tuple[str, dict[str, Any]]:
-        """Parse the accessibility tree into a string text"""
-        node_id_to_idx = {}
-        for idx, node in enumerate(accessibility_tree):
-            node_id_to_idx[node["nodeId"]] = idx
+        if any("frameOwnerIds" in node for node in raw_accessibility_tree):
+            key = None
+        self.raw_accessibility_tree = raw_accessibility_tree
+        self.raw_accessibility_tree_key = key
+        return raw_accessibility_tree
 
-        obs_nodes_info = {}
+    @property
+    def ax_tree_cache_stats(self) -> dict[str, int]:
+        return {
+            "hits": self.ax_tree_cache_hits,
+            "misses": self.ax_tree_cache_misses,
+            "mismatches": self.ax_tree_mismatches,
+        }
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
-            node = accessibility_tree[idx]
-            indent = "\t" * depth
-            valid_node = True
-            try:
-                role = node["role"]["value"]
-                name = node["name"]["value"]
-                node_str = f"[{obs_node_id}] {role} {repr(name)}"
-                properties = []
-                for property in node.get("properties", []):
-                    try:
-                        if property["name"] in IGNORED_ACTREE_PROPERTIES:
-                            continue
-                        properties.append(
-                            f'{property["name"]}: {property["value"]["value"]}'
-                        )
-                    except KeyError:
-                        pass
-
-                if properties:
-                    node_str += " " + " ".join(properties)
-
-                # check valid
-                if not node_str.strip():
-                    valid_node = False
-
-                # empty generic node
-                if not name.strip():
-                    if not properties:
-                        if role in [
-                            "generic",
-                            "img",
-                            "list",
-                            "strong",
-                            "paragraph",
-                            "banner",
-                            "navigation",
-                            "Section",
-                            "LabelText",
-                            "Legend",
-                            "listitem",
-                        ]:
-                            valid_node = False
-                    elif role in ["listitem"]:
-                        valid_node = False
+    def fetch_compact_accessibility_tree(
+        self,
+        info: BrowserInfo,
+        client: CDPSession,
+        current_viewport_only: bool,
+    ) -> CompactAccessibilityTree:
+        """Fetch the accessibility tree with the bounds of its nodes, pruned
+        to the viewport if `current_viewport_only`. The tree is returned in
+        its compact form, which leaves the raw nodes untouched"""
+        raw_accessibility_tree, bounds = self.fetch_accessibility_tree_bounds(
+            info, client
+        )
+        return self.build_compact_accessibility_tree(
+            raw_accessibility_tree,
+            bounds,
+            info["config"],
+            current_viewport_only,
+        )
 
-                if valid_node:
-                    tree_str += f"{indent}{node_str}"
-                    obs_nodes_info[obs_node_id] = {
-                        "backend_id": node["backendDOMNodeId"],
-                        "union_bound": node["union_bound"],
-                        "text": node_str,
-                    }
+    def fetch_accessibility_tree_bounds(
+        self, info: BrowserInfo, client: CDPSession
+    ) -> tuple[AccessibilityTree, dict[str, list[float] | None]]:
+        """The browser side of `fetch_compact_accessibility_tree`: the raw
+        accessibility tree and the bounds of its nodes by backend id"""
+        raw_accessibility_tree: AccessibilityTree
+        if self.ax_update_mode == "incremental":
+            raw_accessibility_tree = self.fetch_cached_accessibility_tree(
+                client
+            )
+        else:
+            raw_accessibility_tree = self.fetch_full_accessibility_tree(client)
+        self.has_frame_content = any(
+            "frameOwnerIds" in node for node in raw_accessibility_tree
+        )
+        # the roots are always inside the viewport
+        backend_ids = list(
+            dict.fromkeys(
+                str(node["backendDOMNodeId"])
+                for node in raw_accessibility_tree
+                if "backendDOMNodeId" in node
+                and node.get("role", {}).get("value") != "RootWebArea"
+            )
+        )
+        bounds = self.fetch_node_bounds(
+            info, client, raw_accessibility_tree, backend_ids
+        )
+        return raw_accessibility_tree, bounds
 
-            except Exception as e:
-                valid_node = False
+    @staticmethod
+    def build_compact_accessibility_tree(
+        raw_accessibility_tree: AccessibilityTree,
+        bounds: dict[str, list[float] | None],
+        config: BrowserConfig,
+        current_viewport_only: bool,
+        incremental_tree: IncrementalAccessibilityTree | None = None,
+    ) -> CompactAccessibilityTree:
+        """The Python side of `fetch_compact_accessibility_tree`, it does not
+        use the browser. With `incremental_tree`, the last tree is reused if
+        the nodes did not change"""
+        if incremental_tree is None:
+            tree = CompactAccessibilityTree.from_cdp_nodes(
+                raw_accessibility_tree
+            )
+        else:
+            tree = incremental_tree.from_cdp_nodes(raw_accessibility_tree)
+
+        has_backend = tree.backend_ids >= 0
+        is_root = tree.has_role("RootWebArea")
+        bounded = np.flatnonzero(has_backend & ~is_root)
+        backend_ids = [str(b) for b in tree.backend_ids[bounded].tolist()]
+
+        # usually because the node is not visible etc
+        missing_bound = [np.nan] * 4
+        tree.bounds[bounded] = np.array(
+            [bounds.get(b) or missing_bound for b in backend_ids],
+            dtype=np.float32,
+        ).reshape(-1, 4)
+        # always inside the viewport
+        tree.bounds[has_backend & is_root] = [0.0, 0.0, 10.0, 10.0]
 
-            for _, child_node_id in enumerate(node["childIds"]):
-                if child_node_id not in node_id_to_idx:
-                    continue
-                # mark this to save some tokens
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
-                )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
+        # filter nodes that are not in the current viewport
+        if current_viewport_only:
+            keep = TextObervationProcessor.get_viewport_keep_mask(
+                tree.bounds, config
+            )
+            tree = tree.prune(keep)
 
-            return tree_str
+        return tree
 
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
-        return tree_str, obs_nodes_info
+    def serialize_accessibility_tree(
+        self,
+        raw_accessibility_tree: AccessibilityTree,
+        bounds: dict[str, list[float] | None],
+        config: BrowserConfig,
+    ) -> tuple[str, Mapping[str, Any]]:
+        """Build the compact tree and serialize it. In the incremental update
+        mode, only the subtrees that changed since the last observation are
+        serialized again, and with `verify_ax_cache` the result is compared
+        with the serialization of the whole tree"""
+        if self.ax_update_mode != "incremental":
+            return self.build_compact_accessibility_tree(
+                raw_accessibility_tree,
+                bounds,
+                config,
+                self.current_viewport_only,
+            ).serialize()
+
+        tree = self.build_compact_accessibility_tree(
+            raw_accessibility_tree,
+            bounds,
+            config,
+            self.current_viewport_only,
+            self.incremental_tree,
+        )
+        content, obs_nodes_info = self.incremental_tree.serialize(tree)
+        if self.verify_ax_cache:
+            (
+                full_content,
+                full_obs_nodes_info,
+            ) = self.build_compact_accessibility_tree(
+                raw_accessibility_tree,
+                bounds,
+                config,
+                self.current_viewport_only,
+            ).serialize()
+            if full_content != content:
+                self.ax_tree_mismatches += 1
+                self.incremental_tree.reset()
+                return full_content, full_obs_nodes_info
+        return content, obs_nodes_info
 
     @staticmethod
-    def clean_accesibility_tree(tree_str: str) -> str:
-        """further clean accesibility tree"""
-        clean_lines: list[str] = []
-        for line in tree_str.split("\n"):
-            # remove statictext if the content already appears in the previous line
-            if "statictext" in line.lower():
-                prev_lines = clean_lines[-3:]
-                pattern = r"\[\d+\] StaticText (.+)"
-
-                match = re.search(pattern, line, re.DOTALL)
-                if match:
-                    static_text = match.group(1)[1:-1]  # remove the quotes
-                    if static_text and all(
-                        static_text not in prev_line
-                        for prev_line in prev_lines
-                    ):
-                        clean_lines.append(line)
-            else:
-                clean_lines.append(line)
-
-        return "\n".join(clean_lines)
-
-    def process(self, page: Page, client: CDPSession) -> str:
-        # get the tab info
+    def get_tab_title_str(page: Page, page_state: PageState) -> str:
+        """Get the tab info, the title of the current tab is in the page
+        state"""
         open_tabs = page.context.pages
         try:
-            tab_titles = [tab.title() for tab in open_tabs]
-            current_tab_idx = open_tabs.index(page)
-            for idx in range(len(open_tabs)):
-                if idx == current_tab_idx:
-                    tab_titles[
-                        idx
-                    ] = f"Tab {idx} (current): {open_tabs[idx].title()}"
+            tab_titles = []
+            for idx, tab in enumerate(open_tabs):
+                if tab == page:
+                    tab_titles.append(
+                        f"Tab {idx} (current): {page_state['title']}"
+                    )
                 else:
-                    tab_titles[idx] = f"Tab {idx}: {open_tabs[idx].title()}"
+                    tab_titles.append(f"Tab {idx}: {tab.title()}")
             tab_title_str = " | ".join(tab_titles)
         except Exception:
             tab_title_str = " | ".join(
                 ["Tab {idx}" for idx in range(len(open_tabs))]
             )
+        return tab_title_str
+
+    def process(
+        self,
+        page: Page,
+        client: CDPSession,
+        page_state: PageState | None = None,
+    ) -> str:
+        return self.fetch(page, client, page_state)()
 
+    def fetch(
+        self,
+        page: Page,
+        client: CDPSession,
+        page_state: PageState | None = None,
+    ) -> Callable[[], str]:
+        """Fetch from the browser what the observation is made of, and
+        return the function that builds the observation from it. That
+        function does not use the browser (e.g., it can run in another
+        thread), it is called before the next fetch."""
         try:
-            browser_info = self.fetch_browser_info(page, client)
+            if page_state is None:
+                page_state = self.fetch_page_state(page)
+            browser_info = self.fetch_browser_info(page, client, page_state)
         except Exception:
             page.wait_for_load_state("load", timeout=500)
-            browser_info = self.fetch_browser_info(page, client)
+            page_state = self.fetch_page_state(page)
+            browser_info = self.fetch_browser_info(page, client, page_state)
+        self.page_state = page_state
+        self.has_frame_content = False
 
+        tab_title_str = self.get_tab_title_str(page, page_state)
+
+        build_content: Callable[[], tuple[str, Mapping[str, Any]]]
         if self.observation_type == "html":
             dom_tree = self.fetch_page_html(
                 browser_info,
@@ -615,31 +1059,38 @@ class TextObervationProcessor(ObservationProcessor):
                 client,
                 current_viewport_only=self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_html(dom_tree)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
+
+            def build_content() -> tuple[str, Mapping[str, Any]]:
+                return self.parse_html(dom_tree)
 
         elif self.observation_type == "accessibility_tree":
-            accessibility_tree = self.fetch_page_accessibility_tree(
-                browser_info,
-                client,
-                current_viewport_only=self.current_viewport_only,
-            )
-            content, obs_nodes_info = self.parse_accessibility_tree(
-                accessibility_tree
-            )
-            content = self.clean_accesibility_tree(content)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
+            (
+                raw_accessibility_tree,
+                bounds,
+            ) = self.fetch_accessibility_tree_bounds(browser_info, client)
+
+            def build_content() -> tuple[str, Mapping[str, Any]]:
+                return self.serialize_accessibility_tree(
+                    raw_accessibility_tree, bounds, browser_info["config"]
+                )
 
         else:
             raise ValueError(
                 f"Invalid observatrion type: {self.observation_type}"
             )
 
-        self.browser_config = browser_info["config"]
-        content = f"{tab_title_str}\n\n{content}"
-        return content
+        def build() -> str:
+            content, self.obs_nodes_info = build_content()
+            self.browser_config = browser_info["config"]
+            # a new dict for each observation, the metadata of the previous
+            # observations may still be read (e.g., by the trajectory)
+            self.meta_data = {
+                "obs_nodes_info": self.obs_nodes_info,
+                "browser_config": browser_info["config"],
+            }
+            return f"{tab_title_str}\n\n{content}"
+
+        return build
 
     def get_element_center(self, element_id: str) -> tuple[float, float]:
         node_info = self.obs_nodes_info[element_id]
@@ -668,6 +1119,68 @@ class ImageObservationProcessor(ObservationProcessor):
         return screenshot
 
 
+class LazyObservation(dict[str, Observation]):
+    """Observation whose image is only captured when it is read.
+
+    The screenshot is taken on the first read of the image, through
+    `obs["image"]`, `obs.get("image")`, `obs.items()`, `obs.values()` or a
+    copy of the observation. "image" is always a key of the observation,
+    checking for it or iterating over the keys does not take the screenshot.
+    The image must be read before the environment executes the next action,
+    after that the observation is expired and reading the image raises an
+    error.
+    """
+
+    def __init__(
+        self,
+        text_obs: Observation,
+        capture_image: Callable[[], npt.NDArray[np.uint8]],
+    ) -> None:
+        super().__init__(text=text_obs)
+        self.capture_image = capture_image
+        self.expired = False
+
+    def __missing__(self, key: str) -> Observation:
+        if key != "image":
+            raise KeyError(key)
+        if self.expired:
+            raise RuntimeError(
+                "The image observation must be read before the next step"
+            )
+        image_obs = self.capture_image()
+        self["image"] = image_obs
+        return image_obs
+
+    def __contains__(self, key: object) -> bool:
+        return key == "image" or super().__contains__(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from super().__iter__()
+        if not super().__contains__("image"):
+            yield "image"
+
+    def __len__(self) -> int:
+        return super().__len__() + (not super().__contains__("image"))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def keys(self) -> KeysView[str]:  # type: ignore[override]
+        return KeysView(self)
+
+    def items(self) -> ItemsView[str, Observation]:  # type: ignore[override]
+        return ItemsView(self)
+
+    def values(self) -> ValuesView[Observation]:  # type: ignore[override]
+        return ValuesView(self)
+
+    def copy(self) -> dict[str, Observation]:
+        return dict(self.items())
+
+    def expire(self) -> None:
+        self.expired = True
+
+
 class ObservationHandler:
     """Main entry point to access all observation processor"""
 
@@ -678,15 +1191,38 @@ class ObservationHandler:
         image_observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        bounds_mode: str = "per_node",
+        ax_update_mode: str = "full",
+        verify_ax_cache: bool = False,
+        lazy_image: bool = False,
+        cache_observation: bool = False,
     ) -> None:
         self.main_observation_type = main_observation_type
         self.text_processor = TextObervationProcessor(
-            text_observation_type, current_viewport_only, viewport_size
+            text_observation_type,
+            current_viewport_only,
+            viewport_size,
+            bounds_mode=bounds_mode,
+            ax_update_mode=ax_update_mode,
+            verify_ax_cache=verify_ax_cache,
         )
         self.image_processor = ImageObservationProcessor(
             image_observation_type
         )
         self.viewport_size = viewport_size
+        # only take the screenshot when the image observation is read
+        self.lazy_image = lazy_image and main_observation_type == "text"
+        self.lazy_observation: LazyObservation | None = None
+        # reuse the last observation when the page did not change
+        self.cache_observation = (
+            cache_observation and main_observation_type == "text"
+        )
+        self.cache_key: tuple[Any, ...] | None = None
+        self.cached_text: Observation | None = None
+        self.cached_image: npt.NDArray[np.uint8] | None = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last_cache_hit = False
 
     def get_observation_space(self) -> spaces.Dict:
         text_space = spaces.Text(
@@ -711,13 +1247,140 @@ class ObservationHandler:
 
         return spaces.Dict({"text": text_space, "image": image_space})
 
+    def get_observation_key(
+        self, page: Page, page_state: PageState
+    ) -> tuple[Any, ...]:
+        """The observation is the same as long as this key is the same"""
+        return (
+            page,
+            tuple(page.context.pages),
+            self.text_processor.get_tab_title_str(page, page_state),
+            page_state["url"],
+            page_state["dom_version"],
+            page_state["win_top_bound"],
+            page_state["win_left_bound"],
+            page_state["win_width"],
+            page_state["win_height"],
+            page_state["device_pixel_ratio"],
+            page_state["doc_width"],
+            page_state["doc_height"],
+        )
+
     def get_observation(
         self, page: Page, client: CDPSession
     ) -> dict[str, Observation]:
-        text_obs = self.text_processor.process(page, client)
-        image_obs = self.image_processor.process(page, client)
+        return self.fetch_observation(page, client)()
+
+    def fetch_observation(
+        self, page: Page, client: CDPSession
+    ) -> Callable[[], dict[str, Observation]]:
+        """The browser side of `get_observation`, return the function that
+        builds the observation without the browser, see
+        `TextObervationProcessor.fetch`"""
+        page_state = None
+        if self.cache_observation:
+            try:
+                page_state = self.text_processor.fetch_page_state(page)
+                key = self.get_observation_key(page, page_state)
+            except Exception:
+                page_state, key = None, None
+            self.last_cache_hit = key is not None and key == self.cache_key
+            if self.last_cache_hit:
+                self.cache_hits += 1
+                # the text processor still holds the nodes of this observation
+                self.text_processor.bounds_cdp_calls = 0
+                cached_text = self.cached_text
+                assert cached_text is not None
+                cached_image = self.fetch_image(
+                    page, client, self.cached_image
+                )
+                return lambda: self.make_observation(
+                    cached_text, page, client, cached_image
+                )
+            self.cache_misses += 1
+
+        build_text = self.text_processor.fetch(page, client, page_state)
+        self.cache_key = None
+        self.cached_text = None
+        self.cached_image = None
+        # a change inside an iframe does not change the key, such
+        # observations are always processed again
+        cache_key = None
+        if (
+            self.cache_observation
+            and not self.text_processor.has_frame_content
+        ):
+            assert self.text_processor.page_state is not None
+            cache_key = self.get_observation_key(
+                page, self.text_processor.page_state
+            )
+        image_obs = self.fetch_image(page, client)
+
+        def build() -> dict[str, Observation]:
+            text_obs = build_text()
+            if cache_key is not None:
+                self.cache_key = cache_key
+                self.cached_text = text_obs
+            return self.make_observation(text_obs, page, client, image_obs)
+
+        return build
+
+    def fetch_image(
+        self,
+        page: Page,
+        client: CDPSession,
+        image_obs: npt.NDArray[np.uint8] | None = None,
+    ) -> npt.NDArray[np.uint8] | None:
+        """The screenshot, None if it is only taken once it is read"""
+        if image_obs is None and not self.lazy_image:
+            image_obs = self.image_processor.process(page, client)
+        return image_obs
+
+    def make_observation(
+        self,
+        text_obs: Observation,
+        page: Page,
+        client: CDPSession,
+        image_obs: npt.NDArray[np.uint8] | None = None,
+    ) -> dict[str, Observation]:
+        if image_obs is None and self.lazy_image:
+
+            def capture_image() -> npt.NDArray[np.uint8]:
+                image = self.image_processor.process(page, client)
+                if self.cache_observation:
+                    self.cached_image = image
+                return image
+
+            self.lazy_observation = LazyObservation(text_obs, capture_image)
+            return self.lazy_observation
+        if image_obs is None:
+            image_obs = self.image_processor.process(page, client)
+        if self.cache_observation:
+            self.cached_image = image_obs
         return {"text": text_obs, "image": image_obs}
 
+    @property
+    def observation_cache_stats(self) -> dict[str, Any]:
+        return {
+            "hit": self.last_cache_hit,
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+        }
+
+    def invalidate_observation(self) -> None:
+        """Called before an action that may change the page without any DOM
+        mutation (e.g., a menu shown by a CSS :hover rule, an element that
+        scrolled), the next observation is processed again"""
+        self.cache_key = None
+        self.text_processor.raw_accessibility_tree_key = None
+
+    def expire_observation(self) -> None:
+        """Called before the page changes, the last lazy image can not be
+        captured anymore"""
+        if self.lazy_observation is not None:
+            self.lazy_observation.expire()
+            self.lazy_observation = None
+
     def get_observation_metadata(self) -> dict[str, ObservationMetadata]:
         return {
             "text": self.text_processor.meta_data,
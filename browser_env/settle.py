@@ -0,0 +1,269 @@
+"""Strategies to decide when the page is ready after an action"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from playwright.sync_api import Page, Request
+
+# seconds between two checks of the page state
+POLL_INTERVAL = 0.05
+# the network / DOM has to be quiet for this long to be considered settled
+QUIET_PERIOD = 0.2
+# requests that are still in flight after this long (e.g., long polling) are
+# not waited for
+STALE_REQUEST_AGE = 2.0
+IGNORED_RESOURCE_TYPES = ["websocket", "eventsource"]
+
+# install a MutationObserver in the page (once per document). It records
+# the time of the last DOM mutation and counts the mutations, user inputs and
+# focus changes, which change the page state without changing the DOM
+INSTALL_DOM_OBSERVER_JS = """
+        if (window.__webarenaMutationObserver === undefined) {
+            window.__webarenaLastMutation = performance.now();
+            window.__webarenaDomVersion = 0;
+            const onChange = () => {
+                window.__webarenaLastMutation = performance.now();
+                window.__webarenaDomVersion += 1;
+            };
+            window.__webarenaMutationObserver = new MutationObserver(onChange);
+            window.__webarenaMutationObserver.observe(document, {
+                subtree: true,
+                childList: true,
+                attributes: true,
+                characterData: true,
+            });
+            document.addEventListener("input", onChange, true);
+            document.addEventListener("change", onChange, true);
+            document.addEventListener("focusin", onChange, true);
+            document.addEventListener("focusout", onChange, true);
+        }
+"""
+
+# return the milliseconds since the last DOM mutation
+DOM_QUIET_TIME_JS = (
+    """
+    () => {"""
+    + INSTALL_DOM_OBSERVER_JS
+    + """
+        return performance.now() - window.__webarenaLastMutation;
+    }
+"""
+)
+
+
+# runs a sync function on the thread that drives the browser
+BrowserCall = Callable[..., Awaitable[Any]]
+
+
+def page_loaded(page: Page) -> bool:
+    """Whether the load event of the page fired"""
+    try:
+        return bool(page.evaluate("document.readyState === 'complete'"))
+    except Exception:
+        # the page is navigating
+        return False
+
+
+class NetworkTracker:
+    """Keep track of the in-flight requests of a page"""
+
+    def __init__(self, page: Page) -> None:
+        self.inflight: dict[Request, float] = {}
+        self.last_activity = time.monotonic()
+        page.on("request", self.on_request)
+        page.on("requestfinished", self.on_request_done)
+        page.on("requestfailed", self.on_request_done)
+
+    def detach(self, page: Page) -> None:
+        page.remove_listener("request", self.on_request)
+        page.remove_listener("requestfinished", self.on_request_done)
+        page.remove_listener("requestfailed", self.on_request_done)
+
+    def on_request(self, request: Request) -> None:
+        if request.resource_type in IGNORED_RESOURCE_TYPES:
+            return
+        self.inflight[request] = time.monotonic()
+        self.last_activity = time.monotonic()
+
+    def on_request_done(self, request: Request) -> None:
+        self.inflight.pop(request, None)
+        self.last_activity = time.monotonic()
+
+    def quiet_time(self) -> float:
+        """Seconds since the network became idle, 0 if it is busy"""
+        now = time.monotonic()
+        if any(
+            now - start < STALE_REQUEST_AGE for start in self.inflight.values()
+        ):
+            return 0.0
+        return now - self.last_activity
+
+
+class SettleStrategy:
+    """Wait after an action until the page is ready to be observed.
+
+    `max_wait` is the upper bound of the waiting time in seconds.
+    """
+
+    def __init__(self, max_wait: float) -> None:
+        self.max_wait = max_wait
+
+    def before_action(self, page: Page) -> None:
+        """Called right before the action is executed on the page"""
+        pass
+
+    def wait(self, page: Page) -> float:
+        """Wait until the page settles, return the seconds waited"""
+        raise NotImplementedError
+
+    def release(self, page: Page) -> None:
+        """Remove what the strategy installed on the page, called when the
+        page is not waited for anymore"""
+        pass
+
+    async def wait_async(self, page: Page, run: BrowserCall) -> float:
+        """Same as `wait` without blocking the browser thread, so that the
+        other pages of the browser are driven in the meantime. `run` calls
+        a function on the browser thread."""
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        await run(self.before_poll, page)
+        while time.monotonic() < deadline:
+            if await run(self.is_settled, page):
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+        return time.monotonic() - start
+
+    def before_poll(self, page: Page) -> None:
+        pass
+
+    def is_settled(self, page: Page) -> bool:
+        """Whether the page is ready, checked between the async waits"""
+        raise NotImplementedError
+
+
+class FixedSleepSettle(SettleStrategy):
+    """Always sleep for `max_wait` seconds"""
+
+    def wait(self, page: Page) -> float:
+        if self.max_wait > 0:
+            time.sleep(self.max_wait)
+        return self.max_wait
+
+    async def wait_async(self, page: Page, run: BrowserCall) -> float:
+        if self.max_wait > 0:
+            await asyncio.sleep(self.max_wait)
+        return self.max_wait
+
+
+class LoadStateSettle(SettleStrategy):
+    """Wait for the load event of the page"""
+
+    def wait(self, page: Page) -> float:
+        start = time.monotonic()
+        if self.max_wait > 0:
+            try:
+                page.wait_for_load_state("load", timeout=self.max_wait * 1000)
+            except Exception:
+                pass
+        return time.monotonic() - start
+
+    def is_settled(self, page: Page) -> bool:
+        return page_loaded(page)
+
+
+class PollingSettle(SettleStrategy):
+    """Wait for the load event, then poll until the page is quiet"""
+
+    def __init__(self, max_wait: float) -> None:
+        super().__init__(max_wait)
+        self.trackers: dict[Any, NetworkTracker] = {}
+
+    def track(self, page: Page) -> NetworkTracker:
+        if page not in self.trackers:
+            self.trackers[page] = NetworkTracker(page)
+            page.on("close", self.release)
+        return self.trackers[page]
+
+    def release(self, page: Page) -> None:
+        tracker = self.trackers.pop(page, None)
+        if tracker is not None:
+            tracker.detach(page)
+            page.remove_listener("close", self.release)
+
+    def before_action(self, page: Page) -> None:
+        self.track(page)
+        self.dom_quiet_time(page)
+
+    @staticmethod
+    def dom_quiet_time(page: Page) -> float:
+        """Seconds since the last DOM mutation, 0 if the page is navigating"""
+        try:
+            return float(page.evaluate(DOM_QUIET_TIME_JS)) / 1000
+        except Exception:
+            return 0.0
+
+    def is_quiet(self, page: Page) -> bool:
+        raise NotImplementedError
+
+    def before_poll(self, page: Page) -> None:
+        self.track(page)
+
+    def is_settled(self, page: Page) -> bool:
+        return page_loaded(page) and self.is_quiet(page)
+
+    def wait(self, page: Page) -> float:
+        if self.max_wait <= 0:
+            return 0.0
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        self.track(page)
+        try:
+            page.wait_for_load_state("load", timeout=self.max_wait * 1000)
+        except Exception:
+            pass
+        while time.monotonic() < deadline:
+            if self.is_quiet(page):
+                break
+            # unlike time.sleep, this lets playwright dispatch the events
+            page.wait_for_timeout(POLL_INTERVAL * 1000)
+        return time.monotonic() - start
+
+
+class NetworkIdleSettle(PollingSettle):
+    """Wait until there is no request in flight"""
+
+    def is_quiet(self, page: Page) -> bool:
+        return self.track(page).quiet_time() >= QUIET_PERIOD
+
+
+class DOMQuiescenceSettle(PollingSettle):
+    """Wait until the DOM stops changing"""
+
+    def is_quiet(self, page: Page) -> bool:
+        return self.dom_quiet_time(page) >= QUIET_PERIOD
+
+
+class AdaptiveSettle(PollingSettle):
+    """Wait until both the network and the DOM are quiet"""
+
+    def is_quiet(self, page: Page) -> bool:
+        return (
+            self.track(page).quiet_time() >= QUIET_PERIOD
+            and self.dom_quiet_time(page) >= QUIET_PERIOD
+        )
+
+
+SETTLE_STRATEGIES: dict[str, type[SettleStrategy]] = {
+    "fixed": FixedSleepSettle,
+    "load": LoadStateSettle,
+    "network_idle": NetworkIdleSettle,
+    "dom_quiescence": DOMQuiescenceSettle,
+    "adaptive": AdaptiveSettle,
+}
+
+
+def get_settle_strategy(name: str, max_wait: float) -> SettleStrategy:
+    if name not in SETTLE_STRATEGIES:
+        raise ValueError(f"Unknown settle strategy: {name}")
+    return SETTLE_STRATEGIES[name](max_wait)
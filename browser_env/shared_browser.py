@@ -0,0 +1,113 @@
+"""One browser shared by concurrent episodes of the same process"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from playwright.sync_api import sync_playwright
+
+from .actions import Action
+from .envs import ScriptBrowserEnv
+from .utils import Observation
+
+T = TypeVar("T")
+
+
+class SharedBrowser:
+    """A playwright instance and a browser driven from a dedicated thread.
+
+    The sync playwright API can not be used inside an event loop and its
+    objects belong to the thread that created them, so every call to the
+    browser, its contexts and its pages goes through `run`. The episodes
+    get a context each with `new_env`.
+    """
+
+    def __init__(self, headless: bool = True, slow_mo: int = 0) -> None:
+        self.headless = headless
+        self.slow_mo = slow_mo
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="browser"
+        )
+
+    async def run(
+        self, function: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        """Call the function on the browser thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs)
+        )
+
+    def launch(self) -> None:
+        self.context_manager = sync_playwright()
+        self.playwright = self.context_manager.__enter__()
+        self.browser = self.playwright.chromium.launch(
+            headless=self.headless, slow_mo=self.slow_mo
+        )
+
+    async def start(self) -> None:
+        await self.run(self.launch)
+
+    def new_env(self, **kwargs: Any) -> "SharedBrowserEnv":
+        """Create an environment with its own context in this browser, the
+        arguments are the ones of `ScriptBrowserEnv`"""
+        env = ScriptBrowserEnv(
+            headless=self.headless,
+            slow_mo=self.slow_mo,
+            browser=self.browser,
+            **kwargs,
+        )
+        return SharedBrowserEnv(self, env)
+
+    async def close(self) -> None:
+        await self.run(self.context_manager.__exit__)
+        self.executor.shutdown()
+
+
+class SharedBrowserEnv:
+    """Async view of a `ScriptBrowserEnv` whose browser is shared.
+
+    The page settles and the observation is built from what was fetched
+    from the browser (e.g., the accessibility tree is pruned and
+    serialized) without holding the browser thread, so the other episodes
+    act and observe meanwhile.
+    """
+
+    def __init__(self, browser: SharedBrowser, env: ScriptBrowserEnv) -> None:
+        self.browser = browser
+        self.env = env
+
+    async def run(
+        self, function: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return await self.browser.run(function, *args, **kwargs)
+
+    async def reset(
+        self,
+        *,
+        seed: int | None = None,
+        options: dict[str, str] | None = None,
+    ) -> tuple[dict[str, Observation], dict[str, Any]]:
+        env = self.env
+        await self.run(env.start_episode, seed=seed, options=options)
+        env.last_settle_time = await env.settle_strategy.wait_async(
+            env.page, self.run
+        )
+        build = await self.run(env.fetch_reset_observation)
+        return await asyncio.to_thread(build)
+
+    async def step(
+        self, action: Action
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        env = self.env
+        success, fail_error, action_time = await self.run(env.act, action)
+        env.last_settle_time = await env.settle_strategy.wait_async(
+            env.page, self.run
+        )
+        build = await self.run(
+            env.fetch_step_observation, success, fail_error, action_time
+        )
+        return await asyncio.to_thread(build)
+
+    async def close(self) -> None:
+        await self.run(self.env.close)
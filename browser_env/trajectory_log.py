@@ -0,0 +1,127 @@
+"""Append-only log of the steps and the results of the tasks of a run.
+
+Each record is a json line tagged with its task:
+    {"task_id": 3, "event": "start", "time": 1700000000.0}
+    {"task_id": 3, "event": "step", "step": {...}}
+    {"task_id": 3, "event": "result", "score": 1.0}
+A task that is run again (e.g., retried) starts a new attempt, the reader
+only keeps the last one. Every process writes its own file in the log
+folder, so that the workers of a run never write to the same file.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import IO, Any
+
+import numpy as np
+
+TRAJECTORY_LOG_FOLDER = "trajectories"
+
+
+def to_json(obj: Any) -> Any:
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def get_trajectory_log_path(result_dir: str | Path) -> Path:
+    """The log file of this process in the result dir"""
+    return Path(result_dir) / TRAJECTORY_LOG_FOLDER / f"{os.getpid()}.jsonl"
+
+
+class TrajectoryLog:
+    """Writer of the log, the records are written in batches of
+    `flush_every` and when a task finishes. Thread safe."""
+
+    def __init__(self, path: str | Path, flush_every: int = 16) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self.file: IO[str] = open(self.path, "a")
+        self.buffer: list[str] = []
+        self.lock = threading.Lock()
+
+    def write(self, task_id: int | str, event: str, **kwargs: Any) -> None:
+        record = {"task_id": task_id, "event": event, **kwargs}
+        line = json.dumps(record, default=to_json) + "\n"
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.flush_every:
+                self.flush_buffer()
+
+    def start_task(self, task_id: int | str) -> None:
+        self.write(task_id, "start", time=time.time())
+
+    def add_step(self, task_id: int | str, step: dict[str, Any]) -> None:
+        self.write(task_id, "step", step=step)
+
+    def add_result(self, task_id: int | str, score: float) -> None:
+        self.write(task_id, "result", score=score)
+        self.flush()
+
+    def flush_buffer(self) -> None:
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        self.buffer.clear()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_buffer()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+def read_trajectory_log(path: str | Path) -> dict[str, list[dict[str, Any]]]:
+    """Read a log file or a log folder. Return the last attempt of each
+    task, as the steps followed by {"score": score} if the task finished,
+    i.e., the content of the per-task history json files"""
+    path = Path(path)
+    files = sorted(path.glob("*.jsonl")) if path.is_dir() else [path]
+    # task id -> (start time, records) of the last attempt
+    attempts: dict[str, tuple[float, list[dict[str, Any]]]] = {}
+    for file in files:
+        # the attempts of the tasks in this file
+        current: dict[str, tuple[float, list[dict[str, Any]]]] = {}
+        with open(file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a process that was killed
+                    continue
+                task_id = str(record["task_id"])
+                if record["event"] == "start":
+                    current[task_id] = (record["time"], [])
+                    if task_id not in attempts or (
+                        attempts[task_id][0] <= record["time"]
+                    ):
+                        attempts[task_id] = current[task_id]
+                elif task_id in current:
+                    if record["event"] == "step":
+                        current[task_id][1].append(record["step"])
+                    elif record["event"] == "result":
+                        current[task_id][1].append({"score": record["score"]})
+    return {task_id: records for task_id, (_, records) in attempts.items()}
+
+
+def export_history(result_dir: str | Path) -> None:
+    """Write the history json file of each task of the log of a result dir,
+    for the tools that read them"""
+    log = read_trajectory_log(Path(result_dir) / TRAJECTORY_LOG_FOLDER)
+    for task_id, history in log.items():
+        with open(Path(result_dir) / f"{task_id}.json", "w") as f:
+            json.dump(history, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the history json files of a result dir"
+    )
+    parser.add_argument("result_dir", type=str)
+    args = parser.parse_args()
+    export_history(args.result_dir)
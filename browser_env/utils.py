@@ -5,6 +5,7 @@ from typing import Any, Dict, TypedDict, Union
 import numpy as np
 import numpy.typing as npt
 from PIL import Image
+from typing_extensions import NotRequired
 
 
 @dataclass
@@ -38,6 +39,8 @@ class AccessibilityTreeNode(TypedDict):
     bound: list[float] | None
     union_bound: list[float] | None
     offsetrect_bound: list[float] | None
+    # backend ids of the iframe elements the node is nested in
+    frameOwnerIds: NotRequired[list[str]]
 
 
 class DOMNode(TypedDict):
@@ -63,6 +66,20 @@ class BrowserConfig(TypedDict):
     device_pixel_ratio: float
 
 
+class PageState(TypedDict):
+    url: str
+    title: str
+    win_top_bound: float
+    win_left_bound: float
+    win_width: float
+    win_height: float
+    device_pixel_ratio: float
+    doc_width: float
+    doc_height: float
+    # changes whenever the document is replaced, mutated or receives input
+    dom_version: str
+
+
 class BrowserInfo(TypedDict):
     DOMTree: dict[str, Any]
     config: BrowserConfig
@@ -4,7 +4,6 @@ import collections
 import html
 import importlib
 import json
-import time
 import urllib
 from pathlib import Path
 from typing import Any, Tuple, Union
@@ -14,6 +13,11 @@ from nltk.tokenize import word_tokenize  # type: ignore
 from playwright.sync_api import CDPSession, Page
 
 from browser_env.actions import Action
+from browser_env.settle import (
+    FixedSleepSettle,
+    SettleStrategy,
+    get_settle_strategy,
+)
 from browser_env.utils import StateInfo
 from evaluation_harness.helper_functions import (
     PseudoPage,
@@ -27,6 +31,8 @@ from evaluation_harness.helper_functions import (
 )
 
 Trajectory = list[Union[Action, StateInfo]]
+# seconds to wait for a page opened by the evaluator
+EVAL_SETTLE_MAX_WAIT = 3.0
 
 
 class Evaluator(object):
@@ -245,6 +251,18 @@ class URLEvaluator(Evaluator):
 class HTMLContentEvaluator(Evaluator):
     """Check whether the contents appear in the page"""
 
+    def __init__(
+        self,
+        eval_tag: str = "",
+        settle_strategy: SettleStrategy | None = None,
+    ) -> None:
+        super().__init__(eval_tag)
+        # how to wait for the page after navigation, by default a fixed
+        # sleep, which the reported scores were computed with
+        self.settle_strategy = settle_strategy or FixedSleepSettle(
+            EVAL_SETTLE_MAX_WAIT
+        )
+
     @beartype
     def __call__(
         self,
@@ -257,6 +275,9 @@ class HTMLContentEvaluator(Evaluator):
             configs = json.load(f)
 
         targets = configs["eval"]["program_html"]
+        settle_page = (
+            page.original_page if isinstance(page, PseudoPage) else page
+        )
 
         score = 1.0
         for target in targets:
@@ -270,8 +291,10 @@ class HTMLContentEvaluator(Evaluator):
 
             # navigate to that url
             if target_url != "last":
+                self.settle_strategy.before_action(settle_page)
                 page.goto(target_url)
-                time.sleep(3)  # TODO [shuyanzh]: fix this hard-coded sleep
+                self.settle_strategy.wait(settle_page)
+                self.settle_strategy.release(settle_page)
 
             # empty, use the full page
             if not locator.strip():
@@ -354,8 +377,11 @@ class EvaluatorComb:
 
 
 @beartype
-def evaluator_router(config_file: Path | str) -> EvaluatorComb:
-    """Router to get the evaluator class"""
+def evaluator_router(
+    config_file: Path | str, settle_strategy: str = "fixed"
+) -> EvaluatorComb:
+    """Router to get the evaluator class. `settle_strategy` is how the
+    evaluator waits for the pages it opens, see browser_env.settle"""
     with open(config_file, "r") as f:
         configs = json.load(f)
 
@@ -368,7 +394,13 @@ def evaluator_router(config_file: Path | str) -> EvaluatorComb:
             case "url_match":
                 evaluators.append(URLEvaluator())
             case "program_html":
-                evaluators.append(HTMLContentEvaluator())
+                evaluators.append(
+                    HTMLContentEvaluator(
+                        settle_strategy=get_settle_strategy(
+                            settle_strategy, EVAL_SETTLE_MAX_WAIT
+                        )
+                    )
+                )
             case _:
                 raise ValueError(f"eval_type {eval_type} is not supported")
 
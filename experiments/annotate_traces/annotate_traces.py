@@ -41,6 +41,11 @@ class SingleActionTrace:
         temp_html_path = os.path.abspath("temp.html")
         webbrowser.open(f"file://{temp_html_path}")
 
+def get_image_src(src, filepath):
+    if src.startswith("data:"):
+        return src
+    return f"file://{os.path.abspath(os.path.join(os.path.dirname(filepath), src))}"
+
 def separate_traces(filepath) -> list[SingleActionTrace]:
     with open(filepath, "r") as f:
         content = f.read()
@@ -48,7 +53,8 @@ def separate_traces(filepath) -> list[SingleActionTrace]:
 
         # reformat back into their original html tags
         flattened_observations = [f"<pre>{div.find('pre').text}</pre>" for div in soup.find_all("div", {"class": "state_obv"})]
-        flattened_images = [f"<img src={img['src']}>" for img in soup.find_all("img")]
+        # the screenshots of the media store are linked relative to the render
+        flattened_images = [f"<img src={get_image_src(img['src'], filepath)}>" for img in soup.find_all("img")]
         flattened_urls = [url for url in soup.find_all("h3", {"class": "url"})]
         flattened_prev_actions = [f"<div>{action.text}</div>" for action in soup.find_all("div", {"class": "prev_action"})]
         flattened_raw_predictions = [f"<div>{prediction.text}</div>" for prediction in soup.find_all("div", {"class": "raw_parsed_prediction"})]
@@ -131,12 +131,37 @@ def config() -> argparse.Namespace:
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=1920,
     )
+    parser.add_argument(
+        "--obs_truncation",
+        type=str,
+        choices=["prefix", "priority"],
+        help="prefix: keep the first max_obs_length tokens of the observation, priority: keep whole lines, interactive and visible elements first",
+        default="prefix",
+    )
     parser.add_argument(
         "--model_endpoint",
         help="huggingface model endpoint",
         type=str,
         default="",
     )
+    parser.add_argument(
+        "--llm_cache_mode",
+        type=str,
+        choices=["off", "read_through", "record", "replay"],
+        help="read_through: reuse the recorded responses and record the new ones, record: always call the model, replay: only use the recorded responses",
+        default="off",
+    )
+    parser.add_argument(
+        "--llm_cache_path",
+        type=str,
+        default="cache/llm_responses.sqlite",
+    )
+    parser.add_argument(
+        "--llm_cache_max_mb",
+        type=int,
+        help="the least recently used responses are removed beyond this size",
+        default=1024,
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
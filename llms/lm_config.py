@@ -7,6 +7,8 @@ import dataclasses
 from dataclasses import dataclass
 from typing import Any
 
+from llms.response_cache import ResponseCache
+
 
 @dataclass(frozen=True)
 class LMConfig:
@@ -20,6 +22,8 @@ class LMConfig:
         tokenizer_cls: The Python class corresponding to the tokenizer, mostly
             for Hugging Face transformers.
         mode: The mode of the API calls, e.g., "chat" or "generation".
+        response_cache: The cache of the responses, None to always call
+            the model.
     """
 
     provider: str
@@ -28,11 +32,22 @@ class LMConfig:
     tokenizer_cls: type | None = None
     mode: str | None = None
     gen_config: dict[str, Any] = dataclasses.field(default_factory=dict)
+    response_cache: ResponseCache | None = None
 
 
 def construct_llm_config(args: argparse.Namespace) -> LMConfig:
+    response_cache = None
+    if args.llm_cache_mode != "off":
+        response_cache = ResponseCache(
+            args.llm_cache_path,
+            args.llm_cache_mode,
+            max_size=args.llm_cache_max_mb * 1024 * 1024,
+        )
     llm_config = LMConfig(
-        provider=args.provider, model=args.model, mode=args.mode
+        provider=args.provider,
+        model=args.model,
+        mode=args.mode,
+        response_cache=response_cache,
     )
     if args.provider == "openai":
         llm_config.gen_config["temperature"] = args.temperature
@@ -41,6 +56,7 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
         llm_config.gen_config["max_tokens"] = args.max_tokens
         llm_config.gen_config["stop_token"] = args.stop_token
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_truncation"] = args.obs_truncation
         llm_config.gen_config["max_retry"] = args.max_retry
     elif args.provider == "huggingface":
         llm_config.gen_config["temperature"] = args.temperature
@@ -50,6 +66,7 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
             [args.stop_token] if args.stop_token else None
         )
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_truncation"] = args.obs_truncation
         llm_config.gen_config["model_endpoint"] = args.model_endpoint
         llm_config.gen_config["max_retry"] = args.max_retry
     else:
@@ -0,0 +1,224 @@
+"""Disk-backed cache of the LLM responses, to rerun experiments offline"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+if TYPE_CHECKING:
+    from llms import lm_config
+
+RESPONSE_CACHE_MODES = ["off", "read_through", "record", "replay"]
+
+
+class ResponseCacheMiss(KeyError):
+    """The response is not in the cache in replay mode"""
+
+
+class ResponseCache:
+    """Content-addressed store of the LLM responses in SQLite.
+
+    A request is keyed by the provider, the model, the mode, the generation
+    config and the exact prompt, and by how many times the same request
+    was sent before in this run, so that retries of a prompt replay the
+    recorded retries. Modes:
+        - read_through: return the cached response, call the model on a miss
+        - record: always call the model and store the response
+        - replay: only return cached responses, raise ResponseCacheMiss on
+          a miss
+    When the responses exceed `max_size` bytes, the least recently used
+    ones are removed.
+    """
+
+    def __init__(
+        self, path: str | Path, mode: str, max_size: int = 1 << 30
+    ) -> None:
+        if mode not in RESPONSE_CACHE_MODES or mode == "off":
+            raise ValueError(f"Invalid response cache mode: {mode}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.max_size = max_size
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                last_used REAL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used "
+            "ON responses (last_used)"
+        )
+        # the total size of the responses, kept up to date by `store` and
+        # `evict` in the same transactions, so that a store does not sum the
+        # whole table. Caches without it are summed once
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            )
+            """
+        )
+        self.conn.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('total_size', "
+            "(SELECT COALESCE(SUM(size), 0) FROM responses))"
+        )
+        self.conn.commit()
+        # how many times each request was sent in this run
+        self.occurrences: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_request_hash(config: lm_config.LMConfig, prompt: Any) -> str:
+        request = {
+            "provider": config.provider,
+            "model": config.model,
+            "mode": config.mode,
+            "gen_config": config.gen_config,
+            "prompt": prompt,
+        }
+        return hashlib.sha256(
+            json.dumps(request, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get_key(self, config: lm_config.LMConfig, prompt: Any) -> str:
+        request_hash = self.get_request_hash(config, prompt)
+        occurrence = self.occurrences.get(request_hash, 0)
+        self.occurrences[request_hash] = occurrence + 1
+        return f"{request_hash}:{occurrence}"
+
+    def lookup(self, key: str) -> str | None:
+        row = self.conn.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        self.conn.commit()
+        response: str = row[0]
+        return response
+
+    def store(
+        self, key: str, config: lm_config.LMConfig, response: str
+    ) -> None:
+        size = len(response.encode("utf-8"))
+        row = self.conn.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        replaced_size = row[0] if row is not None else 0
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                config.provider,
+                config.model,
+                response,
+                size,
+                time.time(),
+            ),
+        )
+        self.conn.execute(
+            "UPDATE meta SET value = value + ? WHERE name = 'total_size'",
+            (size - replaced_size,),
+        )
+        self.evict()
+        self.conn.commit()
+
+    @property
+    def total_size(self) -> int:
+        (total_size,) = self.conn.execute(
+            "SELECT value FROM meta WHERE name = 'total_size'"
+        ).fetchone()
+        return int(total_size)
+
+    def evict(self) -> None:
+        """Remove the least recently used responses beyond `max_size`"""
+        excess = self.total_size - self.max_size
+        if excess <= 0:
+            return
+        evicted = []
+        evicted_size = 0
+        for key, size in self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        ):
+            if evicted_size >= excess:
+                break
+            evicted.append((key,))
+            evicted_size += size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.conn.execute(
+            "UPDATE meta SET value = value - ? WHERE name = 'total_size'",
+            (evicted_size,),
+        )
+
+    def get_cached(self, key: str, config: lm_config.LMConfig) -> str | None:
+        """Return the cached response, None if the model has to be called"""
+        if self.mode == "record":
+            return None
+        response = self.lookup(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        self.misses += 1
+        if self.mode == "replay":
+            raise ResponseCacheMiss(
+                f"No recorded response for {config.provider} "
+                f"{config.model} (key {key})"
+            )
+        return None
+
+    def call(
+        self,
+        config: lm_config.LMConfig,
+        prompt: Any,
+        generate: Callable[[], str],
+    ) -> str:
+        """Return the response to the prompt, `generate` calls the model"""
+        key = self.get_key(config, prompt)
+        response = self.get_cached(key, config)
+        if response is None:
+            response = generate()
+            self.store(key, config, response)
+        return response
+
+    async def acall(
+        self,
+        config: lm_config.LMConfig,
+        prompt: Any,
+        agenerate: Callable[[], Awaitable[str]],
+    ) -> str:
+        """Same as `call`, `agenerate` calls the model asynchronously"""
+        key = self.get_key(config, prompt)
+        response = self.get_cached(key, config)
+        if response is None:
+            response = await agenerate()
+            self.store(key, config, response)
+        return response
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,11 +1,20 @@
+from collections import OrderedDict
 from typing import Any
 
 import tiktoken
 from transformers import LlamaTokenizer  # type: ignore
 
+# the token ids of this many chunks are cached
+TOKEN_CACHE_SIZE = 100_000
+
 
 class Tokenizer(object):
-    def __init__(self, provider: str, model_name: str) -> None:
+    def __init__(
+        self,
+        provider: str,
+        model_name: str,
+        cache_size: int = TOKEN_CACHE_SIZE,
+    ) -> None:
         if provider == "openai":
             self.tokenizer = tiktoken.encoding_for_model(model_name)
         elif provider == "huggingface":
@@ -16,6 +25,11 @@ class Tokenizer(object):
             self.tokenizer.add_eos_token = False  # type: ignore[attr-defined]
         else:
             raise NotImplementedError
+        # least recently used chunk first
+        self.cache: OrderedDict[str, list[int]] = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def encode(self, text: str) -> list[int]:
         return self.tokenizer.encode(text)
@@ -25,3 +39,40 @@ class Tokenizer(object):
 
     def __call__(self, text: str) -> list[int]:
         return self.tokenizer.encode(text)
+
+    def encode_chunk(self, chunk: str) -> list[int]:
+        """Same as `encode`, memoized with LRU eviction. Do not modify the
+        returned ids."""
+        if chunk in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(chunk)
+            return self.cache[chunk]
+        self.cache_misses += 1
+        ids = self.encode(chunk)
+        self.cache[chunk] = ids
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return ids
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens of a multi-line string, summed over its lines.
+
+        Each line is encoded with its newline and cached, so the lines
+        shared by consecutive observations are only encoded once. The text
+        is split into tokens differently at the line boundaries, so the sum
+        is an estimate of `len(encode(text))`: it can be higher or lower,
+        by about one token per line.
+        """
+        return sum(
+            len(self.encode_chunk(line)) for line in text.splitlines(True)
+        )
+
+    @property
+    def cache_stats(self) -> dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "size": len(self.cache),
+        }
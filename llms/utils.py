@@ -1,6 +1,9 @@
 import argparse
+import asyncio
 from typing import Any
 
+import aiolimiter
+
 from llms import (
     generate_from_huggingface_completion,
     generate_from_openai_chat_completion,
@@ -14,6 +17,39 @@ APIInput = str | list[Any] | dict[str, Any]
 def call_llm(
     lm_config: lm_config.LMConfig,
     prompt: APIInput,
+) -> str:
+    if lm_config.response_cache is not None:
+        return lm_config.response_cache.call(
+            lm_config, prompt, lambda: generate_response(lm_config, prompt)
+        )
+    return generate_response(lm_config, prompt)
+
+
+async def acall_llm(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
+    limiter: aiolimiter.AsyncLimiter,
+) -> str:
+    """Same as `call_llm` for concurrent episodes. The requests of all the
+    episodes share the rate limit of `limiter`, and the model is called in
+    a worker thread so that the other episodes keep running."""
+
+    async def agenerate() -> str:
+        async with limiter:
+            return await asyncio.to_thread(
+                generate_response, lm_config, prompt
+            )
+
+    if lm_config.response_cache is not None:
+        return await lm_config.response_cache.acall(
+            lm_config, prompt, agenerate
+        )
+    return await agenerate()
+
+
+def generate_response(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
 ) -> str:
     response: str
     if lm_config.provider == "openai":
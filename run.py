@@ -1,17 +1,27 @@
 """Script to run end-to-end evaluation on the benchmark"""
 import argparse
+import asyncio
+import copy
 import glob
 import json
 import logging
+import multiprocessing
 import os
 import random
 import subprocess
 import tempfile
 import time
-import copy
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing.connection import Connection, wait
 from pathlib import Path
+from typing import Any, Callable, Generator
 
+import aiolimiter
+import numpy as np
 import openai
+from playwright.sync_api import Browser
 
 from agent import (
     Agent,
@@ -22,23 +32,30 @@ from agent import (
 from agent.prompts import *
 from browser_env import (
     Action,
+    ActionParsingError,
     ActionTypes,
     ScriptBrowserEnv,
+    SharedBrowser,
+    SharedBrowserEnv,
     StateInfo,
     Trajectory,
+    TrajectoryLog,
     create_stop_action,
 )
 from browser_env.actions import is_equivalent
-from browser_env.auto_login import get_site_comb_from_filepath
+from browser_env.auto_login import (
+    LoginService,
+    get_site_comb_from_filepath,
+)
 from browser_env.helper_functions import (
     RenderHelper,
     get_action_description,
 )
+from browser_env.media_store import MEDIA_FORMATS, MediaStore
+from browser_env.trajectory_log import get_trajectory_log_path
+from browser_env.utils import Observation
 from evaluation_harness import evaluator_router
 
-import numpy.typing as npt
-import numpy as np
-
 LOG_FOLDER = "log_files"
 Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
 LOG_FILE_NAME = f"{LOG_FOLDER}/log_{time.strftime('%Y%m%d%H%M%S', time.localtime())}_{random.randint(0, 10000)}.log"
@@ -91,8 +108,102 @@ def config() -> argparse.Namespace:
     parser.add_argument("--viewport_height", type=int, default=720)
     parser.add_argument("--save_trace_enabled", action="store_true")
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
+    parser.add_argument(
+        "--bounds_mode",
+        choices=["per_node", "bulk", "snapshot"],
+        default="per_node",
+        help="How to resolve the bounding boxes of the observation nodes",
+    )
+    parser.add_argument(
+        "--settle_strategy",
+        choices=[
+            "fixed",
+            "load",
+            "network_idle",
+            "dom_quiescence",
+            "adaptive",
+        ],
+        default="fixed",
+        help="How to wait for the page after an action, "
+        "sleep_after_execution is the upper bound of the waiting time. The "
+        "evaluator waits for the pages it opens in the same way, up to 3s",
+    )
+    parser.add_argument(
+        "--ax_update_mode",
+        choices=["full", "incremental"],
+        default="full",
+        help="Reuse the accessibility tree of the last step while the DOM "
+        "does not change, and only serialize again the subtrees that "
+        "changed",
+    )
+    parser.add_argument(
+        "--verify_ax_cache",
+        action="store_true",
+        help="Compare every reused or incrementally serialized accessibility "
+        "tree with a fresh one, the mismatches are reported with the stats "
+        "of the run",
+    )
+    parser.add_argument(
+        "--cache_observation",
+        action="store_true",
+        help="Reuse the last observation when the page did not change",
+    )
+    parser.add_argument(
+        "--persistent_browser",
+        action="store_true",
+        help="Reuse one browser across tasks and only create a new context per task",
+    )
+
+    parser.add_argument(
+        "--login_mode",
+        choices=["service", "subprocess"],
+        default="service",
+        help="service: reuse the login cookies of the site combinations across tasks and renew them in the running browser when they expire, subprocess: login in a new browser for each task",
+    )
+    parser.add_argument(
+        "--media_format",
+        choices=MEDIA_FORMATS + ["inline"],
+        default="webp",
+        help="how the screenshots of the renders and the history are stored, webp or png: once per distinct screenshot in the media folder of the result dir, inline: as base64 png in the renders",
+    )
+    parser.add_argument(
+        "--auth_folder",
+        type=str,
+        default="./.auth",
+        help="where the login service keeps the cookies",
+    )
 
     parser.add_argument("--max_steps", type=int, default=30)
+    parser.add_argument(
+        "--episode_driver",
+        choices=["sync", "async", "concurrent", "pool"],
+        default="sync",
+        help="async: call the LLM and render in the background, and prepare the next task during the current one, concurrent: run several episodes at the same time in one browser, pool: run the tasks in worker processes that are restarted when they crash or hang",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="number of episodes run at the same time by the concurrent driver, number of worker processes of the pool driver",
+    )
+    parser.add_argument(
+        "--task_timeout",
+        type=float,
+        default=1800.0,
+        help="seconds after which the pool driver restarts the worker of a task and retries the task",
+    )
+    parser.add_argument(
+        "--max_task_retries",
+        type=int,
+        default=2,
+        help="how many times the pool driver retries a task that crashed, timed out, failed with an error or was logged out",
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=300,
+        help="rate limit of the LLM requests of all the concurrent episodes",
+    )
 
     # agent config
     parser.add_argument("--agent_type", type=str, default="prompt")
@@ -135,12 +246,37 @@ def config() -> argparse.Namespace:
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=1920,
     )
+    parser.add_argument(
+        "--obs_truncation",
+        type=str,
+        choices=["prefix", "priority"],
+        help="prefix: keep the first max_obs_length tokens of the observation, priority: keep whole lines, interactive and visible elements first",
+        default="prefix",
+    )
     parser.add_argument(
         "--model_endpoint",
         help="huggingface model endpoint",
         type=str,
         default="",
     )
+    parser.add_argument(
+        "--llm_cache_mode",
+        type=str,
+        choices=["off", "read_through", "record", "replay"],
+        help="read_through: reuse the recorded responses and record the new ones, record: always call the model, replay: only use the recorded responses",
+        default="off",
+    )
+    parser.add_argument(
+        "--llm_cache_path",
+        type=str,
+        default="cache/llm_responses.sqlite",
+    )
+    parser.add_argument(
+        "--llm_cache_max_mb",
+        type=int,
+        help="the least recently used responses are removed beyond this size",
+        default=1024,
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
@@ -218,26 +354,47 @@ def early_stop(
     return False, ""
 
 
-def ndarray_to_list(v):
-    if isinstance(v, np.ndarray):
-        return v.tolist()
-    return v
-
-def test(
-    args: argparse.Namespace,
-    agent: Agent | PromptAgent | TeacherForcingAgent,
-    config_file_list: list[str],
-) -> None:
-    scores = []
-    history = []
-    max_steps = args.max_steps
+def prepare_task(
+    config_file: str, login_service: LoginService | None = None
+) -> tuple[str, str, int]:
+    """Load the task config and login to its sites. Return the config file
+    to use, the intent and the task id. Without `login_service`, the login
+    runs in a new browser for each task"""
+    # get intent
+    with open(config_file) as f:
+        _c = json.load(f)
+        intent = _c["intent"]
+        task_id = _c["task_id"]
+        # automatically login
+        if _c["storage_state"]:
+            cookie_file_name = os.path.basename(_c["storage_state"])
+            comb = get_site_comb_from_filepath(cookie_file_name)
+            temp_dir = tempfile.mkdtemp()
+            if login_service is not None:
+                _c["storage_state"] = login_service.get_storage_state(comb)
+            else:
+                # subprocess to renew the cookie
+                subprocess.run(
+                    [
+                        "python",
+                        "browser_env/auto_login.py",
+                        "--auth_folder",
+                        temp_dir,
+                        "--site_list",
+                        *comb,
+                    ]
+                )
+                _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
+            assert os.path.exists(_c["storage_state"])
+            # update the config file
+            config_file = f"{temp_dir}/{os.path.basename(config_file)}"
+            with open(config_file, "w") as f:
+                json.dump(_c, f)
+    return config_file, intent, task_id
 
-    early_stop_thresholds = {
-        "parsing_failure": args.parsing_failure_th,
-        "repeating_action": args.repeating_action_failure_th,
-    }
 
-    env = ScriptBrowserEnv(
+def construct_env(args: argparse.Namespace) -> ScriptBrowserEnv:
+    return ScriptBrowserEnv(
         headless=not args.render,
         slow_mo=args.slow_mo,
         observation_type=args.observation_type,
@@ -248,132 +405,576 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        bounds_mode=args.bounds_mode,
+        ax_update_mode=args.ax_update_mode,
+        verify_ax_cache=args.verify_ax_cache,
+        persistent_browser=args.persistent_browser,
+        # the screenshot is only read by the render helper, before env.step
+        lazy_image_observation=True,
+        settle_strategy=args.settle_strategy,
+        cache_observation=args.cache_observation,
+    )
+
+
+def construct_login_service(
+    args: argparse.Namespace, get_browser: Callable[[], Browser]
+) -> LoginService | None:
+    if args.login_mode == "subprocess":
+        return None
+    return LoginService(get_browser, auth_folder=args.auth_folder)
+
+
+def construct_media_store(args: argparse.Namespace) -> MediaStore | None:
+    if args.media_format == "inline":
+        return None
+    return MediaStore(Path(args.result_dir) / "media", args.media_format)
+
+
+def get_history_obs(obs: Any, media_store: MediaStore | None) -> Any:
+    """The observation recorded in the history, the screenshots are
+    recorded by their file name in the media store"""
+    if isinstance(obs, np.ndarray) and media_store is not None:
+        return {"media": media_store.put(obs)}
+    return str(obs)
+
+
+def construct_trajectory_log(args: argparse.Namespace) -> TrajectoryLog | None:
+    """The log of the steps of this process, None if they are not saved"""
+    if not args.save_trace_enabled:
+        return None
+    return TrajectoryLog(get_trajectory_log_path(args.result_dir))
+
+
+def log_stats(
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    login_service: LoginService | None,
+    media_store: MediaStore | None = None,
+    envs: list[ScriptBrowserEnv] | None = None,
+) -> None:
+    if isinstance(agent, PromptAgent):
+        logger.info(
+            f"Tokenizer cache: {agent.prompt_constructor.tokenizer.cache_stats}"
+        )
+        if agent.lm_config.response_cache is not None:
+            logger.info(
+                f"LLM response cache: {agent.lm_config.response_cache.stats}"
+            )
+    if login_service is not None:
+        logger.info(f"Login service: {login_service.stats}")
+    if media_store is not None:
+        logger.info(f"Media store: {media_store.stats}")
+    # summed over the environments, with --ax_update_mode incremental
+    ax_tree_cache_stats: Counter[str] = Counter()
+    for env in envs or []:
+        text_processor = env.observation_handler.text_processor
+        ax_tree_cache_stats.update(text_processor.ax_tree_cache_stats)
+    if ax_tree_cache_stats["hits"] + ax_tree_cache_stats["misses"] > 0:
+        logger.info(f"Accessibility tree cache: {dict(ax_tree_cache_stats)}")
+
+
+def log_unhandled_error(
+    args: argparse.Namespace, config_file: str, e: Exception
+) -> None:
+    logger.info(f"[Unhandled Error] {repr(e)}]")
+    import traceback
+
+    # write to error file
+    with open(Path(args.result_dir) / "error.txt", "a") as f:
+        f.write(f"[Config file]: {config_file}\n")
+        f.write(f"[Unhandled Error] {repr(e)}\n")
+        f.write(traceback.format_exc())  # write stack trace to file
+
+
+# a call to a method of the episode of a driver: its name and arguments
+EpisodeCall = tuple[str, tuple[Any, ...]]
+
+
+def episode_steps(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    intent: str,
+    task_id: int,
+    state_info: StateInfo,
+    trajectory_log: TrajectoryLog | None = None,
+    media_store: MediaStore | None = None,
+) -> Generator[EpisodeCall, Any, Trajectory]:
+    """Step the episode from its first observation until it stops, return
+    the trajectory.
+
+    The loop is shared by the drivers. The model, the browser and the render
+    are reached by yielding a call to the `next_action`, `render`, `step` or
+    `sleep` method of the driver's episode, see `run_steps` and
+    `arun_steps`. The result of the call is sent back, its error is thrown.
+    """
+    early_stop_thresholds = {
+        "parsing_failure": args.parsing_failure_th,
+        "repeating_action": args.repeating_action_failure_th,
+    }
+    trajectory: Trajectory = [state_info]
+    meta_data = {"action_history": ["None"]}
+    while True:
+        early_stop_flag, stop_info = early_stop(
+            trajectory, args.max_steps, early_stop_thresholds
+        )
+
+        obs = state_info["observation"][agent.prompt_constructor.obs_modality]
+
+        llm_start = time.monotonic()
+        if early_stop_flag:
+            action = create_stop_action(f"Early stop: {stop_info}")
+        else:
+            try:
+                action = yield "next_action", (trajectory, intent, meta_data)
+            except ValueError as e:
+                # get the error message
+                action = create_stop_action(f"ERROR: {str(e)}")
+        llm_time = time.monotonic() - llm_start
+
+        try:
+            parsed_response = agent.prompt_constructor.extract_action(
+                action["raw_prediction"]
+            )
+        except ActionParsingError as e:
+            logger.info(f"[Parsing Error] {e}")
+            yield "sleep", (1,)
+            continue
+
+        trajectory.append(action)
+
+        action_str = get_action_description(
+            action,
+            state_info["info"]["observation_metadata"],
+            action_set_tag=args.action_set_tag,
+            prompt_constructor=agent.prompt_constructor
+            if isinstance(agent, PromptAgent)
+            else None,
+        )
+        yield "render", (action, state_info, copy.deepcopy(meta_data))
+        meta_data["action_history"].append(action_str)
+
+        step_history = {
+            "action": action,
+            "intent": intent,
+            "meta_data": copy.deepcopy(meta_data),
+            "obs": get_history_obs(obs, media_store),
+            "parsed_response": parsed_response,
+            "url": state_info["info"]["page"].url,
+        }
+
+        if action["action_type"] == ActionTypes.STOP:
+            if trajectory_log is not None:
+                trajectory_log.add_step(task_id, step_history)
+            break
+
+        observation, _, terminated, _, info = yield "step", (action,)
+        state_info = {"observation": observation, "info": info}
+        trajectory.append(state_info)
+
+        timings = {"llm": llm_time, **info["timings"]}
+        step_history["timings"] = timings
+        logger.info(
+            "[Step timings] "
+            + ", ".join(f"{k}: {v:.2f}s" for k, v in timings.items())
+        )
+        if trajectory_log is not None:
+            trajectory_log.add_step(task_id, step_history)
+
+        if terminated:
+            # add a action place holder
+            trajectory.append(create_stop_action(""))
+            break
+    return trajectory
+
+
+class Episode:
+    """The model, the browser and the render of an episode of `test`"""
+
+    def __init__(
+        self,
+        agent: Agent | PromptAgent | TeacherForcingAgent,
+        env: ScriptBrowserEnv,
+        render_helper: RenderHelper,
+        render_screenshot: bool,
+    ) -> None:
+        self.agent = agent
+        self.env = env
+        self.render_helper = render_helper
+        self.render_screenshot = render_screenshot
+
+    def next_action(
+        self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
+    ) -> Action:
+        return self.agent.next_action(trajectory, intent, meta_data=meta_data)
+
+    def render(
+        self, action: Action, state_info: StateInfo, meta_data: dict[str, Any]
+    ) -> None:
+        self.render_helper.render(
+            action, state_info, meta_data, self.render_screenshot
+        )
+
+    def step(
+        self, action: Action
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        return self.env.step(action)
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class ThreadedEpisode:
+    """Episode of `test_async`. The model is called in a worker thread, the
+    browser from its own thread, and the renders are written in order by
+    `writer` with their futures collected in `writes`."""
+
+    def __init__(
+        self,
+        agent: Agent | PromptAgent | TeacherForcingAgent,
+        env: ScriptBrowserEnv,
+        render_helper: RenderHelper,
+        render_screenshot: bool,
+        browser: ThreadPoolExecutor,
+        writer: ThreadPoolExecutor,
+        writes: list[asyncio.Future[None]],
+    ) -> None:
+        self.agent = agent
+        self.env = env
+        self.render_helper = render_helper
+        self.render_screenshot = render_screenshot
+        self.loop = asyncio.get_running_loop()
+        self.browser = browser
+        self.writer = writer
+        self.writes = writes
+
+    async def next_action(
+        self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
+    ) -> Action:
+        return await asyncio.to_thread(
+            self.agent.next_action, trajectory, intent, meta_data=meta_data
+        )
+
+    async def render(
+        self, action: Action, state_info: StateInfo, meta_data: dict[str, Any]
+    ) -> None:
+        if self.render_screenshot:
+            # the screenshot has to be taken before the next step
+            await self.loop.run_in_executor(
+                self.browser, state_info["observation"].__getitem__, "image"
+            )
+        self.writes.append(
+            self.loop.run_in_executor(
+                self.writer,
+                self.render_helper.render,
+                action,
+                state_info,
+                meta_data,
+                self.render_screenshot,
+            )
+        )
+
+    async def step(
+        self, action: Action
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        return await self.loop.run_in_executor(
+            self.browser, self.env.step, action
+        )
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+class SharedEpisode:
+    """Episode of `test_concurrent`, its browser is shared with the other
+    episodes and its requests to the model are rate limited by `limiter`"""
+
+    def __init__(
+        self,
+        agent: PromptAgent,
+        env: SharedBrowserEnv,
+        limiter: aiolimiter.AsyncLimiter,
+        render_helper: RenderHelper,
+        render_screenshot: bool,
+    ) -> None:
+        self.agent = agent
+        self.env = env
+        self.limiter = limiter
+        self.render_helper = render_helper
+        self.render_screenshot = render_screenshot
+
+    async def next_action(
+        self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
+    ) -> Action:
+        return await self.agent.anext_action(
+            trajectory, intent, meta_data, self.limiter
+        )
+
+    async def render(
+        self, action: Action, state_info: StateInfo, meta_data: dict[str, Any]
+    ) -> None:
+        if self.render_screenshot:
+            # the screenshot is taken by the browser thread
+            await self.env.run(state_info["observation"].__getitem__, "image")
+        await asyncio.to_thread(
+            self.render_helper.render,
+            action,
+            state_info,
+            meta_data,
+            self.render_screenshot,
+        )
+
+    async def step(
+        self, action: Action
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        return await self.env.step(action)
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+def run_steps(
+    steps: Generator[EpisodeCall, Any, Trajectory], episode: Episode
+) -> Trajectory:
+    """Run `episode_steps` with the methods of the sync `episode`"""
+    result: Any = None
+    error: Exception | None = None
+    try:
+        while True:
+            if error is None:
+                name, call_args = steps.send(result)
+            else:
+                name, call_args = steps.throw(error)
+            try:
+                result, error = getattr(episode, name)(*call_args), None
+            except Exception as e:
+                result, error = None, e
+    except StopIteration as stop:
+        trajectory: Trajectory = stop.value
+        return trajectory
+
+
+async def arun_steps(
+    steps: Generator[EpisodeCall, Any, Trajectory],
+    episode: ThreadedEpisode | SharedEpisode,
+) -> Trajectory:
+    """Same as `run_steps`, with the async methods of `episode`"""
+    result: Any = None
+    error: Exception | None = None
+    try:
+        while True:
+            if error is None:
+                name, call_args = steps.send(result)
+            else:
+                name, call_args = steps.throw(error)
+            try:
+                result, error = await getattr(episode, name)(*call_args), None
+            except Exception as e:
+                result, error = None, e
+    except StopIteration as stop:
+        trajectory: Trajectory = stop.value
+        return trajectory
+
+
+def run_task(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    env: ScriptBrowserEnv,
+    config_file: str,
+    trajectory_log: TrajectoryLog | None = None,
+    login_service: LoginService | None = None,
+    media_store: MediaStore | None = None,
+) -> float:
+    """Run the episode of one task, return its score"""
+    render_helper = RenderHelper(
+        config_file, args.result_dir, args.action_set_tag, media_store
     )
+    try:
+        config_file, intent, task_id = prepare_task(config_file, login_service)
+        if trajectory_log is not None:
+            trajectory_log.start_task(task_id)
+
+        logger.info(f"[Config file]: {config_file}")
+        logger.info(f"[Intent]: {intent}")
+
+        agent.reset(config_file)
+        obs, info = env.reset(options={"config_file": config_file})
+        state_info: StateInfo = {"observation": obs, "info": info}
+        episode = Episode(agent, env, render_helper, args.render_screenshot)
+        trajectory = run_steps(
+            episode_steps(
+                args,
+                agent,
+                intent,
+                task_id,
+                state_info,
+                trajectory_log,
+                media_store,
+            ),
+            episode,
+        )
+
+        evaluator = evaluator_router(
+            config_file, settle_strategy=args.settle_strategy
+        )
+        score = evaluator(
+            trajectory=trajectory,
+            config_file=config_file,
+            page=env.page,
+            client=env.get_page_client(env.page),
+        )
+        if trajectory_log is not None:
+            trajectory_log.add_result(task_id, score)
+
+        if score == 1:
+            logger.info(f"[Result] (PASS) {config_file}")
+        else:
+            logger.info(f"[Result] (FAIL) {config_file}")
+
+        if args.save_trace_enabled:
+            env.save_trace(Path(args.result_dir) / "traces" / f"{task_id}.zip")
+    finally:
+        render_helper.close()
+    return score
+
+
+def test(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    config_file_list: list[str],
+) -> None:
+    scores = []
+    env = construct_env(args)
+    login_service = construct_login_service(args, env.get_browser)
+    trajectory_log = construct_trajectory_log(args)
+    media_store = construct_media_store(args)
 
     for config_file in config_file_list:
+        try:
+            score = run_task(
+                args,
+                agent,
+                env,
+                config_file,
+                trajectory_log,
+                login_service,
+                media_store,
+            )
+            scores.append(score)
+        except openai.error.OpenAIError as e:
+            logger.info(f"[OpenAI Error] {repr(e)}")
+        except Exception as e:
+            log_unhandled_error(args, config_file, e)
+        check_logged_out(args, config_file, login_service)
+
+    env.close()
+    if trajectory_log is not None:
+        trajectory_log.close()
+    if media_store is not None:
+        media_store.close()
+    logger.info(f"Average score: {sum(scores) / len(scores)}")
+    log_stats(agent, login_service, media_store, [env])
+
+
+async def test_async(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    config_file_list: list[str],
+) -> None:
+    """Same as `test`, with the work that does not need the browser moved off
+    the critical path of the episode.
+
+    The LLM is called in a worker thread. Rendering runs in order on a
+    background thread, and the next task is loaded (including
+    the login) once the current one is reset, while it runs. The sync
+    playwright API can not be used inside the event loop, so the browser is
+    driven from its own thread.
+    """
+    loop = asyncio.get_running_loop()
+    scores = []
+
+    env = construct_env(args)
+    # every call to the browser goes through this thread
+    browser = ThreadPoolExecutor(max_workers=1)
+    # renders, in submission order
+    writer = ThreadPoolExecutor(max_workers=1)
+    # the next task is prepared while the current one runs
+    preparer = ThreadPoolExecutor(max_workers=1)
+    login_service = construct_login_service(args, env.get_browser)
+    trajectory_log = construct_trajectory_log(args)
+    media_store = construct_media_store(args)
+    if login_service is not None:
+        # the login service uses the browser
+        preparer = browser
+    prepared: dict[int, asyncio.Future[tuple[str, str, int]]] = {}
+
+    def prepare(task_idx: int) -> None:
+        if task_idx < len(config_file_list) and task_idx not in prepared:
+            prepared[task_idx] = loop.run_in_executor(
+                preparer,
+                prepare_task,
+                config_file_list[task_idx],
+                login_service,
+            )
+
+    for task_idx, config_file in enumerate(config_file_list):
+        writes: list[asyncio.Future[None]] = []
         try:
             render_helper = RenderHelper(
-                config_file, args.result_dir, args.action_set_tag
+                config_file, args.result_dir, args.action_set_tag, media_store
             )
-            # get intent
-            with open(config_file) as f:
-                _c = json.load(f)
-                intent = _c["intent"]
-                task_id = _c["task_id"]
-                # automatically login
-                if _c["storage_state"]:
-                    cookie_file_name = os.path.basename(_c["storage_state"])
-                    comb = get_site_comb_from_filepath(cookie_file_name)
-                    temp_dir = tempfile.mkdtemp()
-                    # subprocess to renew the cookie
-                    subprocess.run(
-                        [
-                            "python",
-                            "browser_env/auto_login.py",
-                            "--auth_folder",
-                            temp_dir,
-                            "--site_list",
-                            *comb,
-                        ]
-                    )
-                    _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
-                    assert os.path.exists(_c["storage_state"])
-                    # update the config file
-                    config_file = f"{temp_dir}/{os.path.basename(config_file)}"
-                    with open(config_file, "w") as f:
-                        json.dump(_c, f)
+            prepare(task_idx)
+            config_file, intent, task_id = await prepared.pop(task_idx)
+            if trajectory_log is not None:
+                trajectory_log.start_task(task_id)
 
             logger.info(f"[Config file]: {config_file}")
             logger.info(f"[Intent]: {intent}")
 
             agent.reset(config_file)
-            trajectory: Trajectory = []
-            obs, info = env.reset(options={"config_file": config_file})
+            obs, info = await loop.run_in_executor(
+                browser,
+                partial(env.reset, options={"config_file": config_file}),
+            )
+            # the next task is prepared once this one is reset, its login
+            # then runs on the browser thread while the LLM is called
+            prepare(task_idx + 1)
             state_info: StateInfo = {"observation": obs, "info": info}
-            trajectory.append(state_info)
-
-            meta_data = {"action_history": ["None"]}
-            while True:
-                early_stop_flag, stop_info = early_stop(
-                    trajectory, max_steps, early_stop_thresholds
-                )
-
-                obs = trajectory[-1]["observation"][agent.prompt_constructor.obs_modality]  
-
-                if early_stop_flag:
-                    action = create_stop_action(f"Early stop: {stop_info}")
-                else:
-                    try:
-                        action = agent.next_action(
-                            trajectory, intent, meta_data=meta_data
-                        )
-                    except ValueError as e:
-                        # get the error message
-                        action = create_stop_action(f"ERROR: {str(e)}")
+            episode = ThreadedEpisode(
+                agent,
+                env,
+                render_helper,
+                args.render_screenshot,
+                browser,
+                writer,
+                writes,
+            )
+            trajectory = await arun_steps(
+                episode_steps(
+                    args,
+                    agent,
+                    intent,
+                    task_id,
+                    state_info,
+                    trajectory_log,
+                    media_store,
+                ),
+                episode,
+            )
 
-                try:
-                    parsed_response = agent.prompt_constructor.extract_action(
-                        action["raw_prediction"]
-                    )
-                except ActionParsingError as e:
-                    print("Unexpected error:", e)
-                    time.sleep(1)
-                    continue
-
-                trajectory.append(action)
-                
-
-                action_str = get_action_description(
-                    action,
-                    state_info["info"]["observation_metadata"],
-                    action_set_tag=args.action_set_tag,
-                    prompt_constructor=agent.prompt_constructor
-                    if isinstance(agent, PromptAgent)
-                    else None,
-                )
-                render_helper.render(
-                    action, state_info, meta_data, args.render_screenshot
-                )
-                meta_data["action_history"].append(action_str)
-                
-                         
-
-                history.append({
-                    "action": action,
-                    "intent": intent,
-                    "meta_data": copy.deepcopy(meta_data),
-                    "obs": str(obs),
-                    "parsed_response": parsed_response,
-                    "url": env.page.url
-                })
-
-
-                if action["action_type"] == ActionTypes.STOP:
-                    break
-
-                obs, _, terminated, _, info = env.step(action)
-                state_info = {"observation": obs, "info": info}
-                trajectory.append(state_info)
-
-                if args.save_trace_enabled:
-                    with open(
-                        Path(args.result_dir) / f"{task_id}.json", "w"
-                    ) as f:
-                        json.dump(history, f, indent=4, default=ndarray_to_list)
-
-                if terminated:
-                    # add a action place holder
-                    trajectory.append(create_stop_action(""))
-                    break
-
-            evaluator = evaluator_router(config_file)
-            score = evaluator(
-                trajectory=trajectory,
-                config_file=config_file,
-                page=env.page,
-                client=env.get_page_client(env.page),
+            evaluator = evaluator_router(
+                config_file, settle_strategy=args.settle_strategy
+            )
+            score = await loop.run_in_executor(
+                browser,
+                partial(
+                    evaluator,
+                    trajectory=trajectory,
+                    config_file=config_file,
+                    page=env.page,
+                    client=env.get_page_client(env.page),
+                ),
             )
-            history.append({"score": score})
+            if trajectory_log is not None:
+                trajectory_log.add_result(task_id, score)
             scores.append(score)
 
             if score == 1:
@@ -381,32 +982,459 @@ def test(
             else:
                 logger.info(f"[Result] (FAIL) {config_file}")
 
-
             if args.save_trace_enabled:
-                env.save_trace(
-                    Path(args.result_dir) / "traces" / f"{task_id}.zip"
+                await loop.run_in_executor(
+                    browser,
+                    env.save_trace,
+                    Path(args.result_dir) / "traces" / f"{task_id}.zip",
                 )
-                with open(
-                    Path(args.result_dir) / f"{task_id}.json", "w"
-                ) as f:
-                    json.dump(history, f, indent=4, default=ndarray_to_list)
+            await asyncio.gather(*writes)
 
         except openai.error.OpenAIError as e:
             logger.info(f"[OpenAI Error] {repr(e)}")
         except Exception as e:
-            logger.info(f"[Unhandled Error] {repr(e)}]")
-            import traceback
-
-            # write to error file
-            with open(Path(args.result_dir) / "error.txt", "a") as f:
-                f.write(f"[Config file]: {config_file}\n")
-                f.write(f"[Unhandled Error] {repr(e)}\n")
-                f.write(traceback.format_exc())  # write stack trace to file
+            log_unhandled_error(args, config_file, e)
 
+        # the pending renders must be written before the file is closed
+        await asyncio.gather(*writes, return_exceptions=True)
         render_helper.close()
+        check_logged_out(args, config_file, login_service)
+
+    writer.shutdown()
+    if preparer is not browser:
+        preparer.shutdown()
+    if trajectory_log is not None:
+        trajectory_log.close()
+    if media_store is not None:
+        media_store.close()
+    # the browser thread is shut down once the environment is closed
+    await loop.run_in_executor(browser, env.close)
+    browser.shutdown()
+    logger.info(f"Average score: {sum(scores) / len(scores)}")
+    log_stats(agent, login_service, media_store, [env])
+
+
+async def run_episode(
+    args: argparse.Namespace,
+    agent: PromptAgent,
+    env: SharedBrowserEnv,
+    limiter: aiolimiter.AsyncLimiter,
+    config_file: str,
+    login_service: LoginService | None,
+    trajectory_log: TrajectoryLog | None,
+    media_store: MediaStore | None,
+) -> float | None:
+    """Run one task of the concurrent driver, return its score (None if the
+    episode failed). The files written are the same as in `test`."""
+    score = None
+    render_helper = RenderHelper(
+        config_file, args.result_dir, args.action_set_tag, media_store
+    )
+    try:
+        if login_service is not None:
+            config_file, intent, task_id = await env.run(
+                prepare_task, config_file, login_service
+            )
+        else:
+            config_file, intent, task_id = await asyncio.to_thread(
+                prepare_task, config_file
+            )
+        if trajectory_log is not None:
+            trajectory_log.start_task(task_id)
+
+        logger.info(f"[Config file]: {config_file}")
+        logger.info(f"[Intent]: {intent}")
+
+        agent.reset(config_file)
+        obs, info = await env.reset(options={"config_file": config_file})
+        state_info: StateInfo = {"observation": obs, "info": info}
+        episode = SharedEpisode(
+            agent, env, limiter, render_helper, args.render_screenshot
+        )
+        trajectory = await arun_steps(
+            episode_steps(
+                args,
+                agent,
+                intent,
+                task_id,
+                state_info,
+                trajectory_log,
+                media_store,
+            ),
+            episode,
+        )
+
+        evaluator = evaluator_router(
+            config_file, settle_strategy=args.settle_strategy
+        )
+        score = await env.run(
+            evaluator,
+            trajectory=trajectory,
+            config_file=config_file,
+            page=env.env.page,
+            client=env.env.get_page_client(env.env.page),
+        )
+        if trajectory_log is not None:
+            trajectory_log.add_result(task_id, score)
+
+        if score == 1:
+            logger.info(f"[Result] (PASS) {config_file}")
+        else:
+            logger.info(f"[Result] (FAIL) {config_file}")
+
+        if args.save_trace_enabled:
+            await env.run(
+                env.env.save_trace,
+                Path(args.result_dir) / "traces" / f"{task_id}.zip",
+            )
+
+    except openai.error.OpenAIError as e:
+        logger.info(f"[OpenAI Error] {repr(e)}")
+    except Exception as e:
+        log_unhandled_error(args, config_file, e)
+
+    render_helper.close()
+    check_logged_out(args, config_file, login_service)
+    return score
+
+
+async def test_concurrent(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    config_file_list: list[str],
+) -> None:
+    """Run `args.concurrency` episodes at the same time in this process.
+
+    The episodes share one browser, with a context each, and one LLM client
+    whose requests are rate limited across the episodes. While an episode
+    waits for the model or for its page to settle, the others act and
+    observe.
+    """
+    if not isinstance(agent, PromptAgent):
+        raise ValueError("The concurrent driver only supports prompt agents")
+    browser = SharedBrowser(headless=not args.render, slow_mo=args.slow_mo)
+    await browser.start()
+    limiter = aiolimiter.AsyncLimiter(args.requests_per_minute)
+    login_service = construct_login_service(args, lambda: browser.browser)
+    trajectory_log = construct_trajectory_log(args)
+    media_store = construct_media_store(args)
+    pending = list(config_file_list)
+    scores: list[float] = []
+    envs: list[ScriptBrowserEnv] = []
+
+    async def worker() -> None:
+        env = browser.new_env(
+            observation_type=args.observation_type,
+            current_viewport_only=args.current_viewport_only,
+            viewport_size={
+                "width": args.viewport_width,
+                "height": args.viewport_height,
+            },
+            save_trace_enabled=args.save_trace_enabled,
+            sleep_after_execution=args.sleep_after_execution,
+            bounds_mode=args.bounds_mode,
+            ax_update_mode=args.ax_update_mode,
+            verify_ax_cache=args.verify_ax_cache,
+            # the screenshot is only read by the render helper
+            lazy_image_observation=True,
+            settle_strategy=args.settle_strategy,
+            cache_observation=args.cache_observation,
+        )
+        envs.append(env.env)
+        while pending:
+            score = await run_episode(
+                args,
+                agent,
+                env,
+                limiter,
+                pending.pop(0),
+                login_service,
+                trajectory_log,
+                media_store,
+            )
+            if score is not None:
+                scores.append(score)
+        await env.close()
+
+    num_workers = min(args.concurrency, len(config_file_list))
+    await asyncio.gather(*(worker() for _ in range(num_workers)))
+    await browser.close()
+    if trajectory_log is not None:
+        trajectory_log.close()
+    if media_store is not None:
+        media_store.close()
 
-    env.close()
     logger.info(f"Average score: {sum(scores) / len(scores)}")
+    log_stats(agent, login_service, media_store, envs)
+
+
+# the workers of the pool driver write to the log file of this process
+POOL_CONTEXT = multiprocessing.get_context("fork")
+# the render of a task that was logged out from its site contains these
+LOGGED_OUT_MARKERS = [
+    "Creating an account has many benefits: check out faster",
+    "Welcome, please sign in",
+    "Username or email",
+    "Keep me logged in",
+]
+
+
+def get_task_id(config_file: str) -> str:
+    return os.path.basename(config_file).split(".")[0]
+
+
+def is_logged_out(result_dir: str, config_file: str) -> bool:
+    render_file = (
+        Path(result_dir)
+        / "renders"
+        / f"render_{get_task_id(config_file)}.html"
+    )
+    if not render_file.exists():
+        return False
+    contents = render_file.read_text()
+    return any(marker in contents for marker in LOGGED_OUT_MARKERS)
+
+
+def check_logged_out(
+    args: argparse.Namespace,
+    config_file: str,
+    login_service: LoginService | None,
+) -> bool:
+    """Whether the task was logged out from its sites, the login service
+    then probes them again before the next task reuses their state"""
+    if not is_logged_out(args.result_dir, config_file):
+        return False
+    logger.info(f"[Logged out] {config_file}")
+    if login_service is not None:
+        with open(config_file) as f:
+            storage_state = json.load(f)["storage_state"]
+        if storage_state:
+            login_service.invalidate(
+                get_site_comb_from_filepath(storage_state)
+            )
+    return True
+
+
+class TaskManifest:
+    """Append-only record of the tasks run by the pool driver, one json
+    line per finished task. The last record of a task wins, the tasks whose
+    last record is "done" are skipped when the run is restarted."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.records: dict[str, dict[str, Any]] = {}
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["task_id"]] = record
+
+    @property
+    def completed(self) -> set[str]:
+        return {
+            task_id
+            for task_id, record in self.records.items()
+            if record["status"] == "done"
+        }
+
+    def add(self, config_file: str, status: str, **kwargs: Any) -> None:
+        record = {
+            "task_id": get_task_id(config_file),
+            "config_file": config_file,
+            "status": status,
+            **kwargs,
+        }
+        self.records[record["task_id"]] = record
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def pool_worker(args: argparse.Namespace, conn: Connection) -> None:
+    """Run the tasks received from `test_pool` with one environment, and send
+    back the score and the error of each task"""
+    agent = construct_agent(args)
+    env = construct_env(args)
+    # the workers share the cookies through the auth folder
+    login_service = construct_login_service(args, env.get_browser)
+    trajectory_log = construct_trajectory_log(args)
+    # the workers share the media folder, a screenshot is written by each
+    # worker that sees it first
+    media_store = construct_media_store(args)
+    while (config_file := conn.recv()) is not None:
+        score = None
+        error = ""
+        try:
+            score = run_task(
+                args,
+                agent,
+                env,
+                config_file,
+                trajectory_log,
+                login_service,
+                media_store,
+            )
+            if check_logged_out(args, config_file, login_service):
+                error = "Unexpected logout"
+        except openai.error.OpenAIError as e:
+            logger.info(f"[OpenAI Error] {repr(e)}")
+            error = repr(e)
+        except Exception as e:
+            log_unhandled_error(args, config_file, e)
+            # the environment may be broken, the pool starts a new worker
+            if trajectory_log is not None:
+                trajectory_log.close()
+            if media_store is not None:
+                media_store.close()
+            conn.send((config_file, None, repr(e)))
+            return
+        conn.send((config_file, score, error))
+    env.close()
+    if trajectory_log is not None:
+        trajectory_log.close()
+    if media_store is not None:
+        media_store.close()
+    log_stats(agent, login_service, media_store, [env])
+
+
+PoolWorkerFunction = Callable[[argparse.Namespace, Connection], None]
+
+
+class PoolWorker:
+    """A worker process of `test_pool` and the task it is running"""
+
+    def __init__(
+        self,
+        args: argparse.Namespace,
+        target: PoolWorkerFunction = pool_worker,
+    ) -> None:
+        self.conn, worker_conn = POOL_CONTEXT.Pipe()
+        # daemon: the workers are killed if this process exits
+        self.process = POOL_CONTEXT.Process(
+            target=target, args=(args, worker_conn), daemon=True
+        )
+        self.process.start()
+        worker_conn.close()
+        self.config_file: str | None = None
+        self.start_time = 0.0
+        # why the task of a killed worker failed
+        self.error = "Worker crashed"
+
+    def assign(self, config_file: str) -> None:
+        self.conn.send(config_file)
+        self.config_file = config_file
+        self.start_time = time.monotonic()
+
+    def kill(self, error: str) -> None:
+        self.error = error
+        self.process.kill()
+        self.process.join()
+
+    def stop(self, timeout: float = 60.0) -> None:
+        if self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill("")
+
+
+def test_pool(
+    args: argparse.Namespace,
+    config_file_list: list[str],
+    worker_function: PoolWorkerFunction = pool_worker,
+) -> None:
+    """Run the tasks in `args.concurrency` worker processes, each with its
+    own long-lived environment.
+
+    Workers that crash are restarted, and so are the workers whose task runs
+    for longer than `args.task_timeout`. A task that crashed, timed out,
+    failed with an error or was logged out from its site is retried up to
+    `args.max_task_retries` times. The finished tasks are recorded in the
+    manifest of the result dir, and skipped when the run is restarted.
+    `worker_function` runs in the worker processes, see `pool_worker`.
+    """
+    manifest = TaskManifest(Path(args.result_dir) / "manifest.jsonl")
+    completed = manifest.completed
+    pending = deque(
+        config_file
+        for config_file in config_file_list
+        if get_task_id(config_file) not in completed
+    )
+    logger.info(
+        f"[Pool] {len(config_file_list) - len(pending)} tasks already done, "
+        f"{len(pending)} to run"
+    )
+    attempts: dict[str, int] = defaultdict(int)
+
+    def task_failed(config_file: str, error: str) -> None:
+        attempts[config_file] += 1
+        if attempts[config_file] <= args.max_task_retries:
+            logger.info(f"[Pool] Retry {config_file}: {error}")
+            pending.append(config_file)
+        else:
+            logger.info(f"[Pool] Give up {config_file}: {error}")
+            manifest.add(
+                config_file,
+                "failed",
+                error=error,
+                attempts=attempts[config_file],
+            )
+
+    workers = [
+        PoolWorker(args, worker_function)
+        for _ in range(min(args.concurrency, len(pending)))
+    ]
+    while pending or any(worker.config_file for worker in workers):
+        for idx, worker in enumerate(workers):
+            # collect the result before checking whether the worker is alive,
+            # it may exit right after sending it
+            if worker.config_file is not None and worker.conn.poll():
+                try:
+                    config_file, score, error = worker.conn.recv()
+                except EOFError:
+                    # the worker crashed, it is restarted below
+                    worker.process.join()
+                else:
+                    worker.config_file = None
+                    if error:
+                        task_failed(config_file, error)
+                    else:
+                        manifest.add(
+                            config_file,
+                            "done",
+                            score=score,
+                            attempts=attempts[config_file] + 1,
+                        )
+            elif (
+                worker.config_file is not None
+                and time.monotonic() - worker.start_time > args.task_timeout
+            ):
+                logger.info(f"[Pool] Timeout {worker.config_file}")
+                worker.kill("Timeout")
+
+            if not worker.process.is_alive():
+                if worker.config_file is not None:
+                    task_failed(worker.config_file, worker.error)
+                workers[idx] = worker = PoolWorker(args, worker_function)
+            if worker.config_file is None and pending:
+                worker.assign(pending.popleft())
+
+        wait(
+            [worker.conn for worker in workers]
+            + [worker.process.sentinel for worker in workers],
+            timeout=1.0,
+        )
+
+    for worker in workers:
+        worker.stop()
+    # including the tasks done before a restart
+    scores = [
+        record["score"]
+        for record in manifest.records.values()
+        if record["status"] == "done"
+    ]
+    if scores:
+        logger.info(f"Average score: {sum(scores) / len(scores)}")
 
 
 def prepare(args: argparse.Namespace) -> None:
@@ -465,7 +1493,8 @@ if __name__ == "__main__":
     ed_idx = args.test_end_idx
     for i in range(st_idx, ed_idx):
         test_file_list.append(f"config_files/{i}.json")
-    if "debug" not in args.result_dir:
+    # the pool driver skips the finished tasks with its manifest
+    if "debug" not in args.result_dir and args.episode_driver != "pool":
         test_file_list = get_unfinished(test_file_list, args.result_dir)
 
     if len(test_file_list) == 0:
@@ -479,5 +1508,14 @@ if __name__ == "__main__":
         args.current_viewport_only = True
         dump_config(args)
 
-        agent = construct_agent(args)
-        test(args, agent, test_file_list)
+        if args.episode_driver == "pool":
+            # the workers construct their own agent
+            test_pool(args, test_file_list)
+        else:
+            agent = construct_agent(args)
+            if args.episode_driver == "async":
+                asyncio.run(test_async(args, agent, test_file_list))
+            elif args.episode_driver == "concurrent":
+                asyncio.run(test_concurrent(args, agent, test_file_list))
+            else:
+                test(args, agent, test_file_list)
@@ -0,0 +1,238 @@
+"""Benchmark the accessibility tree serializer against the recursive one.
+
+The serializer is the one of the observations, `CompactAccessibilityTree`,
+built from the nodes and serialized. The recursive serializer of the original
+code is kept here as the baseline.
+
+Recorded trees are JSON files holding the node list returned by
+`TextObervationProcessor.fetch_full_accessibility_tree`. Without them, a
+synthetic Magento-like tree (a large, deeply nested grid) is used.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from typing import Any, Callable
+
+from browser_env.ax_tree import CompactAccessibilityTree
+from browser_env.constants import (
+    IGNORED_ACTREE_PROPERTIES,
+    IGNORED_UNNAMED_ROLES,
+)
+from browser_env.utils import AccessibilityTree
+
+ROLES = ["generic", "row", "gridcell", "link", "button", "StaticText"]
+
+
+def synthetic_tree(
+    num_nodes: int, max_depth: int, branch_prob: float = 0.05, seed: int = 0
+) -> AccessibilityTree:
+    rng = random.Random(seed)
+    tree: AccessibilityTree = [
+        {
+            "nodeId": "1",
+            "role": {"value": "RootWebArea"},
+            "name": {"value": "Dashboard / Magento Admin"},
+            "backendDOMNodeId": 1,
+            "childIds": [],
+            "union_bound": [0.0, 0.0, 10.0, 10.0],
+        }
+    ]
+    depths = [0]
+    for idx in range(1, num_nodes):
+        # mostly extend the current branch to get deep nesting
+        parent = idx - 1 if depths[idx - 1] < max_depth else 0
+        if rng.random() < branch_prob:
+            parent = rng.randrange(idx)
+        role = rng.choice(ROLES)
+        name = rng.choice(["", f"Order #{rng.randrange(100)}", "Edit"])
+        node: dict[str, Any] = {
+            "nodeId": str(idx + 1),
+            "role": {"value": role},
+            "name": {"value": name},
+            "backendDOMNodeId": idx + 1,
+            "childIds": [],
+            "union_bound": [0.0, float(idx), 100.0, 20.0],
+        }
+        if role == "link":
+            node["properties"] = [
+                {"name": "focusable", "value": {"value": True}}
+            ]
+        tree.append(node)
+        tree[parent]["childIds"].append(node["nodeId"])
+        depths.append(depths[parent] + 1)
+    return tree
+
+
+def recursive_serialize(
+    accessibility_tree: AccessibilityTree,
+) -> tuple[str, dict[str, Any]]:
+    """The recursive parse of the tree followed by the cleaning of its
+    lines"""
+    node_id_to_idx = {}
+    for idx, node in enumerate(accessibility_tree):
+        node_id_to_idx[node["nodeId"]] = idx
+
+    obs_nodes_info = {}
+
+    def dfs(idx: int, obs_node_id: str, depth: int) -> str:
+        tree_str = ""
+        node = accessibility_tree[idx]
+        indent = "\t" * depth
+        valid_node = True
+        try:
+            role = node["role"]["value"]
+            name = node["name"]["value"]
+            node_str = f"[{obs_node_id}] {role} {repr(name)}"
+            properties = []
+            for property in node.get("properties", []):
+                try:
+                    if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                        continue
+                    properties.append(
+                        f'{property["name"]}: {property["value"]["value"]}'
+                    )
+                except KeyError:
+                    pass
+
+            if properties:
+                node_str += " " + " ".join(properties)
+
+            # check valid
+            if not node_str.strip():
+                valid_node = False
+
+            # empty generic node
+            if not name.strip():
+                if not properties:
+                    if role in IGNORED_UNNAMED_ROLES:
+                        valid_node = False
+                elif role in ["listitem"]:
+                    valid_node = False
+
+            if valid_node:
+                tree_str += f"{indent}{node_str}"
+                obs_nodes_info[obs_node_id] = {
+                    "backend_id": node["backendDOMNodeId"],
+                    "union_bound": node["union_bound"],
+                    "text": node_str,
+                }
+
+        except Exception:
+            valid_node = False
+
+        for _, child_node_id in enumerate(node["childIds"]):
+            if child_node_id not in node_id_to_idx:
+                continue
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            child_str = dfs(
+                node_id_to_idx[child_node_id], child_node_id, child_depth
+            )
+            if child_str.strip():
+                if tree_str.strip():
+                    tree_str += "\n"
+                tree_str += child_str
+
+        return tree_str
+
+    tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+
+    clean_lines: list[str] = []
+    for line in tree_str.split("\n"):
+        # remove statictext if the content already appears in the previous line
+        if "statictext" in line.lower():
+            prev_lines = clean_lines[-3:]
+            pattern = r"\[\d+\] StaticText (.+)"
+
+            match = re.search(pattern, line, re.DOTALL)
+            if match:
+                static_text = match.group(1)[1:-1]  # remove the quotes
+                if static_text and all(
+                    static_text not in prev_line for prev_line in prev_lines
+                ):
+                    clean_lines.append(line)
+        else:
+            clean_lines.append(line)
+
+    return "\n".join(clean_lines), obs_nodes_info
+
+
+def compact_serialize(
+    accessibility_tree: AccessibilityTree,
+) -> tuple[str, dict[str, Any]]:
+    """Build the compact tree and serialize it, as the observation does"""
+    content, obs_nodes_info = CompactAccessibilityTree.from_cdp_nodes(
+        accessibility_tree
+    ).serialize()
+    return content, dict(obs_nodes_info)
+
+
+def best_time(
+    fn: Callable[[AccessibilityTree], Any],
+    tree: AccessibilityTree,
+    repeat: int,
+) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(tree)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark(name: str, tree: AccessibilityTree, repeat: int) -> None:
+    compact_tree = CompactAccessibilityTree.from_cdp_nodes(tree)
+    serialize_time = best_time(
+        lambda _: compact_tree.serialize(), tree, repeat
+    )
+    new_time = best_time(compact_serialize, tree, repeat)
+    try:
+        content, obs_nodes_info = recursive_serialize(tree)
+        new_content, new_obs_nodes_info = compact_serialize(tree)
+        assert content == new_content, f"{name}: output differs"
+        assert list(obs_nodes_info) == list(new_obs_nodes_info)
+        old_time = best_time(recursive_serialize, tree, repeat)
+        speedup = (
+            f"{old_time / new_time:.2f}x "
+            f"(serialize only {old_time / serialize_time:.2f}x)"
+        )
+        old = f"{old_time * 1000:.1f}ms"
+    except RecursionError:
+        speedup, old = "n/a", "RecursionError"
+    print(
+        f"{name}: {len(tree)} nodes, recursive {old}, "
+        f"compact {new_time * 1000:.1f}ms "
+        f"(serialize only {serialize_time * 1000:.1f}ms), speedup {speedup}"
+    )
+
+
+def config() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the accessibility tree serializer"
+    )
+    parser.add_argument(
+        "trees", nargs="*", help="JSON files of recorded accessibility trees"
+    )
+    parser.add_argument("--num_nodes", type=int, default=20000)
+    parser.add_argument("--max_depth", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = config()
+    if args.trees:
+        for tree_file in args.trees:
+            with open(tree_file, "r") as f:
+                benchmark(tree_file, json.load(f), args.repeat)
+    else:
+        tree = synthetic_tree(args.num_nodes, args.max_depth)
+        benchmark("synthetic", tree, args.repeat)
+        # deeper than the default recursion limit
+        deep_tree = synthetic_tree(
+            args.num_nodes, 2 * sys.getrecursionlimit(), branch_prob=0.0
+        )
+        benchmark("synthetic (deep)", deep_tree, args.repeat)
@@ -3,6 +3,7 @@ import base64
 import glob
 import json
 import os
+import shutil
 from collections import defaultdict
 from typing import Any
 
@@ -56,18 +57,27 @@ def main(result_folder: str, config_json: str) -> None:
                     obv.find("pre").text
                     for obv in soup.find_all("div", {"class": "state_obv"})
                 ]
-                base64_images = [
-                    img["src"].split(",")[1] for img in soup.find_all("img")
-                ]
+                image_srcs = [img["src"] for img in soup.find_all("img")]
                 image_observations = []
                 # save image to file and change the value to be path
                 image_folder = f"images/{os.path.basename(result_folder)}"
                 os.makedirs(image_folder, exist_ok=True)
-                for i, image in enumerate(base64_images):
-                    image_data = base64.b64decode(image)
-                    filename = f"{image_folder}/image_{task_id}_{i}.png"
-                    with open(filename, "wb") as f:  # type: ignore[assignment]
-                        f.write(image_data)  # type: ignore[arg-type]
+                for i, image_src in enumerate(image_srcs):
+                    if image_src.startswith("data:"):
+                        image_data = base64.b64decode(image_src.split(",")[1])
+                        filename = f"{image_folder}/image_{task_id}_{i}.png"
+                        with open(filename, "wb") as f:  # type: ignore[assignment]
+                            f.write(image_data)  # type: ignore[arg-type]
+                    else:
+                        # a file of the media store, relative to the render
+                        media_file = os.path.join(
+                            os.path.dirname(render_file), image_src
+                        )
+                        extension = os.path.splitext(media_file)[1]
+                        filename = (
+                            f"{image_folder}/image_{task_id}_{i}{extension}"
+                        )
+                        shutil.copyfile(media_file, filename)
                     image_observations.append(filename)
                 urls = [
                     url.get_text()
@@ -0,0 +1,214 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from agent.prompts.prompt_constructor import PromptConstructor
+from browser_env import DetachedPage
+from llms.lm_config import LMConfig
+
+OBSERVATION = """Tab 0 (current): One Stop Market
+
+[1] RootWebArea 'One Stop Market' focused: True
+\t[5] link 'My Account'
+\t[6] StaticText 'Welcome to the store, here is a long paragraph'
+\t[7] button 'Search'
+\t[8] textbox 'Search' required: False"""
+
+
+class FakeTokenizer:
+    """One token per word"""
+
+    def __init__(self) -> None:
+        self.encoded: list[str] = []
+
+    def encode(self, text: str) -> list[str]:
+        self.encoded.append(text)
+        return text.split()
+
+    def decode(self, ids: list[str]) -> str:
+        return " ".join(ids)
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+
+class UndercountingTokenizer(FakeTokenizer):
+    """The line estimates miss one token per line"""
+
+    def count_tokens(self, text: str) -> int:
+        return sum(
+            max(len(line.split()) - 1, 0) for line in text.splitlines()
+        )
+
+
+def get_prompt_constructor(
+    tmp_path: Path,
+    gen_config: dict[str, Any],
+    mode: str = "chat",
+    tokenizer: FakeTokenizer | None = None,
+) -> PromptConstructor:
+    instruction_path = tmp_path / "instruction.json"
+    with open(instruction_path, "w") as f:
+        json.dump(
+            {
+                "intro": "You are an agent",
+                "examples": [["observation", "action"]],
+                "template": "{observation}",
+                "meta_data": {"keywords": ["observation"]},
+            },
+            f,
+        )
+    lm_config = LMConfig(
+        provider="openai",
+        model="gpt-3.5-turbo",
+        mode=mode,
+        gen_config=gen_config,
+    )
+    return PromptConstructor(instruction_path, lm_config, tokenizer or FakeTokenizer())  # type: ignore[arg-type]
+
+
+def get_state_info(
+    obs: str, obs_nodes_info: dict[str, Any] | None = None
+) -> Any:
+    return {
+        "observation": {"text": obs},
+        "info": {
+            "page": DetachedPage("http://localhost", ""),
+            "observation_metadata": {
+                "text": {
+                    "obs_nodes_info": obs_nodes_info or {},
+                    "browser_config": {"win_height": 720},
+                }
+            },
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "max_obs_length, kept",
+    [
+        # all the interactive nodes fit, the tab title does not
+        (19, ["", 1, 5, 7, 8]),
+        (25, ["Tab 0 (current): One Stop Market", "", 1, 5, 7, 8]),
+        # the focused node first, then the interactive nodes that fit
+        (10, ["", 1, 7]),
+        (100, ["Tab 0 (current): One Stop Market", "", 1, 5, 6, 7, 8]),
+    ],
+)
+def test_priority_truncation(
+    tmp_path: Path, max_obs_length: int, kept: list[Any]
+) -> None:
+    prompt_constructor = get_prompt_constructor(
+        tmp_path,
+        {"max_obs_length": max_obs_length, "obs_truncation": "priority"},
+    )
+    lines = {
+        int(line.split("]")[0].strip("\t[")): line
+        for line in OBSERVATION.split("\n")
+        if "[" in line
+    }
+    expected = "\n".join(
+        lines[line] if isinstance(line, int) else line for line in kept
+    )
+    obs = prompt_constructor.truncate_observation(get_state_info(OBSERVATION))
+    assert obs == expected
+
+
+def test_priority_truncation_viewport(tmp_path: Path) -> None:
+    obs = "\n".join(
+        [
+            "[1] RootWebArea 'Shop' focused: True",
+            "\t[2] link 'Below the page'",
+            "\t[3] link 'In the page'",
+            "\t[4] link 'Far below the page'",
+        ]
+    )
+    obs_nodes_info = {
+        "2": {"union_bound": [0, 1000, 100, 20]},
+        "3": {"union_bound": [0, 100, 100, 20]},
+        "4": {"union_bound": [0, 5000, 100, 20]},
+    }
+    prompt_constructor = get_prompt_constructor(
+        tmp_path, {"max_obs_length": 15, "obs_truncation": "priority"}
+    )
+    truncated = prompt_constructor.truncate_observation(
+        get_state_info(obs, obs_nodes_info)
+    )
+    # the closest nodes to the viewport, in page order
+    assert truncated.split("\n") == [
+        "[1] RootWebArea 'Shop' focused: True",
+        "\t[2] link 'Below the page'",
+        "\t[3] link 'In the page'",
+    ]
+
+
+@pytest.mark.parametrize("max_obs_length", [5, 10, 19, 25])
+def test_priority_truncation_estimate(
+    tmp_path: Path, max_obs_length: int
+) -> None:
+    tokenizer = UndercountingTokenizer()
+    prompt_constructor = get_prompt_constructor(
+        tmp_path,
+        {"max_obs_length": max_obs_length, "obs_truncation": "priority"},
+        tokenizer=tokenizer,
+    )
+    obs = prompt_constructor.truncate_observation(get_state_info(OBSERVATION))
+    # the limit holds on the encoded observation, not on the estimates
+    assert 0 < len(tokenizer.encode(obs)) <= max_obs_length
+
+
+def test_priority_truncation_focused_text(tmp_path: Path) -> None:
+    obs = "\n".join(
+        [
+            "[1] RootWebArea 'Shop'",
+            "\t[2] StaticText 'Press tab until focused: True'",
+            "\t[3] textbox 'Search' focused: True",
+        ]
+    )
+    prompt_constructor = get_prompt_constructor(
+        tmp_path, {"max_obs_length": 5, "obs_truncation": "priority"}
+    )
+    truncated = prompt_constructor.truncate_observation(get_state_info(obs))
+    # the static text only has the property in its content
+    assert truncated == "\t[3] textbox 'Search' focused: True"
+
+
+def test_prompt_prefix_reused(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    prompt_constructor = get_prompt_constructor(
+        tmp_path, {"max_obs_length": 0}
+    )
+    builds = []
+    build_prompt_prefix = prompt_constructor.build_prompt_prefix
+
+    def count_builds(*args: Any) -> Any:
+        builds.append(args)
+        return build_prompt_prefix(*args)
+
+    monkeypatch.setattr(
+        prompt_constructor, "build_prompt_prefix", count_builds
+    )
+    intro = prompt_constructor.instruction["intro"]
+    examples = prompt_constructor.instruction["examples"]
+    for step in range(3):
+        prompt = prompt_constructor.get_lm_api_input(
+            intro, examples, f"step {step}"
+        )
+        assert prompt[0] == {"role": "system", "content": intro}
+        assert prompt[-1] == {"role": "user", "content": f"step {step}"}
+    assert len(builds) == 1
+    # the words of the fields, and the tokens of the chat format: three per
+    # message and one per name
+    assert (
+        prompt_constructor.get_prompt_prefix(intro, examples)["num_tokens"]
+        == len(
+            "system You are an agent "
+            "system example_user observation "
+            "system example_assistant action".split()
+        )
+        + 3 * 3
+        + 2
+    )
@@ -1,7 +1,17 @@
 import asyncio
 import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from playwright.sync_api import sync_playwright
 
 from browser_env import *
+from browser_env import auto_login
 
 auth_json = {
     "cookies": [
@@ -65,3 +75,183 @@ def test_async_auth_cookie() -> None:
         await env.aclose()
 
     asyncio.run(_test())
+
+
+class FakeContext:
+    def __init__(self, storage_state: dict[str, Any] | None) -> None:
+        self.cookies = storage_state["cookies"] if storage_state else []
+
+    def new_page(self) -> "FakeContext":
+        return self
+
+    def storage_state(self) -> dict[str, Any]:
+        return {"cookies": self.cookies, "origins": []}
+
+    def close(self) -> None:
+        pass
+
+
+class FakeBrowser:
+    def __init__(self) -> None:
+        self.contexts: list[FakeContext] = []
+
+    def new_context(
+        self, storage_state: dict[str, Any] | None = None
+    ) -> FakeContext:
+        context = FakeContext(storage_state)
+        self.contexts.append(context)
+        return context
+
+
+def test_login_service(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def login_comb(page: FakeContext, comb: list[str]) -> None:
+        page.cookies = [{"name": site, "expires": -1} for site in comb]
+
+    # the site is logged in while the cookie is in the page
+    logged_out: set[str] = set()
+    monkeypatch.setattr(auto_login, "login_comb", login_comb)
+    monkeypatch.setattr(
+        auto_login,
+        "is_site_expired",
+        lambda context, site: site in logged_out,
+    )
+    browser = FakeBrowser()
+    service = auto_login.LoginService(lambda: browser, str(tmp_path))  # type: ignore[arg-type, return-value]
+
+    # logged in once, then reused
+    state_path = service.get_storage_state(["gitlab", "reddit"])
+    assert service.get_storage_state(["gitlab", "reddit"]) == state_path
+    assert service.stats == {"reuses": 1, "renewals": 1, "probes": 0}
+    with open(state_path) as f:
+        assert len(json.load(f)["cookies"]) == 2
+
+    # the session was closed by the site, a task was logged out
+    logged_out.add("reddit")
+    service.invalidate(["gitlab", "reddit"])
+    service.get_storage_state(["gitlab", "reddit"])
+    assert service.stats == {"reuses": 1, "renewals": 2, "probes": 1}
+
+    # the cookie expired, the sites are not opened
+    with open(state_path, "w") as f:
+        json.dump({"cookies": [{"name": "gitlab", "expires": 1}]}, f)
+    num_contexts = len(browser.contexts)
+    service.get_storage_state(["gitlab", "reddit"])
+    assert service.stats == {"reuses": 1, "renewals": 3, "probes": 1}
+    # only the context of the renewal
+    assert len(browser.contexts) == num_contexts + 1
+
+
+def test_login_service_validation_ttl(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    probed: list[str] = []
+
+    def is_site_expired(context: FakeContext, site: str) -> bool:
+        probed.append(site)
+        return False
+
+    monkeypatch.setattr(auto_login, "is_site_expired", is_site_expired)
+    with open(tmp_path / "gitlab_state.json", "w") as f:
+        json.dump({"cookies": [{"name": "gitlab", "expires": -1}]}, f)
+    service = auto_login.LoginService(lambda: FakeBrowser(), str(tmp_path))  # type: ignore[arg-type, return-value]
+
+    # probed once, then trusted until the ttl
+    for _ in range(3):
+        service.get_storage_state(["gitlab"])
+    assert probed == ["gitlab"]
+    assert service.stats == {"reuses": 3, "renewals": 0, "probes": 1}
+
+    # a task was logged out
+    service.invalidate(["gitlab"])
+    service.get_storage_state(["gitlab"])
+    assert probed == ["gitlab", "gitlab"]
+
+    # past the ttl
+    service.validation_ttl = 0.0
+    service.get_storage_state(["gitlab"])
+    assert probed == ["gitlab", "gitlab", "gitlab"]
+
+
+def test_is_login_expired() -> None:
+    url = "http://gitlab.com/-/profile"
+    # redirected to the login page
+    assert auto_login.is_login_expired(url + "/sign_in", "", url, "")
+    assert not auto_login.is_login_expired(url, "", url, "")
+    assert not auto_login.is_login_expired(url + "?tab=1", "", url, "", False)
+    # the keyword is only shown to the logged in users
+    assert auto_login.is_login_expired(url, "Sign in", url, "Dashboard")
+    assert not auto_login.is_login_expired(url, "Dashboard", url, "Dashboard")
+
+
+class LoginRedirectHandler(BaseHTTPRequestHandler):
+    """Redirects the logged out users to the login page, as gitlab and
+    shopping do"""
+
+    login_pages = {
+        "/-/profile": "/users/sign_in",
+        "/wishlist/": "/customer/account/login/",
+    }
+
+    def do_GET(self) -> None:
+        login_page = self.login_pages.get(self.path)
+        cookie = self.headers.get("Cookie", "")
+        if login_page and "session=valid" not in cookie:
+            self.send_response(302)
+            self.send_header("Location", login_page)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"<html><body>Page</body></html>")
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def login_server() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LoginRedirectHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.mark.parametrize("site", ["gitlab", "shopping"])
+@pytest.mark.parametrize("session", ["valid", "closed"])
+def test_http_probe(
+    login_server: str,
+    monkeypatch: pytest.MonkeyPatch,
+    site: str,
+    session: str,
+) -> None:
+    site_idx = auto_login.SITES.index(site)
+    assert auto_login.HTTP_PROBE[site_idx]
+    path = ["/-/profile", "/wishlist/"][site_idx]
+    urls = list(auto_login.URLS)
+    urls[site_idx] = login_server + path
+    monkeypatch.setattr(auto_login, "URLS", urls)
+    storage_state = {
+        "cookies": [
+            {
+                "name": "session",
+                "value": session,
+                "domain": "127.0.0.1",
+                "path": "/",
+                "expires": -1,
+                "httpOnly": False,
+                "secure": False,
+                "sameSite": "Lax",
+            }
+        ],
+        "origins": [],
+    }
+    with sync_playwright() as playwright:
+        # the probe only uses the requests of the context, no page
+        request = playwright.request.new_context(storage_state=storage_state)  # type: ignore[arg-type]
+        context = SimpleNamespace(request=request)
+        expired = auto_login.is_site_expired(context, site)  # type: ignore[arg-type]
+        request.dispose()
+    assert expired == (session == "closed")
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from browser_env.media_store import MediaStore
+
+
+@pytest.mark.parametrize("media_format", ["webp", "png"])
+def test_media_store(tmp_path: Path, media_format: str) -> None:
+    store = MediaStore(tmp_path / "media", media_format)
+    image = np.zeros((72, 128, 4), dtype=np.uint8)
+    image[10:20, 10:20] = [255, 0, 0, 255]
+    name = store.put(image)
+    # the caller may reuse the array
+    image[:] = 0
+    assert store.put(image.copy()) != name
+    assert name.endswith(f".{media_format}")
+    store.close()
+    assert store.stats == {"writes": 2, "reuses": 0}
+
+    # lossless
+    with Image.open(store.get_path(name)) as f:
+        saved = np.array(f.convert("RGBA"))
+    assert saved[15, 15].tolist() == [255, 0, 0, 255]
+    assert saved[0, 0].tolist() == [0, 0, 0, 0]
+
+    # the screenshots written by a previous run are reused
+    store = MediaStore(tmp_path / "media", media_format)
+    assert store.put(saved) == name
+    store.close()
+    assert store.stats == {"writes": 0, "reuses": 1}
+    assert (
+        sorted(p.suffix for p in (tmp_path / "media").iterdir())
+        == [f".{media_format}"] * 2
+    )
+
+
+def test_media_store_write_error(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = MediaStore(tmp_path / "media")
+
+    def write(name: str, image: np.ndarray) -> None:
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(store, "write", write)
+    store.put(np.zeros((4, 4, 4), dtype=np.uint8))
+    store.executor.submit(lambda: None).result()
+    # the next screenshot raises the error of the failed write
+    with pytest.raises(OSError):
+        store.put(np.ones((4, 4, 4), dtype=np.uint8))
+    with pytest.raises(OSError):
+        store.close()
+    assert not list((tmp_path / "media").iterdir())
@@ -0,0 +1,1049 @@
+import copy
+import random
+import re
+from typing import Any, Callable
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from browser_env.ax_tree import CompactAccessibilityTree
+from browser_env.constants import (
+    IGNORED_ACTREE_PROPERTIES,
+    IGNORED_UNNAMED_ROLES,
+)
+from browser_env.processors import (
+    AX_FULL_REFRESH_INTERVAL,
+    IN_VIEWPORT_RATIO_THRESHOLD,
+    PAGE_STATE_JS,
+    LazyObservation,
+    ObservationHandler,
+    TextObervationProcessor,
+)
+from browser_env.utils import BrowserConfig, BrowserInfo, PageState
+
+# a tiny document: #document > html > body > [div > "hello", "\n  ", span]
+DOCUMENT: dict[str, Any] = {
+    "backendNodeId": 1,
+    "nodeType": 9,
+    "nodeName": "#document",
+    "nodeValue": "",
+    "children": [
+        {
+            "backendNodeId": 2,
+            "nodeType": 1,
+            "nodeName": "HTML",
+            "nodeValue": "",
+            "children": [
+                {
+                    "backendNodeId": 3,
+                    "nodeType": 1,
+                    "nodeName": "BODY",
+                    "nodeValue": "",
+                    "children": [
+                        {
+                            "backendNodeId": 4,
+                            "nodeType": 1,
+                            "nodeName": "DIV",
+                            "nodeValue": "",
+                            "children": [
+                                {
+                                    "backendNodeId": 5,
+                                    "nodeType": 3,
+                                    "nodeName": "#text",
+                                    "nodeValue": "hello",
+                                }
+                            ],
+                        },
+                        {
+                            "backendNodeId": 6,
+                            "nodeType": 1,
+                            "nodeName": "SPAN",
+                            "nodeValue": "",
+                        },
+                    ],
+                }
+            ],
+        }
+    ],
+}
+
+RECTS: dict[int, dict[str, float] | None] = {
+    1: None,
+    2: {"x": 0, "y": 0, "width": 1280, "height": 2000},
+    3: {"x": 8, "y": 8, "width": 1264, "height": 1984},
+    4: {"x": 8, "y": 8, "width": 1264, "height": 20.5},
+    5: {"x": 8, "y": 8, "width": 35.25, "height": 18},
+    6: {"x": 8, "y": 28.5, "width": 0, "height": 0},
+}
+
+# what the injected script returns, including the whitespace-only text node
+# that CDP leaves out of `DOM.getDocument`
+JS_NODES = [
+    ["#document", -1, False, RECTS[1]],
+    ["HTML", 0, False, RECTS[2]],
+    ["BODY", 1, False, RECTS[3]],
+    ["DIV", 2, False, RECTS[4]],
+    ["#text", 3, False, RECTS[5]],
+    ["#text", 2, True, {"x": 0, "y": 0, "width": 0, "height": 0}],
+    ["SPAN", 2, False, RECTS[6]],
+]
+
+
+CONFIG: BrowserConfig = {
+    "win_top_bound": 100.0,
+    "win_left_bound": 0.0,
+    "win_width": 1280.0,
+    "win_height": 720.0,
+    "win_right_bound": 1280.0,
+    "win_lower_bound": 820.0,
+    "device_pixel_ratio": 1.0,
+}
+
+# the DOM snapshot of the same document, scrolled down by 100px. The text
+# node is wrapped into two lines and the span has no layout
+INFO: BrowserInfo = {
+    "DOMTree": {
+        "documents": [
+            {
+                "nodes": {"backendNodeId": [1, 2, 3, 4, 5, 6]},
+                "layout": {
+                    "nodeIndex": [1, 2, 3, 4, 4],
+                    "bounds": [
+                        [0, 0, 1280, 2000],
+                        [8, 8, 1264, 1984],
+                        [8, 108, 1264, 36],
+                        [8, 108, 35.25, 18],
+                        [8, 126, 20, 18],
+                    ],
+                },
+            }
+        ],
+        "strings": [],
+    },
+    "config": CONFIG,
+}
+
+
+class FakeCDPSession:
+    def __init__(
+        self, js_nodes: list[list[Any]], document: dict[str, Any] = DOCUMENT
+    ) -> None:
+        self.js_nodes = js_nodes
+        self.document = document
+        self.calls: list[str] = []
+
+    def send(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        self.calls.append(method)
+        if method == "DOM.getDocument":
+            return {"root": self.document}
+        if method == "Runtime.evaluate":
+            return {"result": {"type": "object", "value": self.js_nodes}}
+        if method == "DOM.resolveNode":
+            return {"object": {"objectId": str(params["backendNodeId"])}}
+        if method == "Runtime.callFunctionOn":
+            rect = RECTS[int(params["objectId"])]
+            if rect is None:
+                return {"result": {"type": "object", "subtype": "error"}}
+            return {"result": {"type": "object", "value": rect}}
+        raise ValueError(method)
+
+
+def test_bulk_bounds_match_per_node() -> None:
+    backend_node_ids = ["1", "2", "3", "4", "5", "6"]
+    per_node = TextObervationProcessor(
+        "accessibility_tree", False, {"width": 1280, "height": 720}
+    )
+    bulk = TextObervationProcessor(
+        "accessibility_tree",
+        False,
+        {"width": 1280, "height": 720},
+        bounds_mode="bulk",
+    )
+    client = FakeCDPSession(JS_NODES)
+    expected = per_node.fetch_bounds(INFO, client, backend_node_ids)  # type: ignore[arg-type]
+    assert per_node.bounds_cdp_calls == 12
+
+    client = FakeCDPSession(JS_NODES)
+    bounds = bulk.fetch_bounds(INFO, client, backend_node_ids)  # type: ignore[arg-type]
+    assert bounds == expected
+    assert bulk.bounds_cdp_calls == 2
+    assert client.calls == ["DOM.getDocument", "Runtime.evaluate"]
+
+
+def test_bulk_bounds_fallback_on_dom_change() -> None:
+    bulk = TextObervationProcessor(
+        "accessibility_tree",
+        False,
+        {"width": 1280, "height": 720},
+        bounds_mode="bulk",
+    )
+    # the span was removed between the two calls, only the span falls back
+    client = FakeCDPSession(JS_NODES[:-1])
+    bounds = bulk.fetch_bounds(INFO, client, ["4", "6"])  # type: ignore[arg-type]
+    assert bounds == {
+        "4": [8, 8, 1264, 20.5],
+        "6": [8, 28.5, 0, 0],
+    }
+    assert bulk.bounds_cdp_calls == 2 + 2
+
+    # a node inserted before the div is skipped
+    client = FakeCDPSession(
+        JS_NODES[:3]
+        + [["P", 2, False, {"x": 0, "y": 0, "width": 1, "height": 1}]]
+        + [
+            [name, parent + int(parent > 2), is_whitespace, rect]
+            for name, parent, is_whitespace, rect in JS_NODES[3:]
+        ]
+    )
+    bounds = bulk.fetch_bounds(INFO, client, ["4", "5", "6"])  # type: ignore[arg-type]
+    assert bounds == {
+        "4": [8, 8, 1264, 20.5],
+        "5": [8, 8, 35.25, 18],
+        "6": [8, 28.5, 0, 0],
+    }
+    assert bulk.bounds_cdp_calls == 2
+
+
+def test_bulk_bounds_truncated_text() -> None:
+    bulk = TextObervationProcessor(
+        "accessibility_tree",
+        False,
+        {"width": 1280, "height": 720},
+        bounds_mode="bulk",
+    )
+    # CDP truncates long node values, e.g., a large inline script
+    document = copy.deepcopy(DOCUMENT)
+    text_node = document["children"][0]["children"][0]["children"][0][
+        "children"
+    ][0]
+    text_node["nodeValue"] = "x" * 10000 + "\u2026"
+    client = FakeCDPSession(JS_NODES, document)
+    bounds = bulk.fetch_bounds(INFO, client, ["4", "5", "6"])  # type: ignore[arg-type]
+    assert bounds == {
+        "4": [8, 8, 1264, 20.5],
+        "5": [8, 8, 35.25, 18],
+        "6": [8, 28.5, 0, 0],
+    }
+    assert bulk.bounds_cdp_calls == 2
+    assert client.calls == ["DOM.getDocument", "Runtime.evaluate"]
+
+
+def test_snapshot_bounds() -> None:
+    processor = TextObervationProcessor(
+        "html",
+        False,
+        {"width": 1280, "height": 720},
+        bounds_mode="snapshot",
+    )
+    client = FakeCDPSession(JS_NODES)
+    bounds = processor.fetch_bounds(INFO, client, ["1", "2", "4", "5", "6"])  # type: ignore[arg-type]
+    assert bounds == {
+        "1": None,
+        "2": [0, -100.0, 1280, 2000],
+        "4": [8, 8.0, 1264, 36],
+        "5": [8, 8.0, 35.25, 36.0],
+        "6": None,
+    }
+    assert processor.bounds_cdp_calls == 0
+    assert client.calls == []
+
+
+def test_lazy_image_observation() -> None:
+    num_captures = 0
+
+    def capture() -> npt.NDArray[np.uint8]:
+        nonlocal num_captures
+        num_captures += 1
+        return np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    obs = LazyObservation("text observation", capture)
+    assert obs["text"] == "text observation"
+    assert num_captures == 0
+    assert obs["image"].shape == (720, 1280, 3)  # type: ignore[union-attr]
+    assert obs["image"] is obs["image"]
+    assert num_captures == 1
+
+    obs = LazyObservation("text observation", capture)
+    obs.expire()
+    with pytest.raises(RuntimeError):
+        obs["image"]
+    assert num_captures == 1
+
+
+def test_lazy_image_observation_mapping() -> None:
+    num_captures = 0
+
+    def capture() -> npt.NDArray[np.uint8]:
+        nonlocal num_captures
+        num_captures += 1
+        return np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    obs = LazyObservation("text observation", capture)
+    # the image is a key before it is captured
+    assert "image" in obs
+    assert "audio" not in obs
+    assert list(obs) == ["text", "image"]
+    assert list(obs.keys()) == ["text", "image"]
+    assert len(obs) == 2
+    assert obs.get("audio") is None
+    assert num_captures == 0
+
+    image = obs.get("image")
+    assert image is not None and image.shape == (720, 1280, 3)
+    assert num_captures == 1
+    assert list(obs) == ["text", "image"]
+    assert len(obs) == 2
+    assert obs.get("image") is image
+
+    for read in [
+        lambda obs: dict(obs.items()),
+        lambda obs: list(obs.values()),
+        lambda obs: obs.copy(),
+        lambda obs: {**obs},
+    ]:
+        obs = LazyObservation("text observation", capture)
+        num_captures = 0
+        read(obs)
+        assert num_captures == 1
+        obs["image"]
+        assert num_captures == 1
+
+
+def ax_node(
+    node_id: int,
+    role: str,
+    name: str | None,
+    child_ids: list[int],
+    **kwargs: Any,
+) -> dict[str, Any]:
+    node: dict[str, Any] = {
+        "nodeId": str(node_id),
+        "role": {"value": role},
+        "childIds": [str(child_id) for child_id in child_ids],
+        "backendDOMNodeId": node_id,
+        "union_bound": [0.0, 0.0, 10.0, 10.0],
+    }
+    if name is not None:
+        node["name"] = {"value": name}
+    node.update(kwargs)
+    return node
+
+
+def serialize_reference(
+    accessibility_tree: list[dict[str, Any]],
+) -> tuple[str, dict[str, Any]]:
+    """The recursive parse and cleaning of the lines that
+    `CompactAccessibilityTree.serialize` replaces"""
+    node_id_to_idx = {
+        node["nodeId"]: idx for idx, node in enumerate(accessibility_tree)
+    }
+    obs_nodes_info = {}
+
+    def dfs(idx: int, obs_node_id: str, depth: int) -> str:
+        tree_str = ""
+        node = accessibility_tree[idx]
+        valid_node = True
+        try:
+            role = node["role"]["value"]
+            name = node["name"]["value"]
+            node_str = f"[{obs_node_id}] {role} {repr(name)}"
+            properties = []
+            for property in node.get("properties", []):
+                try:
+                    if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                        continue
+                    properties.append(
+                        f'{property["name"]}: {property["value"]["value"]}'
+                    )
+                except KeyError:
+                    pass
+            if properties:
+                node_str += " " + " ".join(properties)
+            if not name.strip():
+                if not properties:
+                    if role in IGNORED_UNNAMED_ROLES:
+                        valid_node = False
+                elif role in ["listitem"]:
+                    valid_node = False
+            if valid_node:
+                tree_str += "\t" * depth + node_str
+                obs_nodes_info[obs_node_id] = {
+                    "backend_id": node["backendDOMNodeId"],
+                    "union_bound": node["union_bound"],
+                    "text": node_str,
+                }
+        except Exception:
+            valid_node = False
+
+        for child_node_id in node["childIds"]:
+            if child_node_id not in node_id_to_idx:
+                continue
+            child_depth = depth + 1 if valid_node else depth
+            child_str = dfs(
+                node_id_to_idx[child_node_id], child_node_id, child_depth
+            )
+            if child_str.strip():
+                if tree_str.strip():
+                    tree_str += "\n"
+                tree_str += child_str
+        return tree_str
+
+    tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+    clean_lines: list[str] = []
+    for line in tree_str.split("\n"):
+        if "statictext" in line.lower():
+            match = re.search(r"\[\d+\] StaticText (.+)", line, re.DOTALL)
+            if match:
+                static_text = match.group(1)[1:-1]
+                if static_text and all(
+                    static_text not in prev_line
+                    for prev_line in clean_lines[-3:]
+                ):
+                    clean_lines.append(line)
+        else:
+            clean_lines.append(line)
+    return "\n".join(clean_lines), obs_nodes_info
+
+
+def test_serialize_accessibility_tree() -> None:
+    tree = [
+        ax_node(1, "RootWebArea", "Shop", [2, 3, 9, 99]),
+        ax_node(2, "link", "Home", [4]),
+        ax_node(3, "generic", "", [5, 6, 7]),
+        # repeated text of the parent link is removed
+        ax_node(4, "StaticText", "Home", []),
+        # no backend node: printed, but its children are not indented
+        ax_node(5, "paragraph", "Orders", [8]),
+        ax_node(6, "StaticText", "Orders", []),
+        ax_node(7, "textbox", None, []),
+        ax_node(8, "StaticText", "Total", []),
+        ax_node(
+            9,
+            "listitem",
+            "",
+            [10],
+            properties=[
+                {"name": "description", "value": {"value": "a\nb"}},
+                {"name": "focusable", "value": {"value": True}},
+            ],
+        ),
+        ax_node(10, "StaticText", "b", []),
+    ]
+    del tree[4]["backendDOMNodeId"]
+
+    expected = serialize_reference(tree)
+    content, obs_nodes_info = CompactAccessibilityTree.from_cdp_nodes(
+        tree  # type: ignore[arg-type]
+    ).serialize()
+    assert content == expected[0]
+    assert list(obs_nodes_info) == list(expected[1])
+    assert content == (
+        "[1] RootWebArea 'Shop'\n"
+        "\t[2] link 'Home'\n"
+        "\t[5] paragraph 'Orders'\n"
+        "\t[8] StaticText 'Total'\n"
+        "\t[10] StaticText 'b'"
+    )
+    # the removed static texts keep their ids
+    assert list(obs_nodes_info) == ["1", "2", "4", "8", "6", "10"]
+
+
+def test_serialize_deep_accessibility_tree() -> None:
+    depth = 5000
+    tree = [
+        ax_node(idx, "link", f"link {idx}", [idx + 1] if idx < depth else [])
+        for idx in range(1, depth + 1)
+    ]
+    content, obs_nodes_info = CompactAccessibilityTree.from_cdp_nodes(
+        tree  # type: ignore[arg-type]
+    ).serialize()
+    assert len(obs_nodes_info) == depth
+    assert (
+        content.split("\n")[-1]
+        == "\t" * (depth - 1) + "[5000] link 'link 5000'"
+    )
+
+
+def prune_tree_reference(
+    tree: list[dict[str, Any]], keep: list[bool]
+) -> list[dict[str, Any]]:
+    """The node-by-node removal that `prune_tree` replaces"""
+    nodeid_to_cursor = {node["nodeId"]: idx for idx, node in enumerate(tree)}
+    for cursor, node in enumerate(tree):
+        if keep[cursor]:
+            continue
+        parent = tree[nodeid_to_cursor[node["parentId"]]]
+        index = parent["childIds"].index(node["nodeId"])
+        parent["childIds"].pop(index)
+        for child_id in node["childIds"]:
+            parent["childIds"].insert(index, child_id)
+            index += 1
+        for child_id in node["childIds"]:
+            tree[nodeid_to_cursor[child_id]]["parentId"] = node["parentId"]
+        node["parentId"] = "[REMOVED]"
+    return [node for node in tree if node.get("parentId") != "[REMOVED]"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_prune_tree(seed: int) -> None:
+    rng = random.Random(seed)
+    tree: list[dict[str, Any]] = [{"nodeId": "0", "childIds": []}]
+    for idx in range(1, 200):
+        parent = tree[rng.randrange(idx)]
+        tree.append({"nodeId": str(idx), "parentId": parent["nodeId"]})
+        tree[-1]["childIds"] = []
+        parent["childIds"].append(str(idx))
+    # the nodes are not always listed in tree order
+    tree = [tree[0]] + rng.sample(tree[1:], len(tree) - 1)
+    keep = [True] + [rng.random() < 0.3 for _ in tree[1:]]
+
+    expected = prune_tree_reference(copy.deepcopy(tree), keep)
+    assert TextObervationProcessor.prune_tree(tree, keep) == expected  # type: ignore[arg-type]
+
+
+def in_viewport_ratio_reference(
+    union_bound: list[float], config: BrowserConfig
+) -> float:
+    """The per-node ratio that `get_viewport_keep_mask` vectorizes"""
+    elem_left_bound, elem_top_bound, width, height = union_bound
+    overlap_width = max(
+        0,
+        min(elem_left_bound + width, config["win_width"])
+        - max(elem_left_bound, 0),
+    )
+    overlap_height = max(
+        0,
+        min(elem_top_bound + height, config["win_height"])
+        - max(elem_top_bound, 0),
+    )
+    return overlap_width * overlap_height / (width * height)
+
+
+def test_viewport_keep_mask() -> None:
+    rng = random.Random(0)
+    union_bounds: list[list[float] | None] = [
+        None,
+        [],
+        [10.0, 10.0, 0.0, 20.0],
+        [10.0, 10.0, 20.0, 0.0],
+        # half of it is above the viewport
+        [0.0, -10.0, 100.0, 20.0],
+        # 70% of it is in the viewport
+        [1210.0, 0.0, 100.0, 10.0],
+    ]
+    for _ in range(1000):
+        union_bounds.append(
+            [
+                rng.uniform(-500, 1500),
+                rng.uniform(-500, 1500),
+                rng.uniform(1, 1000),
+                rng.uniform(1, 1000),
+            ]
+        )
+
+    keep = TextObervationProcessor.get_viewport_keep_mask(union_bounds, CONFIG)
+    assert keep[:6].tolist() == [False, False, False, False, False, True]
+    for union_bound, kept in zip(union_bounds[6:], keep[6:]):
+        assert union_bound is not None
+        ratio = in_viewport_ratio_reference(union_bound, CONFIG)
+        assert kept == (ratio >= IN_VIEWPORT_RATIO_THRESHOLD)
+    assert 0 < keep.sum() < len(union_bounds)
+
+
+def test_page_state_probe_fields() -> None:
+    returned = PAGE_STATE_JS.split("return {")[1]
+    fields = re.findall(r"^\s+(\w+):", returned, re.MULTILINE)
+    assert sorted(fields) == sorted(PageState.__annotations__)
+
+
+class FakePage:
+    def __init__(self) -> None:
+        self.context = self
+        self.pages = [self]
+        self.page_state: PageState = {
+            "url": "http://localhost/",
+            "title": "Home",
+            "win_top_bound": 0.0,
+            "win_left_bound": 0.0,
+            "win_width": 1280.0,
+            "win_height": 720.0,
+            "device_pixel_ratio": 1.0,
+            "doc_width": 1280.0,
+            "doc_height": 2000.0,
+            "dom_version": "1.5:0",
+        }
+
+    def evaluate(self, expression: str) -> PageState:
+        return dict(self.page_state)  # type: ignore[return-value]
+
+
+def test_observation_cache() -> None:
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        True,
+        {"width": 1280, "height": 720},
+        lazy_image=True,
+        cache_observation=True,
+    )
+    num_process = 0
+    num_captures = 0
+
+    def fetch(
+        page: FakePage, client: Any, page_state: PageState | None = None
+    ) -> Callable[[], str]:
+        nonlocal num_process
+        num_process += 1
+        handler.text_processor.page_state = page.evaluate("")
+        text = f"observation {num_process}"
+        return lambda: text
+
+    def capture(page: FakePage, client: Any) -> npt.NDArray[np.uint8]:
+        nonlocal num_captures
+        num_captures += 1
+        return np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    handler.text_processor.fetch = fetch  # type: ignore[assignment]
+    handler.image_processor.process = capture  # type: ignore[assignment]
+    page = FakePage()
+
+    obs = handler.get_observation(page, None)  # type: ignore[arg-type]
+    image = obs["image"]
+    handler.expire_observation()
+    # nothing changed on the page, e.g., a failed click
+    obs = handler.get_observation(page, None)  # type: ignore[arg-type]
+    assert obs["text"] == "observation 1"
+    assert obs["image"] is image
+    assert handler.observation_cache_stats == {
+        "hit": True,
+        "hits": 1,
+        "misses": 1,
+    }
+    handler.expire_observation()
+
+    # scrolled
+    page.page_state["win_top_bound"] = 100.0
+    obs = handler.get_observation(page, None)  # type: ignore[arg-type]
+    assert obs["text"] == "observation 2"
+    handler.expire_observation()
+    # typed into a text box
+    page.page_state["dom_version"] = "1.5:1"
+    obs = handler.get_observation(page, None)  # type: ignore[arg-type]
+    assert obs["text"] == "observation 3"
+    obs["image"]
+    handler.expire_observation()
+    # an image loaded
+    page.page_state["doc_height"] = 2500.0
+    obs = handler.get_observation(page, None)  # type: ignore[arg-type]
+    assert obs["text"] == "observation 4"
+    handler.expire_observation()
+    # hovered, a menu may be shown by a CSS rule
+    handler.invalidate_observation()
+    obs = handler.get_observation(page, None)  # type: ignore[arg-type]
+    assert obs["text"] == "observation 5"
+    assert handler.observation_cache_stats == {
+        "hit": False,
+        "hits": 1,
+        "misses": 5,
+    }
+    assert num_captures == 2
+
+
+def test_cached_accessibility_tree() -> None:
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        False,
+        {"width": 1280, "height": 720},
+        ax_update_mode="incremental",
+        verify_ax_cache=True,
+    )
+    processor = handler.text_processor
+    num_fetches = 0
+    fresh_tree = [
+        ax_node(1, "RootWebArea", "Shop", [2]),
+        ax_node(2, "link", "Home", []),
+    ]
+
+    def fetch(client: Any) -> list[dict[str, Any]]:
+        nonlocal num_fetches
+        num_fetches += 1
+        return copy.deepcopy(fresh_tree)
+
+    processor.fetch_full_accessibility_tree = fetch  # type: ignore[assignment]
+    page_state = FakePage().page_state
+    processor.page_state = page_state
+
+    tree = processor.fetch_cached_accessibility_tree(None)  # type: ignore[arg-type]
+    assert not processor.ax_tree_reused
+    # e.g., scrolled, the DOM did not change
+    assert processor.fetch_cached_accessibility_tree(None) is tree  # type: ignore[arg-type]
+    assert processor.ax_tree_reused
+    # the tree changed without any DOM mutation
+    fresh_tree[1]["name"] = {"value": "Home page"}
+    tree = processor.fetch_cached_accessibility_tree(None)  # type: ignore[arg-type]
+    assert tree[1]["name"]["value"] == "Home page"
+    # e.g., hovered
+    handler.invalidate_observation()
+    processor.fetch_cached_accessibility_tree(None)  # type: ignore[arg-type]
+    assert not processor.ax_tree_reused
+    assert processor.ax_tree_cache_stats == {
+        "hits": 2,
+        "misses": 2,
+        "mismatches": 1,
+    }
+
+    processor.verify_ax_cache = False
+    processor.page_state = {**page_state, "dom_version": "1.5:1"}
+    processor.fetch_cached_accessibility_tree(None)  # type: ignore[arg-type]
+    assert not processor.ax_tree_reused
+    # a full refresh after AX_FULL_REFRESH_INTERVAL observations
+    for _ in range(AX_FULL_REFRESH_INTERVAL - 4):
+        processor.fetch_cached_accessibility_tree(None)  # type: ignore[arg-type]
+        assert processor.ax_tree_reused
+    processor.fetch_cached_accessibility_tree(None)  # type: ignore[arg-type]
+    assert not processor.ax_tree_reused
+    assert num_fetches == 6
+    assert processor.ax_tree_cache_stats == {
+        "hits": 2 + AX_FULL_REFRESH_INTERVAL - 4,
+        "misses": 4,
+        "mismatches": 1,
+    }
+
+
+def random_accessibility_tree(
+    rng: random.Random, num_nodes: int
+) -> tuple[list[dict[str, Any]], dict[str, list[float] | None]]:
+    roles = ["generic", "link", "StaticText", "listitem", "button"]
+    names = ["", "Home", "Orders", "Total", "Home page"]
+    tree = [ax_node(1, "RootWebArea", "Shop", [])]
+    bounds: dict[str, list[float] | None] = {}
+    for node_id in range(2, num_nodes + 1):
+        parent = rng.choice(tree)
+        node = ax_node(
+            node_id,
+            rng.choice(roles),
+            rng.choice(names) if rng.random() < 0.95 else None,
+            [],
+            parentId=parent["nodeId"],
+        )
+        del node["union_bound"]
+        if rng.random() < 0.1:
+            node["properties"] = [{"name": "focusable", "value": {"value": 1}}]
+        if rng.random() < 0.1:
+            del node["backendDOMNodeId"]
+        parent["childIds"].append(node["nodeId"])
+        tree.append(node)
+        bounds[str(node_id)] = (
+            [
+                float(rng.randrange(-500, 1500)),
+                float(rng.randrange(-500, 1500)),
+                float(rng.randrange(0, 800)),
+                float(rng.randrange(0, 800)),
+            ]
+            if rng.random() < 0.9
+            else None
+        )
+    del tree[0]["union_bound"]
+    return tree, bounds
+
+
+@pytest.mark.parametrize("current_viewport_only", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_accessibility_tree(
+    seed: int, current_viewport_only: bool
+) -> None:
+    rng = random.Random(seed)
+    raw_tree, bounds = random_accessibility_tree(rng, 300)
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only,
+        {"width": 1280, "height": 720},
+    )
+    processor.fetch_full_accessibility_tree = (  # type: ignore[assignment]
+        lambda client: copy.deepcopy(raw_tree)
+    )
+    processor.fetch_bounds = (  # type: ignore[assignment]
+        lambda info, client, backend_node_ids: {
+            backend_node_id: bounds[backend_node_id]
+            for backend_node_id in backend_node_ids
+        }
+    )
+
+    tree = copy.deepcopy(raw_tree)
+    keep = []
+    for node in tree:
+        if "backendDOMNodeId" not in node:
+            node["union_bound"] = None
+        elif node["role"]["value"] == "RootWebArea":
+            node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
+        else:
+            node["union_bound"] = bounds[node["nodeId"]]
+        union_bound = node["union_bound"]
+        keep.append(
+            bool(union_bound)
+            and union_bound[2] != 0
+            and union_bound[3] != 0
+            and in_viewport_ratio_reference(union_bound, CONFIG)
+            >= IN_VIEWPORT_RATIO_THRESHOLD
+        )
+    if current_viewport_only:
+        tree = prune_tree_reference(tree, keep)
+    expected = serialize_reference(tree)
+    compact_tree = processor.fetch_compact_accessibility_tree(
+        INFO, None, current_viewport_only  # type: ignore[arg-type]
+    )
+    content, obs_nodes_info = compact_tree.serialize()
+
+    assert len(compact_tree) == len(tree)
+    assert content == expected[0]
+    assert list(obs_nodes_info) == list(expected[1])
+    assert dict(obs_nodes_info) == expected[1]
+
+
+def mutate_accessibility_tree(
+    rng: random.Random,
+    tree: list[dict[str, Any]],
+    bounds: dict[str, list[float] | None],
+) -> None:
+    """Change one node of the tree: its name, its bounds, a new child or its
+    removal"""
+    node = rng.choice(tree[1:])
+    mutation = rng.choice(["name", "bounds", "add", "remove"])
+    if mutation == "name":
+        node["name"] = {"value": rng.choice(["Home", "Orders", "Cart"])}
+    elif mutation == "bounds":
+        bounds[node["nodeId"]] = [
+            float(rng.randrange(-500, 1500)),
+            float(rng.randrange(-500, 1500)),
+            200.0,
+            200.0,
+        ]
+    elif mutation == "add":
+        node_id = str(max(int(node["nodeId"]) for node in tree) + 1)
+        child = ax_node(
+            int(node_id), "StaticText", "Total", [], parentId=node["nodeId"]
+        )
+        del child["union_bound"]
+        node["childIds"].insert(0, node_id)
+        tree.append(child)
+        bounds[node_id] = [0.0, 0.0, 100.0, 100.0]
+    elif not node["childIds"]:
+        parent = next(
+            parent for parent in tree if node["nodeId"] in parent["childIds"]
+        )
+        parent["childIds"].remove(node["nodeId"])
+        tree.remove(node)
+
+
+@pytest.mark.parametrize("current_viewport_only", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_accessibility_tree(
+    seed: int, current_viewport_only: bool
+) -> None:
+    rng = random.Random(seed)
+    raw_tree, bounds = random_accessibility_tree(rng, 300)
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only,
+        {"width": 1280, "height": 720},
+        ax_update_mode="incremental",
+    )
+    incremental_tree = processor.incremental_tree
+
+    fetched_tree = copy.deepcopy(raw_tree)
+    for step in range(20):
+        subtrees = dict(incremental_tree.subtrees)
+        content, obs_nodes_info = processor.serialize_accessibility_tree(
+            fetched_tree, bounds, CONFIG
+        )
+        (
+            expected_content,
+            expected_obs_nodes_info,
+        ) = TextObervationProcessor.build_compact_accessibility_tree(
+            raw_tree, bounds, CONFIG, current_viewport_only
+        ).serialize()
+        assert content == expected_content
+        assert list(obs_nodes_info) == list(expected_obs_nodes_info)
+        assert dict(obs_nodes_info) == dict(expected_obs_nodes_info)
+        if subtrees:
+            # the lines of most subtrees are reused
+            reused = [
+                node_id
+                for node_id, subtree in incremental_tree.subtrees.items()
+                if subtrees.get(node_id) is subtree
+            ]
+            assert len(reused) > len(incremental_tree.subtrees) / 2
+        if step % 2:
+            mutate_accessibility_tree(rng, raw_tree, bounds)
+            fetched_tree = copy.deepcopy(raw_tree)
+        else:
+            # the same tree, e.g., after a scroll
+            node_id = rng.choice(list(bounds))
+            bounds[node_id] = [0.0, 0.0, 100.0, 100.0]
+
+
+class FakeFrameCDPSession:
+    """A page with an iframe, which contains another iframe"""
+
+    frame_trees: dict[str, list[dict[str, Any]]] = {
+        "main": [
+            ax_node(1, "RootWebArea", "Shop", [2, 3]),
+            ax_node(2, "link", "Home", []),
+            ax_node(3, "Iframe", "", [], parentId="1"),
+        ],
+        "editor": [
+            ax_node(1, "RootWebArea", "Editor", [2], backendDOMNodeId=10),
+            ax_node(2, "Iframe", "", [], parentId="1", backendDOMNodeId=11),
+        ],
+        "preview": [
+            ax_node(1, "RootWebArea", "Preview", [2], backendDOMNodeId=20),
+            ax_node(
+                2, "button", "Save", [], parentId="1", backendDOMNodeId=21
+            ),
+        ],
+    }
+    frame_owners = {"editor": 3, "preview": 11}
+
+    def send(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        if method == "Page.getFrameTree":
+            return {
+                "frameTree": {
+                    "frame": {"id": "main"},
+                    "childFrames": [
+                        {
+                            "frame": {"id": "editor"},
+                            "childFrames": [{"frame": {"id": "preview"}}],
+                        },
+                        {"frame": {"id": "cross-origin"}},
+                    ],
+                }
+            }
+        frame_id = params.get("frameId", "main")
+        if frame_id not in self.frame_trees:
+            raise ValueError(f"No frame with given id found: {frame_id}")
+        if method == "Accessibility.getFullAXTree":
+            return {"nodes": copy.deepcopy(self.frame_trees[frame_id])}
+        if method == "DOM.getFrameOwner":
+            return {"backendNodeId": self.frame_owners[frame_id]}
+        raise ValueError(method)
+
+
+def test_frame_accessibility_tree() -> None:
+    processor = TextObervationProcessor(
+        "accessibility_tree", False, {"width": 1280, "height": 720}
+    )
+    client = FakeFrameCDPSession()
+    tree = processor.fetch_full_accessibility_tree(client)  # type: ignore[arg-type]
+    content, obs_nodes_info = CompactAccessibilityTree.from_cdp_nodes(
+        tree
+    ).serialize()
+    assert content == (
+        "[1] RootWebArea 'Shop'\n"
+        "\t[2] link 'Home'\n"
+        "\t[3] Iframe ''\n"
+        "\t\t[3000001] RootWebArea 'Editor'\n"
+        "\t\t\t[3000002] Iframe ''\n"
+        "\t\t\t\t[11000001] RootWebArea 'Preview'\n"
+        "\t\t\t\t\t[11000002] button 'Save'"
+    )
+    assert [node.get("frameOwnerIds") for node in tree] == [
+        None,
+        None,
+        None,
+        ["3"],
+        ["3"],
+        ["3", "11"],
+        ["3", "11"],
+    ]
+
+    # the nodes inside the iframes are shifted by the iframe positions
+    element_bounds = {
+        "2": [10.0, 10.0, 50.0, 20.0],
+        "3": [100.0, 200.0, 600.0, 400.0],
+        "11": [5.0, 50.0, 300.0, 200.0],
+        "21": [1.0, 2.0, 40.0, 20.0],
+    }
+    processor.fetch_bounds = (  # type: ignore[assignment]
+        lambda info, client, backend_node_ids: {
+            backend_node_id: element_bounds.get(backend_node_id)
+            for backend_node_id in backend_node_ids
+        }
+    )
+    bounds = processor.fetch_node_bounds(INFO, client, tree, ["2", "21"])  # type: ignore[arg-type]
+    assert bounds == {
+        "2": [10.0, 10.0, 50.0, 20.0],
+        "21": [106.0, 252.0, 40.0, 20.0],
+    }
+
+
+def test_frame_node_ids_are_stable() -> None:
+    client = FakeFrameCDPSession()
+    tree = TextObervationProcessor.fetch_full_accessibility_tree(client)  # type: ignore[arg-type]
+    # a node added to the page does not change the ids of the frames
+    client.frame_trees = {
+        **client.frame_trees,
+        "main": [
+            ax_node(1, "RootWebArea", "Shop", [2, 3, 40]),
+            ax_node(2, "link", "Home", []),
+            ax_node(3, "Iframe", "", [], parentId="1"),
+            ax_node(40, "link", "Cart", [], parentId="1"),
+        ],
+    }
+    new_tree = TextObervationProcessor.fetch_full_accessibility_tree(client)  # type: ignore[arg-type]
+    frame_node_ids = [
+        node["nodeId"] for node in tree if "frameOwnerIds" in node
+    ]
+    assert frame_node_ids == [
+        node["nodeId"] for node in new_tree if "frameOwnerIds" in node
+    ]
+    assert len(set(node["nodeId"] for node in new_tree)) == len(new_tree)
+
+
+def test_observation_cache_with_iframes() -> None:
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        False,
+        {"width": 1280, "height": 720},
+        cache_observation=True,
+    )
+    processor = handler.text_processor
+    processor.fetch_browser_info = (  # type: ignore[assignment]
+        lambda page, client, page_state: INFO
+    )
+    processor.fetch_bounds = (  # type: ignore[assignment]
+        lambda info, client, backend_node_ids: {
+            backend_node_id: [10.0, 10.0, 50.0, 20.0]
+            for backend_node_id in backend_node_ids
+        }
+    )
+    handler.image_processor.process = (  # type: ignore[assignment]
+        lambda page, client: np.zeros((720, 1280, 3), dtype=np.uint8)
+    )
+    page = FakePage()
+    client = FakeFrameCDPSession()
+
+    obs = handler.get_observation(page, client)  # type: ignore[arg-type]
+    assert "button 'Save'" in obs["text"]
+    # typed into the iframe, the DOM version of the page is the same
+    client.frame_trees = {
+        **client.frame_trees,
+        "preview": [
+            ax_node(1, "RootWebArea", "Preview", [2], backendDOMNodeId=20),
+            ax_node(
+                2, "button", "Saved", [], parentId="1", backendDOMNodeId=21
+            ),
+        ],
+    }
+    obs = handler.get_observation(page, client)  # type: ignore[arg-type]
+    assert "button 'Saved'" in obs["text"]
+    assert handler.observation_cache_stats == {
+        "hit": False,
+        "hits": 0,
+        "misses": 2,
+    }
@@ -0,0 +1,63 @@
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from browser_env import DetachedPage, create_stop_action
+from browser_env.helper_functions import (
+    HTML_HEAD,
+    HTML_TAIL,
+    RenderHelper,
+)
+from browser_env.media_store import MediaStore
+
+
+@pytest.mark.parametrize("media", [False, True])
+def test_render_helper(tmp_path: Path, media: bool) -> None:
+    config_file = tmp_path / "0.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": 0, "intent": "test"}, f)
+    (tmp_path / "renders").mkdir()
+    render_file = tmp_path / "renders" / "render_0.html"
+
+    media_store = MediaStore(tmp_path / "media") if media else None
+    render_helper = RenderHelper(
+        str(config_file), str(tmp_path), "id_accessibility_tree", media_store
+    )
+    for i in range(2):
+        state_info = {
+            "observation": {
+                "text": f"[{i}] RootWebArea",
+                "image": np.zeros((4, 4, 4), dtype=np.uint8),
+            },
+            "info": {
+                "page": DetachedPage(f"http://localhost/{i}", ""),
+                "observation_metadata": {"text": {"obs_nodes_info": {}}},
+            },
+        }
+        render_helper.render(
+            create_stop_action(""),
+            state_info,  # type: ignore[arg-type]
+            {"action_history": ["None"]},
+            render_screenshot=True,
+        )
+        # the steps can be read while the task runs
+        assert render_file.read_text().count("state_obv") == i + 1
+    render_helper.close()
+    render_helper.close()
+    if media_store is not None:
+        media_store.close()
+
+    html = render_file.read_text()
+    assert html.startswith(HTML_HEAD) and html.endswith(HTML_TAIL)
+    body = re.findall(r"<body>(.*?)</body>", html, re.DOTALL)[0]
+    assert body.strip().startswith("<pre>task_id: 0\nintent: test\n</pre>")
+    if media_store is not None:
+        # the same screenshot twice
+        srcs = re.findall(r"<img src='(.*?)'", body)
+        assert srcs == [srcs[0]] * 2 and srcs[0].startswith("../media/")
+        assert (render_file.parent / srcs[0]).exists()
+    else:
+        assert body.count("<img src='data:image/png;base64,") == 2
@@ -2,6 +2,7 @@ import asyncio
 import collections
 import json
 import tempfile
+import threading
 from typing import Callable, Dict, Optional, Tuple, Type, Union, cast
 
 import pytest
@@ -13,6 +14,7 @@ from browser_env import (
     AsyncScriptBrowserEnv,
     DetachedPage,
     ScriptBrowserEnv,
+    SharedBrowser,
     create_focus_and_click_action,
     create_goto_url_action,
     create_keyboard_type_action,
@@ -27,6 +29,8 @@ from browser_env.env_config import (
     SHOPPING,
     SHOPPING_ADMIN,
 )
+from browser_env.settle import get_settle_strategy
+from browser_env.shared_browser import SharedBrowserEnv
 
 
 def test_script_browser_env(script_browser_env: ScriptBrowserEnv) -> None:
@@ -276,3 +280,155 @@ def test_accessibility_tree_observation_update(
         )
     )
     assert "UNIQUE_NAME" in obs["text"]
+
+
+def test_persistent_browser() -> None:
+    env = ScriptBrowserEnv(persistent_browser=True)
+    env.reset()
+    env.step(create_goto_url_action("http://www.example.com"))
+    env.context.add_cookies(
+        [{"name": "foo", "value": "bar", "url": "http://www.example.com"}]
+    )
+    browser = env.browser
+    env.reset()
+    # same browser, fresh context
+    assert env.browser is browser
+    assert env.context.cookies() == []
+    assert env.browser_launches == 1
+    assert env.context_creations == 2
+    env.close()
+
+
+def test_page_state_dom_version(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    processor = env.observation_handler.text_processor
+    page_state = processor.fetch_page_state(env.page)
+    assert page_state["url"] == "https://russmaxdesign.github.io/exercise/"
+    # nothing happened on the page
+    assert processor.fetch_page_state(env.page) == page_state
+    env.step(
+        create_playwright_action(
+            'page.get_by_label("Full name").fill("UNIQUE_NAME")'
+        )
+    )
+    assert processor.fetch_page_state(env.page)["dom_version"] != (
+        page_state["dom_version"]
+    )
+
+
+def test_accessibility_tree_iframe(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    env.page.set_content(
+        '<button>Outside</button><iframe srcdoc="<button>Inside</button>">'
+        "</iframe>"
+    )
+    env.page.frames[1].wait_for_load_state()
+    env.observation_handler.expire_observation()
+    obs = env._get_obs()
+    assert "button 'Outside'" in obs["text"]
+    assert "button 'Inside'" in obs["text"]
+
+
+def test_bulk_bounds_long_text() -> None:
+    # CDP truncates the value of the text node of the script
+    env = ScriptBrowserEnv(
+        observation_type="accessibility_tree", bounds_mode="bulk"
+    )
+    env.reset()
+    env.page.set_content(
+        f"<script>var data = '{'x' * 20000}';</script>"
+        "<button>Save</button><a href='#'>Home</a>"
+    )
+    env.observation_handler.expire_observation()
+    obs = env._get_obs()
+    processor = env.observation_handler.text_processor
+    assert "button 'Save'" in obs["text"]
+    assert processor.bounds_cdp_calls == 2
+    env.close()
+
+
+def test_shared_browser() -> None:
+    async def run_episode(browser: SharedBrowser, text: str) -> str:
+        env = browser.new_env(
+            observation_type="accessibility_tree", sleep_after_execution=0.5
+        )
+        await env.reset()
+        obs, _, _, _, _ = await env.step(
+            create_goto_url_action(f"data:text/html,<button>{text}</button>")
+        )
+        await env.close()
+        return obs["text"]
+
+    async def _test() -> None:
+        browser = SharedBrowser()
+        await browser.start()
+        texts = await asyncio.gather(
+            run_episode(browser, "First"), run_episode(browser, "Second")
+        )
+        # closing an episode only closes its context
+        assert await browser.run(lambda: browser.browser.is_connected())
+        assert await browser.run(lambda: browser.browser.contexts) == []
+        await browser.close()
+        assert "button 'First'" in texts[0]
+        assert "button 'Second'" in texts[1]
+
+    asyncio.run(_test())
+
+
+def test_shared_browser_observation_thread() -> None:
+    threads: list[str] = []
+
+    class FakeEnv:
+        page = None
+        settle_strategy = get_settle_strategy("fixed", 0)
+
+        def act(self, action: Action) -> tuple[bool, str, float]:
+            threads.append(f"act {threading.current_thread().name}")
+            return True, "", 0.0
+
+        def fetch_step_observation(
+            self, success: bool, fail_error: str, action_time: float
+        ) -> Callable[
+            [], tuple[dict[str, str], float, bool, bool, dict[str, str]]
+        ]:
+            threads.append(f"fetch {threading.current_thread().name}")
+
+            def build() -> tuple[
+                dict[str, str], float, bool, bool, dict[str, str]
+            ]:
+                threads.append(f"build {threading.current_thread().name}")
+                return (
+                    {"text": "observation"},
+                    float(success),
+                    False,
+                    False,
+                    {},
+                )
+
+            return build
+
+    async def _test() -> None:
+        # the browser is not launched, only its thread is used
+        browser = SharedBrowser()
+        env = SharedBrowserEnv(browser, cast(ScriptBrowserEnv, FakeEnv()))
+        obs, *_ = await env.step(create_goto_url_action("about:blank"))
+        browser.executor.shutdown()
+        assert obs["text"] == "observation"
+
+    asyncio.run(_test())
+    # the observation is built without holding the browser thread
+    assert threads[0].startswith("act browser")
+    assert threads[1].startswith("fetch browser")
+    assert threads[2].startswith("build ")
+    assert not threads[2].startswith("build browser")
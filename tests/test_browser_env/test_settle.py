@@ -0,0 +1,117 @@
+import asyncio
+from typing import Any, Callable
+
+import pytest
+
+from browser_env.settle import (
+    AdaptiveSettle,
+    FixedSleepSettle,
+    NetworkTracker,
+    get_settle_strategy,
+)
+
+
+class FakePage:
+    def __init__(self, dom_quiet_ms: list[float]) -> None:
+        self.dom_quiet_ms = dom_quiet_ms
+        self.handlers: dict[str, list] = {}
+        self.timeouts: list[float] = []
+
+    def on(self, event: str, handler) -> None:  # type: ignore[no-untyped-def]
+        self.handlers.setdefault(event, []).append(handler)
+
+    def remove_listener(self, event: str, handler) -> None:  # type: ignore[no-untyped-def]
+        self.handlers[event].remove(handler)
+
+    def emit(self, event: str, arg: object) -> None:
+        for handler in list(self.handlers.get(event, [])):
+            handler(arg)
+
+    def evaluate(self, expression: str) -> float:
+        if "readyState" in expression:
+            return True
+        if len(self.dom_quiet_ms) > 1:
+            return self.dom_quiet_ms.pop(0)
+        return self.dom_quiet_ms[0]
+
+    def wait_for_load_state(self, state: str, timeout: float) -> None:
+        pass
+
+    def wait_for_timeout(self, timeout: float) -> None:
+        self.timeouts.append(timeout)
+
+
+class FakeRequest:
+    resource_type = "xhr"
+
+
+def test_get_settle_strategy() -> None:
+    assert isinstance(get_settle_strategy("fixed", 0.0), FixedSleepSettle)
+    assert isinstance(get_settle_strategy("adaptive", 1.0), AdaptiveSettle)
+    with pytest.raises(ValueError):
+        get_settle_strategy("unknown", 1.0)
+    assert get_settle_strategy("fixed", 0.0).wait(FakePage([0])) == 0.0  # type: ignore[arg-type]
+
+
+def test_network_tracker() -> None:
+    page = FakePage([0])
+    tracker = NetworkTracker(page)  # type: ignore[arg-type]
+    request = FakeRequest()
+    page.emit("request", request)
+    assert tracker.quiet_time() == 0.0
+    page.emit("requestfinished", request)
+    assert tracker.inflight == {}
+    assert tracker.quiet_time() >= 0.0
+
+
+def test_adaptive_settle_stops_early() -> None:
+    # the DOM keeps changing for two polls, then becomes quiet
+    page = FakePage([0, 50, 1000])
+    strategy = AdaptiveSettle(max_wait=10.0)
+    strategy.before_action(page)  # type: ignore[arg-type]
+    waited = strategy.wait(page)  # type: ignore[arg-type]
+    assert waited < 10.0
+    assert len(page.timeouts) > 0
+
+
+def test_release_detaches_listeners() -> None:
+    page = FakePage([1000])
+    strategy = AdaptiveSettle(max_wait=10.0)
+    strategy.before_action(page)  # type: ignore[arg-type]
+    strategy.wait(page)  # type: ignore[arg-type]
+    assert any(page.handlers.values())
+    strategy.release(page)  # type: ignore[arg-type]
+    assert not any(page.handlers.values())
+    assert strategy.trackers == {}
+
+    # a closed page is released as well
+    strategy.before_action(page)  # type: ignore[arg-type]
+    page.emit("close", page)
+    assert not any(page.handlers.values())
+    assert strategy.trackers == {}
+
+
+async def run_on_browser_thread(
+    function: Callable[..., Any], *args: Any
+) -> Any:
+    return function(*args)
+
+
+def test_adaptive_settle_async() -> None:
+    page = FakePage([0, 50, 1000])
+    strategy = AdaptiveSettle(max_wait=10.0)
+    strategy.before_action(page)  # type: ignore[arg-type]
+    waited = asyncio.run(
+        strategy.wait_async(page, run_on_browser_thread)  # type: ignore[arg-type]
+    )
+    assert waited < 10.0
+    # the waits do not block the browser thread
+    assert page.timeouts == []
+
+
+def test_fixed_settle_async() -> None:
+    strategy = FixedSleepSettle(max_wait=0.01)
+    waited = asyncio.run(
+        strategy.wait_async(FakePage([0]), run_on_browser_thread)  # type: ignore[arg-type]
+    )
+    assert waited == 0.01
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from browser_env import TrajectoryLog, read_trajectory_log
+from browser_env.trajectory_log import export_history
+
+
+def test_trajectory_log(tmp_path: Path) -> None:
+    log = TrajectoryLog(tmp_path / "1.jsonl", flush_every=3)
+    log.start_task(0)
+    log.add_step(0, {"url": "a", "coords": np.array([0.5, 0.5])})
+    # batched
+    assert (tmp_path / "1.jsonl").read_text() == ""
+    log.add_step(0, {"url": "b"})
+    assert len((tmp_path / "1.jsonl").read_text().splitlines()) == 3
+    log.add_result(0, 1.0)
+    # the first attempt of the task is replaced by the second one
+    log.start_task(1)
+    log.add_step(1, {"url": "c"})
+    log.start_task(1)
+    log.add_step(1, {"url": "d"})
+    log.close()
+
+    assert read_trajectory_log(tmp_path / "1.jsonl") == {
+        "0": [
+            {"url": "a", "coords": [0.5, 0.5]},
+            {"url": "b"},
+            {"score": 1.0},
+        ],
+        "1": [{"url": "d"}],
+    }
+
+
+def test_trajectory_log_folder(tmp_path: Path) -> None:
+    log_folder = tmp_path / "trajectories"
+    # a worker was killed in the middle of the task, and the task was
+    # retried by another worker
+    log = TrajectoryLog(log_folder / "2.jsonl")
+    log.start_task(0)
+    log.add_step(0, {"url": "b"})
+    log.add_result(0, 0.0)
+    log.close()
+    with open(log_folder / "1.jsonl", "w") as f:
+        f.write(json.dumps({"task_id": 0, "event": "start", "time": 0.0}))
+        f.write('\n{"task_id": 0, "event": "st')
+
+    assert read_trajectory_log(log_folder) == {
+        "0": [{"url": "b"}, {"score": 0.0}]
+    }
+    export_history(tmp_path)
+    with open(tmp_path / "0.json") as f:
+        assert json.load(f) == [{"url": "b"}, {"score": 0.0}]
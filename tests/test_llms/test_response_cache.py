@@ -0,0 +1,133 @@
+from pathlib import Path
+
+import pytest
+
+from llms.lm_config import LMConfig
+from llms.response_cache import ResponseCache, ResponseCacheMiss
+
+CONFIG = LMConfig(
+    provider="openai", model="gpt-4", mode="chat", gen_config={"top_p": 0.9}
+)
+
+
+class FakeModel:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        return f"response {self.calls}"
+
+
+def test_occurrence_keys(tmp_path: Path) -> None:
+    cache = ResponseCache(tmp_path / "cache.db", "read_through")
+    first = cache.get_key(CONFIG, "prompt")
+    second = cache.get_key(CONFIG, "prompt")
+    other = cache.get_key(CONFIG, "other prompt")
+    assert first != second
+    assert first.split(":")[0] == second.split(":")[0]
+    assert (first.split(":")[1], second.split(":")[1]) == ("0", "1")
+    assert other.endswith(":0")
+    # the generation config is part of the request
+    config = LMConfig(provider="openai", model="gpt-4", mode="chat")
+    assert cache.get_key(config, "prompt").split(":")[0] != first.split(":")[0]
+
+
+def test_invalid_mode(tmp_path: Path) -> None:
+    for mode in ["off", "write"]:
+        with pytest.raises(ValueError):
+            ResponseCache(tmp_path / "cache.db", mode)
+
+
+def test_read_through(tmp_path: Path) -> None:
+    model = FakeModel()
+    cache = ResponseCache(tmp_path / "cache.db", "read_through")
+    # the retries of a prompt are different requests
+    assert cache.call(CONFIG, "prompt", model) == "response 1"
+    assert cache.call(CONFIG, "prompt", model) == "response 2"
+    assert model.calls == 2
+    assert cache.stats["misses"] == 2
+
+    # the next run replays the recorded retries
+    cache = ResponseCache(tmp_path / "cache.db", "read_through")
+    assert cache.call(CONFIG, "prompt", model) == "response 1"
+    assert cache.call(CONFIG, "prompt", model) == "response 2"
+    assert cache.call(CONFIG, "prompt", model) == "response 3"
+    assert model.calls == 3
+    assert cache.stats == {
+        "mode": "read_through",
+        "hits": 2,
+        "misses": 1,
+        "hit_rate": 2 / 3,
+    }
+
+
+def test_record(tmp_path: Path) -> None:
+    model = FakeModel()
+    cache = ResponseCache(tmp_path / "cache.db", "read_through")
+    cache.call(CONFIG, "prompt", model)
+    # always calls the model and overwrites the response
+    cache = ResponseCache(tmp_path / "cache.db", "record")
+    assert cache.call(CONFIG, "prompt", model) == "response 2"
+    assert model.calls == 2
+    assert cache.stats["hits"] == cache.stats["misses"] == 0
+    cache = ResponseCache(tmp_path / "cache.db", "replay")
+    assert cache.call(CONFIG, "prompt", model) == "response 2"
+
+
+def test_replay(tmp_path: Path) -> None:
+    model = FakeModel()
+    cache = ResponseCache(tmp_path / "cache.db", "record")
+    cache.call(CONFIG, "prompt", model)
+    cache.close()
+
+    # persisted across reopen, the model is never called
+    cache = ResponseCache(tmp_path / "cache.db", "replay")
+    assert cache.call(CONFIG, "prompt", model) == "response 1"
+    with pytest.raises(ResponseCacheMiss):
+        cache.call(CONFIG, "prompt", model)
+    with pytest.raises(ResponseCacheMiss):
+        cache.call(CONFIG, "other prompt", model)
+    assert model.calls == 1
+    # nothing is stored on a miss
+    assert cache.lookup(cache.get_key(CONFIG, "other prompt")) is None
+
+
+def test_eviction(tmp_path: Path) -> None:
+    model = FakeModel()
+    # "response n" is 10 bytes, room for two responses
+    cache = ResponseCache(tmp_path / "cache.db", "read_through", max_size=25)
+    cache.call(CONFIG, "a", model)
+    cache.call(CONFIG, "b", model)
+    cache.close()
+    cache = ResponseCache(tmp_path / "cache.db", "read_through", max_size=25)
+    # "a" is used more recently than "b"
+    assert cache.call(CONFIG, "a", model) == "response 1"
+    assert cache.call(CONFIG, "c", model) == "response 3"
+    cache.close()
+
+    cache = ResponseCache(tmp_path / "cache.db", "replay", max_size=25)
+    assert cache.call(CONFIG, "a", model) == "response 1"
+    assert cache.call(CONFIG, "c", model) == "response 3"
+    with pytest.raises(ResponseCacheMiss):
+        cache.call(CONFIG, "b", model)
+
+
+def test_total_size(tmp_path: Path) -> None:
+    model = FakeModel()
+    cache = ResponseCache(tmp_path / "cache.db", "read_through", max_size=25)
+    assert cache.total_size == 0
+    cache.call(CONFIG, "a", model)
+    cache.store(cache.get_key(CONFIG, "b"), CONFIG, "short")
+    assert cache.total_size == 10 + 5
+    # a replaced response only counts once
+    cache.store(f"{cache.get_request_hash(CONFIG, 'b')}:0", CONFIG, "longer")
+    assert cache.total_size == 10 + 6
+    cache.call(CONFIG, "c", model)
+    assert cache.total_size == 6 + 10
+    # the caches without the total are summed when they are opened
+    cache.conn.execute("DROP TABLE meta")
+    cache.conn.commit()
+    cache.close()
+    cache = ResponseCache(tmp_path / "cache.db", "read_through", max_size=25)
+    assert cache.total_size == 16
@@ -0,0 +1,71 @@
+from typing import Any
+
+import pytest
+
+from llms import tokenizers
+from llms.tokenizers import Tokenizer
+
+OBSERVATION = """Tab 0 (current): One Stop Market
+
+[1] RootWebArea 'One Stop Market' focused: True
+\t[5] link 'My Account'
+\t[6] StaticText 'Welcome to the store, here is a long paragraph'
+\t[7] button 'Search'
+\t[8] textbox 'Search' required: False"""
+
+
+class FakeEncoding:
+    """One token per character"""
+
+    def __init__(self) -> None:
+        self.encoded: list[str] = []
+
+    def encode(self, text: str) -> list[int]:
+        self.encoded.append(text)
+        return [ord(c) for c in text]
+
+
+def test_count_tokens() -> None:
+    tokenizer = Tokenizer("openai", "gpt-3.5-turbo")
+    for text in ["", "[5] link 'My Account'", "a\n", OBSERVATION]:
+        expected = len(tokenizer.encode(text))
+        num_lines = len(text.splitlines())
+        # the tokens can merge across the lines either way
+        assert abs(tokenizer.count_tokens(text) - expected) <= num_lines
+        # from the cache
+        assert abs(tokenizer.count_tokens(text) - expected) <= num_lines
+    # a single line is encoded as is
+    line = "\t[7] button 'Search'"
+    assert tokenizer.count_tokens(line) == len(tokenizer.encode(line))
+
+
+def test_encode_chunk_lru(monkeypatch: pytest.MonkeyPatch) -> None:
+    encoding = FakeEncoding()
+
+    def encoding_for_model(model_name: str) -> Any:
+        return encoding
+
+    monkeypatch.setattr(
+        tokenizers.tiktoken, "encoding_for_model", encoding_for_model
+    )
+    tokenizer = Tokenizer("openai", "gpt-3.5-turbo", cache_size=2)
+    assert tokenizer.encode_chunk("a") == [ord("a")]
+    tokenizer.encode_chunk("b")
+    # "a" is now more recently used than "b"
+    tokenizer.encode_chunk("a")
+    tokenizer.encode_chunk("c")
+    assert list(tokenizer.cache) == ["a", "c"]
+    assert encoding.encoded == ["a", "b", "c"]
+    # "b" was evicted
+    tokenizer.encode_chunk("b")
+    assert encoding.encoded == ["a", "b", "c", "b"]
+    assert list(tokenizer.cache) == ["c", "b"]
+    assert tokenizer.cache_stats == {
+        "hits": 1,
+        "misses": 4,
+        "hit_rate": 0.2,
+        "size": 2,
+    }
+    # the lines of the text are the chunks
+    assert tokenizer.count_tokens("b\nc\n") == 4
+    assert tokenizer.cache_stats["misses"] == 6
@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from browser_env import (
+    Action,
+    ActionParsingError,
+    ActionTypes,
+    DetachedPage,
+    Trajectory,
+    create_none_action,
+    create_stop_action,
+)
+
+# run.py is a script at the root of the repo
+sys.path.insert(0, str(Path(__file__).parents[1]))
+import run  # noqa: E402  # isort: skip
+
+
+class FakePromptConstructor:
+    obs_modality = "text"
+
+    def extract_action(self, response: str) -> str:
+        if response == "unparsable":
+            raise ActionParsingError("Cannot parse the action")
+        return response
+
+
+class FakeAgent:
+    prompt_constructor = FakePromptConstructor()
+
+    def reset(self, config_file: str) -> None:
+        pass
+
+    def next_action(
+        self, trajectory: Trajectory, intent: str, meta_data: Any
+    ) -> Action:
+        return create_stop_action("done")
+
+
+class FakeTextProcessor:
+    ax_tree_cache_stats = {"hits": 2, "misses": 1, "mismatches": 1}
+
+
+class FakeObservationHandler:
+    text_processor = FakeTextProcessor()
+
+
+class FakeEnv:
+    def __init__(self) -> None:
+        self.page = DetachedPage("http://localhost", "")
+        self.observation_handler = FakeObservationHandler()
+        self.closed = False
+        self.events: list[str] = []
+
+    def get_browser(self) -> None:
+        return None
+
+    def reset(
+        self, options: dict[str, str]
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        self.events.append(f"reset {options['config_file']}")
+        return {"text": "obs"}, {
+            "page": self.page,
+            "observation_metadata": {},
+        }
+
+    def get_page_client(self, page: DetachedPage) -> None:
+        return None
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeRenderHelper:
+    def __init__(self, *args: Any) -> None:
+        pass
+
+    def render(self, *args: Any) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeLoginService:
+    stats = {"reuses": 0, "renewals": 0}
+
+    def __init__(self) -> None:
+        self.invalidated: list[list[str]] = []
+
+    def invalidate(self, comb: list[str]) -> None:
+        self.invalidated.append(comb)
+
+
+@pytest.fixture
+def driver_args(tmp_path: Path) -> argparse.Namespace:
+    return argparse.Namespace(
+        max_steps=5,
+        parsing_failure_th=3,
+        repeating_action_failure_th=3,
+        render_screenshot=False,
+        save_trace_enabled=False,
+        media_format="inline",
+        result_dir=str(tmp_path),
+        action_set_tag="id_accessibility_tree",
+        settle_strategy="fixed",
+    )
+
+
+@pytest.mark.parametrize("login_service", [None, FakeLoginService()])
+def test_async_driver_teardown(
+    driver_args: argparse.Namespace,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+    login_service: FakeLoginService | None,
+) -> None:
+    env = FakeEnv()
+    monkeypatch.setattr(run, "construct_env", lambda args: env)
+    monkeypatch.setattr(
+        run, "construct_login_service", lambda args, get_browser: login_service
+    )
+
+    def prepare_task(
+        config_file: str, login_service: FakeLoginService | None
+    ) -> tuple[str, str, int]:
+        env.events.append(f"prepare {config_file}")
+        return config_file, "intent", 0
+
+    monkeypatch.setattr(run, "prepare_task", prepare_task)
+    monkeypatch.setattr(run, "RenderHelper", FakeRenderHelper)
+    monkeypatch.setattr(
+        run, "get_action_description", lambda *args, **kwargs: "stop"
+    )
+    monkeypatch.setattr(
+        run,
+        "evaluator_router",
+        lambda config_file, settle_strategy: lambda **kwargs: 1.0,
+    )
+
+    with caplog.at_level(logging.INFO, logger="logger"):
+        asyncio.run(
+            run.test_async(
+                driver_args, FakeAgent(), ["0.json", "1.json"]  # type: ignore[arg-type]
+            )
+        )
+    # the browser thread was still running when the environment closed
+    assert env.closed
+    # the next task is prepared (and logged in) after the reset
+    assert env.events == [
+        "prepare 0.json",
+        "reset 0.json",
+        "prepare 1.json",
+        "reset 1.json",
+    ]
+    assert "Average score: 1.0" in caplog.text
+    assert (
+        "Accessibility tree cache: {'hits': 2, 'misses': 1, 'mismatches': 1}"
+        in caplog.text
+    )
+    assert "[Unhandled Error]" not in caplog.text
+
+
+class ScriptedEpisode:
+    """Sync episode whose model answers from `answers`, an exception is
+    raised by the model"""
+
+    def __init__(self, answers: list[Action | Exception]) -> None:
+        self.answers = answers
+        self.steps: list[Action] = []
+        self.sleeps = 0
+
+    def next_action(
+        self, trajectory: Trajectory, intent: str, meta_data: Any
+    ) -> Action:
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def render(self, *args: Any) -> None:
+        pass
+
+    def step(
+        self, action: Action
+    ) -> tuple[dict[str, Any], float, bool, bool, dict[str, Any]]:
+        self.steps.append(action)
+        return (
+            {"text": "obs"},
+            1.0,
+            False,
+            False,
+            {
+                "page": DetachedPage("http://localhost", ""),
+                "observation_metadata": {},
+                "timings": {"action": 0.0},
+            },
+        )
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps += 1
+
+
+def test_episode_steps(
+    driver_args: argparse.Namespace,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    monkeypatch.setattr(
+        run, "get_action_description", lambda *args, **kwargs: "none"
+    )
+    unparsable = create_none_action()
+    unparsable["raw_prediction"] = "unparsable"
+    episode = ScriptedEpisode(
+        [unparsable, create_none_action(), ValueError("No answer")]
+    )
+    state_info = {
+        "observation": {"text": "obs"},
+        "info": {
+            "page": DetachedPage("http://localhost", ""),
+            "observation_metadata": {},
+        },
+    }
+    with caplog.at_level(logging.INFO, logger="logger"):
+        trajectory = run.run_steps(
+            run.episode_steps(
+                driver_args,
+                FakeAgent(),  # type: ignore[arg-type]
+                "intent",
+                0,
+                state_info,  # type: ignore[arg-type]
+            ),
+            episode,  # type: ignore[arg-type]
+        )
+    # the unparsable action is retried, the error of the model stops
+    assert episode.sleeps == 1
+    assert len(episode.steps) == 1
+    assert len(trajectory) == 4
+    assert trajectory[-1]["action_type"] == ActionTypes.STOP  # type: ignore[typeddict-item]
+    assert trajectory[-1]["answer"] == "ERROR: No answer"  # type: ignore[typeddict-item]
+    # the recovered parsing error does not mark the task as failed
+    assert "[Parsing Error] Cannot parse the action" in caplog.text
+    assert "[Unhandled Error]" not in caplog.text
+    assert not (Path(driver_args.result_dir) / "error.txt").exists()
+
+
+def stub_worker(args: argparse.Namespace, conn: Connection) -> None:
+    """Worker of `test_pool` whose behavior is given by the task name"""
+    while (config_file := conn.recv()) is not None:
+        with open(Path(args.result_dir) / "runs.txt", "a") as f:
+            f.write(config_file + "\n")
+        task = run.get_task_id(config_file)
+        if task.startswith("hang"):
+            time.sleep(60)
+        elif task.startswith("crash"):
+            os._exit(1)
+        elif task.startswith("error"):
+            conn.send((config_file, None, "Error"))
+        else:
+            conn.send((config_file, 1.0, ""))
+
+
+def get_runs(result_dir: str) -> list[str]:
+    with open(Path(result_dir) / "runs.txt") as f:
+        return f.read().split()
+
+
+@pytest.fixture
+def pool_args(tmp_path: Path) -> argparse.Namespace:
+    return argparse.Namespace(
+        concurrency=2,
+        max_task_retries=2,
+        task_timeout=60.0,
+        result_dir=str(tmp_path),
+    )
+
+
+@pytest.mark.parametrize("logged_out", [False, True])
+def test_check_logged_out(
+    driver_args: argparse.Namespace, tmp_path: Path, logged_out: bool
+) -> None:
+    config_file = tmp_path / "3.json"
+    with open(config_file, "w") as f:
+        json.dump({"storage_state": "./.auth/gitlab.reddit_state.json"}, f)
+    (tmp_path / "renders").mkdir()
+    with open(tmp_path / "renders" / "render_3.html", "w") as f:
+        f.write(run.LOGGED_OUT_MARKERS[0] if logged_out else "Dashboard")
+    login_service = FakeLoginService()
+    assert (
+        run.check_logged_out(driver_args, str(config_file), login_service)  # type: ignore[arg-type]
+        == logged_out
+    )
+    # the sites of the task are probed before their state is reused
+    expected = [["gitlab", "reddit"]] if logged_out else []
+    assert login_service.invalidated == expected
+
+
+def test_task_manifest(tmp_path: Path) -> None:
+    path = tmp_path / "manifest.jsonl"
+    manifest = run.TaskManifest(path)
+    assert manifest.records == {}
+    manifest.add("config_files/0.json", "failed", error="Error")
+    manifest.add("config_files/1.json", "done", score=1.0)
+    assert manifest.completed == {"1"}
+    # a failed task that is run again
+    manifest.add("config_files/0.json", "done", score=0.0)
+    assert manifest.completed == {"0", "1"}
+
+    # the last record of a task wins when the manifest is read back
+    manifest = run.TaskManifest(path)
+    assert manifest.completed == {"0", "1"}
+    assert manifest.records["0"]["score"] == 0.0
+    with open(path) as f:
+        assert len(f.readlines()) == 3
+
+
+def test_pool_resume(pool_args: argparse.Namespace) -> None:
+    manifest = run.TaskManifest(Path(pool_args.result_dir) / "manifest.jsonl")
+    manifest.add("0.json", "done", score=1.0)
+    manifest.add("1.json", "failed", error="Error")
+
+    run.test_pool(pool_args, ["0.json", "1.json", "2.json"], stub_worker)
+    assert sorted(get_runs(pool_args.result_dir)) == ["1.json", "2.json"]
+    manifest = run.TaskManifest(Path(pool_args.result_dir) / "manifest.jsonl")
+    assert manifest.completed == {"0", "1", "2"}
+
+    # nothing is left to run
+    os.remove(Path(pool_args.result_dir) / "runs.txt")
+    run.test_pool(pool_args, ["0.json", "1.json", "2.json"], stub_worker)
+    assert not (Path(pool_args.result_dir) / "runs.txt").exists()
+
+
+@pytest.mark.parametrize("task", ["error", "crash"])
+def test_pool_retry(pool_args: argparse.Namespace, task: str) -> None:
+    run.test_pool(pool_args, [f"{task}.json", "0.json"], stub_worker)
+    runs = get_runs(pool_args.result_dir)
+    assert runs.count(f"{task}.json") == pool_args.max_task_retries + 1
+    assert runs.count("0.json") == 1
+
+    manifest = run.TaskManifest(Path(pool_args.result_dir) / "manifest.jsonl")
+    assert manifest.completed == {"0"}
+    record = manifest.records[task]
+    assert record["status"] == "failed"
+    assert record["attempts"] == pool_args.max_task_retries + 1
+
+
+def test_pool_timeout(pool_args: argparse.Namespace) -> None:
+    pool_args.max_task_retries = 1
+    pool_args.task_timeout = 0.5
+    start_time = time.monotonic()
+    run.test_pool(pool_args, ["hang.json", "0.json", "1.json"], stub_worker)
+    assert time.monotonic() - start_time < 30
+
+    runs = get_runs(pool_args.result_dir)
+    assert runs.count("hang.json") == 2
+    manifest = run.TaskManifest(Path(pool_args.result_dir) / "manifest.jsonl")
+    assert manifest.completed == {"0", "1"}
+    assert manifest.records["hang"] == {
+        "task_id": "hang",
+        "config_file": "hang.json",
+        "status": "failed",
+        "error": "Timeout",
+        "attempts": 2,
+    }